@@ -0,0 +1,162 @@
+"""Batch mode: one karm command for many storages and accounts
+
+Manifest is a text file with a job per line:
+
+    <url> <user> <storage> [<password>]
+
+Fields are split the way shell does it, so paths with spaces could be
+quoted. Empty lines and lines starting with # are skipped. Password
+given on the command line is used for jobs without one.
+
+Jobs are run by a pool of worker processes. Each worker is forked once
+with everything already imported and runs many jobs, so the jobs don't
+pay for interpreter startup and imports, and the jobs of the same
+basecamp account reuse worker's open connections. Output of each job
+is captured and printed as a whole when it's finished, failure of the
+job (including SystemExit) doesn't affect the others. Jobs have empty
+standard input, so the one which asks a question fails instead of
+waiting for the answer.
+"""
+import sys
+import time
+import shlex
+import traceback
+from itertools import imap
+from StringIO import StringIO
+
+from errors import KArmError
+
+class Job(object):
+    """Job of the manifest
+    """
+
+    def __init__(self, index, url, user, storage, password=None):
+        self.index = index
+        self.url = url
+        self.user = user
+        self.storage = storage
+        self.password = password
+
+    def arguments(self, password=None):
+        """Return global options of the job for karm command line
+        """
+        password = self.password or password
+        if password is None:
+            raise KArmError, 'No password for job %d (%s at %s)' % (
+                self.index, self.user, self.url)
+        return ['--url=' + self.url, '--user=' + self.user,
+                '--password=' + password, '--storage=' + self.storage]
+
+    def __str__(self):
+        return '%s at %s, %s' % (self.user, self.url, self.storage)
+
+def readManifest(path):
+    """Return list of jobs of the manifest file
+    """
+    f = open(path, 'rb')
+    try:
+        lines = f.readlines()
+    finally:
+        f.close()
+    jobs = []
+    for number, line in enumerate(lines):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            fields = shlex.split(line)
+        except ValueError, e:
+            raise KArmError, 'Manifest %s, line %d: %s' % (path, number + 1,
+                                                         e)
+        if len(fields) not in (3, 4):
+            raise KArmError, 'Manifest %s, line %d: expected url, user, ' \
+                'storage and optional password' % (path, number + 1)
+        jobs.append(Job(len(jobs), *fields))
+    return jobs
+
+def runJob(function, index, argv):
+    """Run function(argv) capturing it's output, return (index, status,
+    seconds, output)
+
+    status is 'ok' or 'failed', output of failed job ends with the
+    error.
+    """
+    stdin, stdout, stderr = sys.stdin, sys.stdout, sys.stderr
+    output = StringIO()
+    sys.stdin = StringIO()
+    sys.stdout = sys.stderr = output
+    start = time.time()
+    status = 'ok'
+    try:
+        try:
+            function(argv)
+        except SystemExit, e:
+            if e.code:
+                status = 'failed'
+                if not isinstance(e.code, int):
+                    print e.code
+        except KeyboardInterrupt:
+            raise
+        except:
+            status = 'failed'
+            traceback.print_exc(file=output)
+    finally:
+        sys.stdin, sys.stdout, sys.stderr = stdin, stdout, stderr
+    return index, status, time.time() - start, output.getvalue()
+
+def _runJob(args):
+    # module level function, so that pool could pass it to workers
+    return runJob(*args)
+
+def runBatch(function, jobs, options, command, password=None, processes=4,
+             report=None):
+    """Run function(argv) for every job in a pool of processes, return
+    list of (job, status, seconds) in the order of jobs
+
+    argv is made of global options, job's global options and command
+    with it's options. report(job, status, seconds, output) is called
+    as soon as the job is finished.
+    """
+    tasks = [(function, job.index,
+              options + job.arguments(password) + command)
+             for job in jobs]
+    results = [None] * len(jobs)
+    pool = None
+    finished = imap(_runJob, tasks)
+    if processes > 1 and len(jobs) > 1:
+        try:
+            from multiprocessing import Pool
+        except ImportError:
+            # python before 2.6, jobs are run one by one
+            pass
+        else:
+            pool = Pool(min(processes, len(jobs)))
+            finished = pool.imap_unordered(_runJob, tasks)
+    try:
+        for index, status, seconds, output in finished:
+            results[index] = (jobs[index], status, seconds)
+            if report is not None:
+                report(jobs[index], status, seconds, output)
+    except KeyboardInterrupt:
+        if pool is not None:
+            pool.terminate()
+        raise
+    if pool is not None:
+        pool.close()
+        pool.join()
+    return results
+
+def summary(results, elapsed):
+    """Return text table of job results
+    """
+    lines = ['%-6s %8s  %s' % ('status', 'seconds', 'job')]
+    failed = 0
+    total = 0.0
+    for job, status, seconds in results:
+        lines.append('%-6s %8.3f  %s' % (status, seconds, job))
+        if status != 'ok':
+            failed += 1
+        total += seconds
+    lines.append('%d jobs, %d failed, %.3f seconds of jobs in %.3f '
+                 'seconds' % (len(results), failed, total, elapsed))
+    return '\n'.join(lines)
@@ -3,7 +3,17 @@
 
 Depends on cmdhelper package.
 Loads karm.commands entry points to retrieve available commmands.
+
+With --batch option the command is run for every job of the manifest
+(see batch module) instead of the given url, user and storage, without
+waiting for user's input.
+
+With --profile option JSON report of command's phase timings, basecamp
+calls and counters (see timing module) is written once command is
+finished.
 """
+import sys
+import time
 
 from cmdhelper import CMDHelper
 
@@ -20,6 +30,19 @@ class KArmUtility(CMDHelper):
         ('password=', 'p', "a password for the given user name"),
         ('storage=', 's', "a path to karm storage file"),
         ('debug', 'd', "print about what is going on during execution"),
+        ('pool-size=', None, "how many connections to basecamp could be "
+         "open at once (default 4)"),
+        ('timeout=', None, "timeout of basecamp requests in seconds"),
+        ('no-input', None, "never wait for user's input, time entries "
+         "get empty descriptions"),
+        ('batch=', 'B', "a path to manifest of url, user and storage "
+         "jobs to run the command for"),
+        ('jobs=', 'j', "how many batch jobs could run at once "
+         "(default 4)"),
+        ('profile=', None, "write JSON report of phase timings to the "
+         "given file ('-' for standard output)"),
+        ('profile-stats=', None, "write cProfile statistics to the given "
+         "file"),
     ] + CMDHelper.global_options
     
     required_options = ['url', 'user', 'password', 'storage']
@@ -33,9 +56,182 @@ class KArmUtility(CMDHelper):
         self.password = None
         self.storage = None
         self.debug = True
+        self.pool_size = 4
+        self.timeout = None
+        self.no_input = False
+        self.batch = None
+        self.jobs = 4
+        self.profile = None
+        self.profile_stats = None
+
+
+# global options handled by main itself
+MAIN_OPTIONS = {'--batch': 'batch', '-B': 'batch',
+                '--jobs': 'jobs', '-j': 'jobs',
+                '--password': 'password', '-p': 'password',
+                '--profile': 'profile', '--profile-stats': 'profile-stats'}
+
+def valueOptions():
+    """Return dict of long and short names of global options which take
+    a value
+    """
+    names = {}
+    for option in KArmUtility.global_options:
+        name, short = option[:2]
+        if name.endswith('='):
+            names['--' + name[:-1]] = True
+            if short:
+                names['-' + short] = True
+    return names
+
+def splitOptions(args):
+    """Return (main options, other global options, command with it's
+    options) of command line arguments
+    
+    Global options go before the command, main options are the ones
+    of MAIN_OPTIONS and their values are taken out of global options.
+    Values of options could be given as --name=value, --name value,
+    -nvalue and -n value, short flags could be grouped.
+    """
+    takesValue = valueOptions()
+    batch = {}
+    options = []
+    index = 0
+    def value(name, rest):
+        if rest:
+            return rest, index
+        if index >= len(args):
+            raise SystemExit, 'Option %s requires a value' % name
+        return args[index], index + 1
+    while index < len(args) and args[index].startswith('-') and \
+          args[index] != '-':
+        arg = args[index]
+        index += 1
+        if arg.startswith('--'):
+            name, rest = arg, None
+            if '=' in arg:
+                name, rest = arg.split('=', 1)
+            if takesValue.has_key(name):
+                rest, index = value(name, rest)
+            if MAIN_OPTIONS.has_key(name):
+                batch[MAIN_OPTIONS[name]] = rest
+            elif rest is None:
+                options.append(arg)
+            else:
+                options.append('%s=%s' % (name, rest))
+            continue
+        flags = ''
+        for position in range(1, len(arg)):
+            name = '-' + arg[position]
+            if not takesValue.has_key(name):
+                flags += arg[position]
+                continue
+            rest, index = value(name, arg[position + 1:])
+            if MAIN_OPTIONS.has_key(name):
+                batch[MAIN_OPTIONS[name]] = rest
+            else:
+                options.extend([name, rest])
+            break
+        if flags:
+            options.append('-' + flags)
+    return batch, options, args[index:]
+
+def runCommand(argv):
+    """Run karm with the given command line arguments
+    """
+    sys.argv = sys.argv[:1] + argv
+    app = KArmUtility(entry_point='karm.commands')
+    app.run()
+
+def runBatch(batch, options, command):
+    """Run command for every job of the manifest, return exit status
+    """
+    from basecamp.karm import batch as runner
+    from basecamp.karm.errors import KArmError
+    try:
+        jobs = runner.readManifest(batch['batch'])
+    except (KArmError, EnvironmentError), e:
+        raise SystemExit, 'Batch manifest can not be read: %s' % e
+    try:
+        processes = int(batch.get('jobs', 4))
+    except ValueError:
+        processes = 0
+    if processes < 1:
+        raise SystemExit, 'Number of jobs should be a positive integer'
+    # workers are forked with basecamp client already imported
+    try:
+        import basecamp.karm.transport
+        import basecamp.api
+    except ImportError:
+        pass
+
+    def report(job, status, seconds, output):
+        print '=== %s: %s in %.3f seconds' % (job, status, seconds)
+        if output:
+            sys.stdout.write(output)
+        sys.stdout.flush()
+
+    # nobody answers questions of jobs
+    options = options + ['--no-input']
+    start = time.time()
+    try:
+        results = runner.runBatch(runCommand, jobs, options, command,
+                                  batch.get('password'), processes, report)
+    except KArmError, e:
+        raise SystemExit, str(e)
+    print runner.summary(results, time.time() - start)
+    for job, status, seconds in results:
+        if status != 'ok':
+            return 1
+    return 0
+
+def runProfiled(argv, report, stats=None):
+    """Run karm with the given command line arguments and write JSON
+    report of it's phases to report path, cProfile statistics to stats
+    path if it's given
+    """
+    from basecamp.karm import timing
+    try:
+        import json
+    except ImportError:
+        import simplejson as json
 
+    profile = timing.activate()
+    profiler = None
+    if stats is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        runCommand(argv)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(stats)
+        timing.deactivate()
+        data = profile.report()
+        if report == '-':
+            f = sys.stdout
+        else:
+            f = open(report, 'wb')
+        try:
+            json.dump(data, f, indent=1, sort_keys=True,
+                      separators=(',', ': '))
+            f.write('\n')
+        finally:
+            if f is not sys.stdout:
+                f.close()
 
 def main():
+    batch, options, command = splitOptions(sys.argv[1:])
+    if batch.has_key('batch'):
+        if batch.has_key('profile') or batch.has_key('profile-stats'):
+            raise SystemExit, 'Batch jobs can not be profiled'
+        sys.exit(runBatch(batch, options, command))
+    if batch.has_key('profile') or batch.has_key('profile-stats'):
+        runProfiled(sys.argv[1:], batch.get('profile', '-'),
+                    batch.get('profile-stats'))
+        return
     app = KArmUtility(entry_point='karm.commands')
     app.run()
 
@@ -0,0 +1,116 @@
+"""On-disk cache of basecamp responses
+
+Every cached response is kept in its own file named after md5 of the
+request's url and credentials, together with ETag and Last-Modified
+validators of the response. Expired entries are revalidated with
+conditional request (If-None-Match, If-Modified-Since), and 304 answer
+is served from the cache (see transport.PooledHandler).
+
+Cache also remembers small values between runs, update command uses it
+to skip merging when neither basecamp data nor storage have changed.
+"""
+import os
+import time
+import tempfile
+import cPickle
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+DIRECTORY = os.path.join('~', '.karm', 'cache')
+# keys every cached response has
+ENTRY_KEYS = frozenset(('status', 'reason', 'headers', 'body', 'etag',
+                        'last_modified', 'fetched'))
+
+class ResponseCache(object):
+    """Responses cached in the directory
+
+    Entry is fresh for ttl seconds after it was fetched or revalidated,
+    fresh entries are served without requests to the server at all.
+    ttl 0 means every entry is revalidated.
+
+    Digests of response bodies served through the cache are collected
+    in served list, see signature method.
+    """
+
+    def __init__(self, directory=DIRECTORY, ttl=0):
+        self.directory = os.path.expanduser(directory)
+        self.ttl = ttl
+        self.served = []
+        if not os.path.isdir(self.directory):
+            # responses are private data of basecamp account
+            os.makedirs(self.directory, 0700)
+
+    def key(self, url, credentials=''):
+        return md5('%s\n%s' % (url, credentials)).hexdigest()
+
+    def _path(self, key, suffix):
+        return os.path.join(self.directory, key + suffix)
+
+    def _read(self, path):
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return None
+        try:
+            try:
+                return cPickle.load(f)
+            except Exception:
+                # broken or truncated entry is the same as missing one
+                return None
+        finally:
+            f.close()
+
+    def _write(self, path, value):
+        fd, temp = tempfile.mkstemp(dir=self.directory)
+        f = os.fdopen(fd, 'wb')
+        try:
+            try:
+                cPickle.dump(value, f, 2)
+            finally:
+                f.close()
+            os.rename(temp, path)
+        except:
+            os.remove(temp)
+            raise
+
+    def lookup(self, key):
+        """Return cached entry or None
+
+        Entry is a dict with status, reason, headers (list of header
+        lines), body, etag, last_modified and fetched keys, file of any
+        other value is taken as broken.
+        """
+        entry = self._read(self._path(key, '.response'))
+        if not isinstance(entry, dict) or not ENTRY_KEYS.issubset(entry):
+            return None
+        return entry
+
+    def store(self, key, entry):
+        entry['fetched'] = time.time()
+        self._write(self._path(key, '.response'), entry)
+
+    def isFresh(self, entry):
+        return time.time() - entry['fetched'] < self.ttl
+
+    def serve(self, entry):
+        """Record that entry is used as response
+        """
+        self.served.append(md5(entry['body']).hexdigest())
+
+    def signature(self):
+        """Return digest of all the responses served so far
+
+        Same signature means the same data was received from the server.
+        """
+        return md5(' '.join(self.served)).hexdigest()
+
+    def recall(self, name, default=None):
+        value = self._read(self._path(self.key(name), '.value'))
+        if value is None:
+            return default
+        return value
+
+    def remember(self, name, value):
+        self._write(self._path(self.key(name), '.value'), value)
@@ -15,19 +15,151 @@ Create time entries at basecamp's account in cases:
        it's content as a time entry comment
     4. Something else? Not yet ;)
 
+All the operations are planned first and written into outbox journal
+next to the storage, then they are submitted concurrently (see outbox
+module). If checkin is interrupted or some of the operations fail,
+the next checkin submits only the ones which are not done yet. Time
+entries and todo items which were sent, but basecamp didn't confirm
+them, are not sent again: they are reported, and once they are looked
+for in basecamp the next checkin takes them as done with --confirm-sent
+or sends them again with --resume-sent.
+
+With --plan nothing is submitted, the operations are written into JSON
+plan file, where descriptions of time entries could be filled in. Plan
+is submitted later with --apply without any questions. With --no-input
+global option (batch jobs always have it) descriptions are not asked
+and time entries get empty ones.
 """
 
+import os
 import time
+import threading
 
-from basecamp.api import Basecamp
-
-from basecamp.karm import patch
-from basecamp.karm import KArm
+from basecamp.karm import KArm, timing
+from basecamp.karm.errors import KArmError, NotFoundError
+from basecamp.karm.outbox import Outbox, Operation, Reference, execute
 from basecamp.karm.utils import prettyTime, bcTime, getSessionTime
 
 from cmdhelper.cmd import Command
 from cmdhelper.errors import CMDHelperArgError
 
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+TIME_ENTRY_METHODS = ('createTimeEntryForProject',
+                      'createTimeEntryForTodoItem')
+# methods of operations checkin makes, mapped to basecamp type of the
+# task operation is usually made for, tasks of different types may have
+# the same uid
+OPERATION_BCTYPES = {
+    'createTimeEntryForProject': u'project',
+    'createTimeEntryForTodoItem': u'todoitem',
+    'completeTodoItem': u'todoitem',
+    'createTodoItem': None,
+}
+
+def findTask(karm, method, uid):
+    """Find task of the storage operation of the given method is made
+    for, raise NotFoundError if there's no such
+    """
+    try:
+        return karm.find(uid, OPERATION_BCTYPES.get(method))
+    except NotFoundError:
+        return karm.find(uid)
+
+def writePlan(path, karm, operations):
+    """Write operations into JSON plan file
+    
+    Every operation is written with summary of it's task and with
+    minutes of session time for time entries. Descriptions of time
+    entries (and anything else) could be edited before plan is applied.
+    """
+    def value(value):
+        if isinstance(value, Reference):
+            return {'operation': value.id}
+        return value
+    records = []
+    for op in operations:
+        todo = findTask(karm, op.method, op.uid)
+        record = {
+            'id': op.id,
+            'method': op.method,
+            'uid': op.uid,
+            'summary': todo.summary,
+            'args': map(value, op.args),
+            'kw': dict([(name, value(arg)) for name, arg in op.kw.items()]),
+            'depends': op.depends,
+        }
+        if op.method in TIME_ENTRY_METHODS:
+            record['minutes'] = op.minutes
+        records.append(record)
+    f = open(path, 'wb')
+    try:
+        json.dump({'storage': os.path.abspath(karm.file),
+                   'operations': records}, f, indent=1, sort_keys=True,
+                  separators=(',', ': '))
+    finally:
+        f.close()
+
+def readPlan(path, karm):
+    """Return operations of JSON plan file
+    
+    Raise KArmError if the plan was made for another storage, has
+    operations of other methods than checkin makes (see
+    OPERATION_BCTYPES), or doesn't match the storage anymore: time
+    entry's session time has changed or task is gone.
+    """
+    def value(value):
+        if isinstance(value, dict):
+            return Reference(value['operation'])
+        return value
+    f = open(path, 'rb')
+    try:
+        try:
+            plan = json.load(f)
+        except ValueError, e:
+            raise KArmError, 'Plan file %s is broken: %s' % (path, e)
+    finally:
+        f.close()
+    storage = os.path.abspath(karm.file)
+    if isinstance(storage, str):
+        # json gives unicode path
+        storage = storage.decode('utf-8', 'replace')
+    operations = []
+    try:
+        if plan['storage'] != storage:
+            raise KArmError, 'Plan file %s was made for another storage: ' \
+                '%s' % (path, plan['storage'])
+        for record in plan['operations']:
+            if record['method'] not in OPERATION_BCTYPES:
+                raise KArmError, 'Plan file %s has unknown operation: %s' \
+                    % (path, record['method'])
+            uid = record['uid']
+            try:
+                todo = findTask(karm, record['method'], uid)
+            except NotFoundError:
+                raise KArmError, 'Task [%s] of the plan is not found' % uid
+            if record['method'] in TIME_ENTRY_METHODS and \
+               getSessionTime(todo) != record['minutes']:
+                raise KArmError, 'Session time of task <%s> [%s] has ' \
+                    'changed since the plan was made' % (todo.summary, uid)
+            operations.append(Operation(record['id'], str(record['method']),
+                uid, map(value, record['args']),
+                dict([(str(name), value(arg))
+                      for name, arg in record['kw'].items()]),
+                record['depends'], record.get('minutes')))
+    except (KeyError, TypeError), e:
+        raise KArmError, 'Plan file %s is broken: %s' % (path, e)
+    ids = dict([(op.id, True) for op in operations])
+    for op in operations:
+        for id in op.depends:
+            if not ids.has_key(id):
+                raise KArmError, 'Operation %d of the plan depends on ' \
+                    'missing operation %d' % (op.id, id)
+    return operations
+
 class CheckIn(Command):
 
     description = "KArm checkin command. Takes session time from " \
@@ -37,16 +169,48 @@ class CheckIn(Command):
     user_options = [
         ('date=', 'd', "date to use for each time entry "
          "(date format: year-mm-dd, e.g. '2009-02-14')"),
+        ('workers=', 'w', "number of concurrent requests to submit "
+         "time entries with (default 4)"),
+        ('plan=', None, "write plan of time entries to the given file "
+         "instead of submitting them"),
+        ('apply=', None, "submit time entries of the given plan file "
+         "without asking for their descriptions"),
+        ('confirm-sent', None, "take operations of interrupted checkin "
+         "which were sent, but not confirmed, as done, when basecamp has "
+         "them (default False)"),
+        ('resume-sent', None, "send operations of interrupted checkin "
+         "which were sent, but not confirmed, once again, when basecamp "
+         "doesn't have them (default False)"),
     ]
+
+    boolean_options = ['confirm-sent', 'resume-sent']
     
     def initialize_options(self):
         self.date = None
+        self.workers = 4
+        self.plan = None
+        self.apply = None
+        self.confirm_sent = False
+        self.resume_sent = False
 
     def finalize_options(self):
         super(CheckIn, self).finalize_options()
         # check format of the entered date
         if self.date is not None:
             self.checkDate(self.date)
+        try:
+            self.workers = int(self.workers)
+        except ValueError:
+            self.workers = 0
+        if self.workers < 1:
+            raise CMDHelperArgError, "Number of workers should be " \
+                "a positive integer"
+        if self.plan is not None and self.apply is not None:
+            raise CMDHelperArgError, "Plan could be either written or " \
+                "applied, not both at once"
+        if self.confirm_sent and self.resume_sent:
+            raise CMDHelperArgError, "Sent operations could be either " \
+                "confirmed or sent again, not both at once"
     
     def checkDate(self, date):
         """Raise error in case date is not in format: year-mm-dd
@@ -60,23 +224,31 @@ class CheckIn(Command):
                 "year-mm-dd, e.g. '2009-02-14'"
 
     def getUserId(self, bc):
+        span = timing.start('fetch')
         person = bc.getAuthenticatedPerson()
+        span.stop()
         if person is not None:
             return person.id
         else:
             raise Exception, "Could not retrieve logged in person"
 
-    def run(self):
+    def collect(self, karm, userId=None, ask=True):
+        """Return list of operations to be submitted to basecamp
 
-        karm = KArm()
-        karm.load(self.storage)
-        bc = Basecamp(self.url, self.user, self.password)
-            
-        userId = self.getUserId(bc)
+        Descriptions of time entries are asked here, so that nothing
+        waits for user's input while operations are submitted. Without
+        asking time entries of projects and todo items get empty ones.
+        """
+        operations = []
+        def add(method, uid, args, kw={}, depends=(), minutes=None):
+            op = Operation(len(operations), method, uid, args, kw, depends,
+                           minutes)
+            operations.append(op)
+            return op
+        def timeEntry(description):
+            return {'date': self.date, 'person_id': userId,
+                    'description': description}
 
-        updated = False
-        # now let's go through the collected data
-        # and decide what to do with each entry
         for project_id, project in karm.todos.items():
             if project.x_kde_ktimetracker_bctype != 'project':
                 continue
@@ -87,136 +259,191 @@ class CheckIn(Command):
             pSessionTime = getSessionTime(project)
             if pSessionTime is not None:
                 # log time for project, aka create time entry for project
-                summary = raw_input("    Please, enter time entry (%s) "
-                                    "description for project "
-                                    "(<Enter> to skip comment): " %
-                                    prettyTime(pSessionTime))
-                entry = bc.createTimeEntryForProject(
-                    int(project_id),
-                    bcTime(pSessionTime),
-                    date=self.date,
-                    person_id=userId,
-                    description=summary
-                )
-                if self.cmdutil.debug:
-                    print "    Add time to project: (%s)" % \
-                        bcTime(pSessionTime)
-                # update karm file
-                project.x_kde_ktimetracker_totalsessiontime = '0'
-                updated = True
-                if self.cmdutil.debug:
-                    print "    Reset project's session time to 0"
+                summary = ''
+                if ask:
+                    summary = raw_input("    Please, enter time entry (%s) "
+                                        "description for project "
+                                        "(<Enter> to skip comment): " %
+                                        prettyTime(pSessionTime))
+                add('createTimeEntryForProject', project.uid,
+                    (int(project_id), bcTime(pSessionTime)),
+                    timeEntry(summary), minutes=pSessionTime)
                     
             # now loop through the project's todo lists
             for list_id, todolist in project.todos.items():
-                if todolist.x_kde_ktimetracker_bctype == 'todolist':
-                    # go deeper to find todos
-                    for todo_id, todo in todolist.todos.items():
-                        if todo.x_kde_ktimetracker_bctype != 'todoitem':
-                            # create todo in basecamp
-                            todo_id = str(bc.createTodoItem(
-                                int(list_id),
-                                content=todo.summary,
-                                notify=True
-                            ).id)
-                            todolist.delete(todo.uid)
-                            todo.uid = todo_id
-                            todolist.add(todo)
-                            todo.x_kde_ktimetracker_bctype = 'todoitem'
-                            updated = True
-                        
-                        # check for todos time entry
-                        pSessionTime = getSessionTime(todo)
-                        if pSessionTime is not None:
-                            # log time for todo item
+                if todolist.x_kde_ktimetracker_bctype != 'todolist':
+                    # possibly we've got time entry for project
+                    # with entry comment as todo body
+                    pSessionTime = getSessionTime(todolist)
+                    if pSessionTime is not None:
+                        add('createTimeEntryForProject', todolist.uid,
+                            (int(project_id), bcTime(pSessionTime)),
+                            timeEntry(todolist.summary),
+                            minutes=pSessionTime)
+                    continue
+
+                # go deeper to find todos
+                for todo_id, todo in todolist.todos.items():
+                    if todo.x_kde_ktimetracker_bctype != 'todoitem':
+                        # create todo in basecamp, the rest of operations
+                        # use id it gets there
+                        item = Reference(add('createTodoItem', todo.uid,
+                            (int(list_id),),
+                            {'content': todo.summary, 'notify': True}).id)
+                    else:
+                        item = int(todo_id)
+                    
+                    # check for todos time entry
+                    entries = []
+                    pSessionTime = getSessionTime(todo)
+                    if pSessionTime is not None:
+                        summary = ''
+                        if ask:
                             summary = raw_input(
                                 "    Please, enter time entry (%s) "
                                 "description for todo item <%s> "
                                 "(<Enter> to skip comment): " %
                                 (prettyTime(pSessionTime), todo.summary)
                             )
-                            entry = bc.createTimeEntryForTodoItem(
-                                int(todo_id),
-                                bcTime(pSessionTime),
-                                date=self.date,
-                                person_id=userId,
-                                description=summary
-                            )
-                            if self.cmdutil.debug:
-                                print "    Added time for todo item <%s>: " \
-                                      "(%s)" % (bcTime(pSessionTime),
-                                                todo.summary)
-                            # update karm file
-                            todo.x_kde_ktimetracker_totalsessiontime = '0'
-                            updated = True
-                            if self.cmdutil.debug:
-                                print "    Reset todo's session time to 0"
-                        
-                        # then check whether todo has more time entries inside
+                        entries.append(add('createTimeEntryForTodoItem',
+                            todo.uid, (item, bcTime(pSessionTime)),
+                            timeEntry(summary), minutes=pSessionTime).id)
+                    
+                    # then check whether todo has more time entries inside
+                    for entry_id, entry in todo.todos.items():
+                        pSessionTime = getSessionTime(entry)
+                        if pSessionTime is not None:
+                            entries.append(add('createTimeEntryForTodoItem',
+                                entry.uid, (item, bcTime(pSessionTime)),
+                                timeEntry(entry.summary),
+                                minutes=pSessionTime).id)
+
+                    # todo checked as done is completed after it's time is
+                    # logged, if all of it's time entries are checked too
+                    if todo.isCompleted() and not [entry
+                            for entry in todo.todos.values()
+                            if not entry.isCompleted()]:
+                        add('completeTodoItem', todo.uid, (item,),
+                            depends=entries)
+        return operations
+
+    def submit(self, outbox, operations):
+        """Submit operations which are not done yet, return the failed ones
+        
+        Each worker thread uses it's own basecamp client. Unconfirmed
+        operations are sent again only with --resume-sent.
+        """
+        from basecamp.karm.transport import connect, getPool
+
+        local = threading.local()
+        def client():
+            bc = getattr(local, 'bc', None)
+            if bc is None:
+                bc = local.bc = connect(
+                    self.url, self.user, self.password,
+                    getPool(self.pool_size, self.timeout))
+            return bc
+        def result(op, value):
+            # the only result needed is id of created todo item
+            if op.method == 'createTodoItem':
+                return int(value.id)
+            return None
+        return execute(operations, client, outbox, self.workers,
+                       result=result, resend=self.resume_sent)
+
+    def confirmSent(self, outbox, operations):
+        """Mark unconfirmed operations done, person has found them in
+        basecamp
+        
+        Created todo items are not, their ids are not known.
+        """
+        for op in operations:
+            if op.isUnconfirmed() and op.method != 'createTodoItem':
+                outbox.markDone(op, None)
+                if self.cmdutil.debug:
+                    print "Confirmed %s" % op
+
+    def updateStorage(self, karm, operations):
+        """Update storage with results of done operations
+        
+        Time logged to basecamp is taken off session time, created todo
+        items get their ids, completed todo items, time entries, lists
+        and projects are deleted. Return True if storage has changed.
+        
+        Storage could already have some of the changes if checkin was
+        interrupted, they are not applied twice: time of operations
+        marked applied in the outbox is already taken off, and session
+        time tracked since the interrupted checkin is kept for the next
+        one.
+        """
+        updated = False
+        renamed = {}
+        completed = {}
+        for op in operations:
+            if not op.done:
+                continue
+            uid = renamed.get(op.uid, op.uid)
+            if op.method == 'createTodoItem':
+                renamed[op.uid] = str(op.result)
+                try:
+                    todo = findTask(karm, op.method, uid)
+                except NotFoundError:
+                    continue
+                karm.rekey(uid, str(op.result),
+                           todo.x_kde_ktimetracker_bctype)
+                todo.x_kde_ktimetracker_bctype = 'todoitem'
+                updated = True
+            elif op.method == 'completeTodoItem':
+                completed[uid] = True
+                if self.cmdutil.debug:
+                    print "    Checked as done todo item [%s]" % uid
+            elif not op.applied:
+                try:
+                    todo = findTask(karm, op.method, uid)
+                except NotFoundError:
+                    continue
+                sessionTime = getSessionTime(todo)
+                if sessionTime is not None:
+                    # journals without minutes reset the whole session
+                    minutes = op.minutes
+                    if minutes is None:
+                        minutes = sessionTime
+                    todo.x_kde_ktimetracker_totalsessiontime = \
+                        max(sessionTime - minutes, 0)
+                    updated = True
+                    if self.cmdutil.debug:
+                        print "    Added time for <%s>: (%s)" % (
+                            todo.summary, op.args[1])
+
+        for project_id, project in karm.todos.items():
+            if project.x_kde_ktimetracker_bctype != 'project':
+                continue
+            for list_id, todolist in project.todos.items():
+                if todolist.x_kde_ktimetracker_bctype == 'todolist':
+                    for todo_id, todo in todolist.todos.items():
+                        if todo.x_kde_ktimetracker_bctype != 'todoitem':
+                            # it's not created in basecamp yet
+                            continue
+                        # delete time entry if it is checked and logged
                         for entry_id, entry in todo.todos.items():
-                            # log time if such exists
-                            pSessionTime = getSessionTime(entry)
-                            if pSessionTime is not None:
-                                # log time for todo item
-                                summary = entry.summary
-                                dummy = bc.createTimeEntryForTodoItem(
-                                    int(todo_id),
-                                    bcTime(pSessionTime),
-                                    date=self.date,
-                                    person_id=userId,
-                                    description=summary
-                                )
-                                if self.cmdutil.debug:
-                                    print "    Added time for todo item " \
-                                          "<%s>: (%s)" % (
-                                        bcTime(pSessionTime),
-                                        todo.summary
-                                    )
-                                # update karm file
-                                entry.x_kde_ktimetracker_totalsessiontime = '0'
-                                updated = True
-                                
-                            # delete time entry if it is checked
-                            if entry.isCompleted():
+                            if entry.isCompleted() and \
+                               getSessionTime(entry) is None:
                                 todo.delete(entry_id)
                                 updated = True
                         
                         # delete todo itself if it is checked as done
-                        if todo.isCompleted() and not todo.todos:
-                            # check todo item as done in basecamp
-                            if bc.completeTodoItem(int(todo_id)) and \
-                               self.cmdutil.debug:
-                                    print "    Checked as done todo item " \
-                                          "[%s]:" % todo_id
+                        if completed.has_key(todo_id) and \
+                           todo.isCompleted() and not todo.todos:
                             todolist.delete(todo_id)
                             updated = True
                             if self.cmdutil.debug:
                                 print "    Deleted todo item " \
                                       "<%s>" % todo.summary
-                else:
-                    # possibly we've got time entry for project
-                    # with entry comment as todo body
-                    pSessionTime = getSessionTime(todolist)
-                    if pSessionTime is not None:
-                        # log time for project
-                        summary = todolist.summary
-                        entry = bc.createTimeEntryForProject(
-                            int(project_id),
-                            bcTime(pSessionTime),
-                            date=self.date,
-                            person_id=userId,
-                            description=summary
-                        )
-                        if self.cmdutil.debug:
-                            print "    Added time for project: (%s)" % \
-                                bcTime(pSessionTime)
-                        # update karm file
-                        todolist.x_kde_ktimetracker_totalsessiontime = '0'
-                        updated = True
 
                 # after logging time delete such kind of todo
                 # in case it is checked as done
-                if todolist.isCompleted() and not todolist.todos:
+                if todolist.isCompleted() and not todolist.todos and \
+                   getSessionTime(todolist) is None:
                     project.delete(list_id)
                     updated = True
                     if self.cmdutil.debug:
@@ -224,16 +451,127 @@ class CheckIn(Command):
             
             # check whether project has any lists
             # if not then delete this project from karm
-            if project.isCompleted() and not project.todos:
+            if project.isCompleted() and not project.todos and \
+               getSessionTime(project) is None:
                 karm.delete(project_id)
                 updated = True
                 if self.cmdutil.debug:
                     print "    Deleted project [%s]" % project_id
+        return updated
+
+    def run(self):
+
+        # transport with basecamp.api are imported only when command is run
+        from basecamp.karm.transport import connect, getPool, timingReport
+
+        karm = KArm()
+        karm.load(self.storage)
+        if self.cmdutil.debug:
+            for todo in karm.orphans:
+                print "Skipped task <%s> [%s]: parent task [%s] not found" % (
+                    todo.summary, todo.uid, todo.related_to)
+            for cycle in karm.cycles:
+                print "Skipped tasks related to each other in a cycle: %s" % \
+                    ', '.join(['[%s]' % todo.uid for todo in cycle])
+            for todo in karm.duplicates:
+                print "Skipped task <%s> [%s]: there already exists task " \
+                      "with the same id" % (todo.summary, todo.uid)
+
+        # operations of interrupted checkin are finished first, time
+        # tracked since then is kept and logged by the next checkin
+        outbox = Outbox(self.storage + '.outbox')
+        if outbox.exists():
+            if self.plan is not None or self.apply is not None:
+                raise KArmError, "Previous checkin is not finished, run " \
+                    "checkin without --plan and --apply to finish it"
+            operations = outbox.load()
+            if self.cmdutil.debug:
+                print "Resuming unfinished checkin: %d of %d operations " \
+                      "are not done" % (
+                    len([op for op in operations if not op.done]),
+                    len(operations))
+            if self.confirm_sent:
+                self.confirmSent(outbox, operations)
+        elif self.plan is not None:
+            # nothing is sent to basecamp, person is known on apply
+            span = timing.start('plan')
+            operations = self.collect(karm, ask=False)
+            writePlan(self.plan, karm, operations)
+            span.stop()
+            timing.count('operations', len(operations))
+            if self.cmdutil.debug:
+                print "Wrote plan of %d operations to %s" % (
+                    len(operations), self.plan)
+            return
+        else:
+            bc = connect(self.url, self.user, self.password,
+                         getPool(self.pool_size, self.timeout))
+            if self.apply is not None:
+                span = timing.start('plan')
+                operations = readPlan(self.apply, karm)
+                span.stop()
+                userId = self.getUserId(bc)
+                for op in operations:
+                    if op.kw.has_key('person_id'):
+                        if op.kw['person_id'] is None:
+                            op.kw['person_id'] = userId
+                        if self.date is not None:
+                            op.kw['date'] = self.date
+            else:
+                userId = self.getUserId(bc)
+                # time spent on answering questions is a part of it
+                span = timing.start('plan')
+                operations = self.collect(karm, userId,
+                    not getattr(self.cmdutil, 'no_input', False))
+                span.stop()
+            if operations:
+                outbox.create(operations)
+
+        failed = []
+        if operations:
+            timing.count('operations', len(operations))
+            span = timing.start('submit')
+            try:
+                failed = self.submit(outbox, operations)
+            finally:
+                outbox.close()
+                span.stop()
+        unconfirmed = [op for op in failed if op.isUnconfirmed()]
+        if self.cmdutil.debug:
+            for op in failed:
+                if op.isUnconfirmed():
+                    error = "it was sent, but not confirmed"
+                else:
+                    error = op.error or "it depends on failed operation"
+                print "Failed %s: %s" % (op, error)
+            print timingReport(getPool())
 
         # dump karm storage if something has changed
+        span = timing.start('merge')
+        updated = self.updateStorage(karm, operations)
+        span.stop()
         if updated:
             karm.dump()
             if self.cmdutil.debug:
                 print "Done..."
         elif self.cmdutil.debug:
             print "Nothing has changed..."
+        if operations:
+            # time of done operations is taken off storage now
+            outbox.markApplied([op for op in operations if op.done])
+            outbox.close()
+
+        # journal is kept until all of it's operations are done
+        if unconfirmed:
+            raise KArmError, "%d of %d operations were sent, but basecamp " \
+                "didn't confirm them, look for them in basecamp and run " \
+                "checkin with --confirm-sent if they are there, or with " \
+                "--resume-sent if they are not (created todo items could " \
+                "only be sent again): %s" % (
+                len(unconfirmed), len(operations),
+                ', '.join(['%s [%s]' % (op, op.uid) for op in unconfirmed]))
+        if failed:
+            raise KArmError, "%d of %d operations failed, run checkin " \
+                "again to retry them" % (len(failed), len(operations))
+        if operations:
+            outbox.remove()
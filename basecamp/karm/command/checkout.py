@@ -9,13 +9,14 @@ Previous KArm configuration won't be taken into account. It will be
 only backed up.
 """
 
-from basecamp.api import Basecamp
+import threading
 
-from basecamp.karm import patch
-from basecamp.karm import KArm
+from basecamp.karm import KArm, timing
 from basecamp.karm.todo import Todo
+from basecamp.karm.workers import concurrentMap
 
 from cmdhelper.cmd import Command
+from cmdhelper.errors import CMDHelperArgError
 
 class CheckOut(Command):
 
@@ -28,6 +29,8 @@ class CheckOut(Command):
          "have assigned to you todos (default False)"),
         ('fetch-time', 't', "fetch todos total time calculated from "
          "all time entries for certain todo item (default False)"),
+        ('workers=', 'w', "number of concurrent requests to fetch "
+         "todos time with (default 4)"),
     ]
     
     boolean_options = ['active-projects', 'fetch-time']
@@ -35,15 +38,54 @@ class CheckOut(Command):
     def initialize_options(self):
         self.active_projects = False
         self.fetch_time = False
+        self.workers = 4
+
+    def finalize_options(self):
+        super(CheckOut, self).finalize_options()
+        try:
+            self.workers = int(self.workers)
+        except ValueError:
+            self.workers = 0
+        if self.workers < 1:
+            raise CMDHelperArgError, "Number of workers should be " \
+                "a positive integer"
+
+    def fetchHours(self, todo_ids):
+        """Return list of hours logged for each of the given todo items
+        
+        Time entries are requested concurrently, each worker thread uses
+        it's own basecamp client, all of them share connection pool.
+        """
+        from basecamp.karm.transport import connect, getPool
+
+        local = threading.local()
+        def fetch(todo_id):
+            bc = getattr(local, 'bc', None)
+            if bc is None:
+                bc = local.bc = connect(
+                    self.url, self.user, self.password,
+                    getPool(self.pool_size, self.timeout))
+            hours = 0.0
+            for time_entry in bc.getEntriesForTodoItem(todo_id):
+                hours += float(time_entry.hours)
+            return hours
+        
+        return concurrentMap(fetch, todo_ids, self.workers)
     
     def run(self):
+        # transport with basecamp.api are imported only when command is run
+        from basecamp.karm.transport import connect, getPool, timingReport
+
         karm = KArm()
-        bc = Basecamp(self.url, self.user, self.password)
+        bc = connect(self.url, self.user, self.password,
+                     getPool(self.pool_size, self.timeout))
         counter = 0
 
         # add projects as todo items to karm
+        span = timing.start('fetch')
         projects = bc.getProjects()
         todolists = bc.getTodoLists()
+        span.stop()
         if self.active_projects:
             active_ids = [todolist.project_id for todolist in todolists]
             projects = [project for project in projects
@@ -57,7 +99,17 @@ class CheckOut(Command):
             if self.cmdutil.debug:
                 print "Added project: <%s>" % project.name
 
+        # fetch time of all todo items at once
+        hours = {}
+        if self.fetch_time:
+            span = timing.start('fetch')
+            todo_ids = [todo.id for todolist in todolists
+                                for todo in todolist.todo_items]
+            hours = dict(zip(todo_ids, self.fetchHours(todo_ids)))
+            span.stop()
+
         # add todolists with their todo items to karm
+        span = timing.start('merge')
         for todolist in todolists:
             project_id = str(todolist.project_id)
             task = karm.todos[project_id].add(Todo(
@@ -71,23 +123,24 @@ class CheckOut(Command):
             
             # add todo items eventually
             for todo in todolist.todo_items:
-                hours = 0.0
-                if self.fetch_time:
-                    for time_entry in bc.getEntriesForTodoItem(todo.id):
-                        hours += float(time_entry.hours)
                 task.add(Todo(
                     str(todo.id),
                     todo.content,
                     related_to=str(todolist.id),
                     x_kde_ktimetracker_bctype='todoitem',
-                    x_kde_ktimetracker_totaltasktime=str(int(hours * 60.0))
+                    x_kde_ktimetracker_totaltasktime=int(
+                        hours.get(todo.id, 0.0) * 60.0)
                 ))
                 if self.cmdutil.debug:
                     print "        Added todo item: <%s>" % todo.content
                 counter += 1
 
+        span.stop()
+        timing.count('todos added', len(karm._index))
+
         # dump result
         karm.dump(self.storage)
         if self.cmdutil.debug:
             print 'Added %d todo items...' % counter
+            print timingReport(getPool())
             print 'Done...'
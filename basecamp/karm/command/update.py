@@ -6,22 +6,93 @@ KArm update script.
 Requests data from basecamp server and update existing iCalendar
 file for using it in KArm utility.
 
-How merging is done:
+How merging is done (see diff module):
 1. New projects, todos and todo lists are simply added to KArm.
 2. Deleted or completed items are only notified, not actually deleted from
    KArm.
 3. Updated items are appropriately updated in KArm (summary, content and
    total times).
-"""
+4. Items moved to another project or todo list are moved in KArm too.
+
+Responses of basecamp are cached on disk (see cache module, ~/.karm/cache
+unless --cache-dir is given) and when neither them nor storage have
+changed since the last update, merging is skipped at all.
 
-from basecamp.api import Basecamp
+Sync cursor (time of the last sync and change markers of the synced
+projects) is kept in the storage as calendar properties. Next update
+requests todo lists only of the projects changed since then and leaves
+subtrees of the others untouched, --full option makes it sync
+everything.
+"""
+import os
+import time
+import urllib
 
-from basecamp.karm import patch
-from basecamp.karm import KArm
-from basecamp.karm.todo import Todo
-from basecamp.karm.utils import prettyTime, bcTime, getSessionTime
+from basecamp.karm import KArm, timing
+from basecamp.karm.ics import readProperties
+from basecamp.karm.diff import snapshot, diff, applyChanges
 
 from cmdhelper.cmd import Command
+from cmdhelper.errors import CMDHelperArgError
+
+SYNC_TIME = 'X-KARM-SYNC-TIME'
+SYNC_PROJECTS = 'X-KARM-SYNC-PROJECTS'
+# time entries of project basecamp returns at once
+ENTRIES_PAGE = 50
+
+def readCursor(properties):
+    """Return project id -> change marker map of the sync cursor kept
+    in storage properties, None if there is no cursor
+    """
+    if not properties.has_key(SYNC_TIME) or \
+       not properties.has_key(SYNC_PROJECTS):
+        return None
+    markers = {}
+    for pair in properties[SYNC_PROJECTS].split():
+        if '=' not in pair:
+            return None
+        id, marker = pair.split('=', 1)
+        markers[id] = urllib.unquote(marker)
+    return markers
+
+def writeCursor(properties, markers):
+    """Keep sync cursor with the given markers in storage properties
+    """
+    ids = markers.keys()
+    ids.sort()
+    properties[SYNC_TIME] = unicode(time.strftime('%Y%m%dT%H%M%SZ',
+                                                  time.gmtime()))
+    properties[SYNC_PROJECTS] = u' '.join([
+        '%s=%s' % (id, urllib.quote(markers[id], safe='')) for id in ids])
+
+def headerProperties(path):
+    """Return calendar properties of storage file's header, the part
+    before it's first component, where karm keeps them
+    """
+    lines = []
+    try:
+        f = open(path, 'rb')
+    except IOError:
+        return {}
+    try:
+        for line in f:
+            if lines and line[:6].upper() == 'BEGIN:':
+                break
+            lines.append(line)
+    finally:
+        f.close()
+    return readProperties(lines)
+
+def changeMarker(project):
+    """Return the string which changes whenever the project is changed,
+    None if basecamp client doesn't tell it
+    """
+    marker = getattr(project, 'last_changed_on', None)
+    if marker is None:
+        return None
+    if isinstance(marker, unicode):
+        return marker.encode('utf-8')
+    return str(marker)
 
 class Update(Command):
 
@@ -34,163 +105,247 @@ class Update(Command):
          "have assigned to you todos (default False)"),
         ('update-time', 't', "update todos total time calculated from "
          "all time entries for certain todo item (default False)"),
+        ('bulk-time', 'b', "with --update-time request time entries once "
+         "per project instead of once per todo item (default False)"),
+        ('cache-ttl=', None, "seconds during which cached basecamp "
+         "responses are used without asking server (default 0)"),
+        ('no-cache', None, "don't use cached basecamp responses and "
+         "always merge them (default False)"),
+        ('cache-dir=', None, "directory of cached basecamp responses "
+         "(default ~/.karm/cache)"),
+        ('dry-run', 'n', "print changes without saving them to the "
+         "storage (default False)"),
+        ('full', None, "sync all projects, not only the ones changed "
+         "since the last update (default False)"),
     ]
 
-    boolean_options = ['active-projects', 'update-time']
+    boolean_options = ['active-projects', 'update-time', 'bulk-time',
+                       'no-cache', 'dry-run', 'full']
 
     def initialize_options(self):
         self.active_projects = False
         self.update_time = False
+        self.bulk_time = False
+        self.cache_ttl = 0
+        self.no_cache = False
+        self.cache_dir = None
+        self.dry_run = False
+        self.full = False
+
+    def finalize_options(self):
+        super(Update, self).finalize_options()
+        try:
+            self.cache_ttl = float(self.cache_ttl)
+        except ValueError:
+            self.cache_ttl = -1
+        if self.cache_ttl < 0:
+            raise CMDHelperArgError, "Cache TTL should be a non-negative " \
+                "number of seconds"
+
+    def fetchHours(self, bc, project_ids):
+        """Return todo item id -> hours map of time logged for todo items
+        of the given projects
+        
+        Time entries are requested for every project page by page, the
+        way basecamp returns them (ENTRIES_PAGE of them per page, the
+        last page is shorter), entries seen on an earlier page are
+        counted once. The ones which are not logged for todo items are
+        skipped. Return None if basecamp client can't request time
+        entries of the project or doesn't tell which todo item they are
+        logged for, then time should be requested for each todo item.
+        """
+        if not hasattr(bc, 'getEntriesForProject'):
+            return None
+        hours = {}
+        for project_id in project_ids:
+            seen = {}
+            page = 1
+            while True:
+                entries = bc.getEntriesForProject(project_id, page)
+                new = 0
+                for time_entry in entries:
+                    if not hasattr(time_entry, 'todo_item_id'):
+                        return None
+                    if seen.has_key(time_entry.id):
+                        continue
+                    seen[time_entry.id] = True
+                    new += 1
+                    todo_id = time_entry.todo_item_id
+                    if todo_id:
+                        todo_id = str(todo_id)
+                        hours[todo_id] = hours.get(todo_id, 0.0) + \
+                            float(time_entry.hours)
+                if len(entries) < ENTRIES_PAGE or not new:
+                    break
+                page += 1
+        return hours
+
+    def storageState(self):
+        """Return what the merge result depends on besides basecamp data
+        """
+        try:
+            info = os.stat(self.storage)
+        except OSError:
+            return None
+        return (info.st_size, info.st_mtime, bool(self.active_projects),
+                bool(self.update_time), bool(self.bulk_time))
     
+    def fetchTodoLists(self, bc, project_ids):
+        """Return todo lists of the given projects
+        
+        Todo lists are requested for each project if basecamp client
+        can do it, otherwise all of them are requested and filtered.
+        """
+        if hasattr(bc, 'getTodoListsForProject'):
+            todolists = []
+            for project_id in project_ids:
+                todolists.extend(bc.getTodoListsForProject(project_id))
+            return todolists
+        return [todolist for todolist in bc.getTodoLists()
+                   if todolist.project_id in project_ids]
+
     def run(self):
 
+        # transport with basecamp.api are imported only when command is run
+        from basecamp.karm.transport import connect, getPool, timingReport
+
+        cache = None
+        if not self.no_cache:
+            from basecamp.karm.cache import ResponseCache, DIRECTORY
+            cache = ResponseCache(self.cache_dir or DIRECTORY,
+                                  self.cache_ttl)
+        bc = connect(self.url, self.user, self.password,
+                     getPool(self.pool_size, self.timeout), cache)
+
+        span = timing.start('fetch')
+        allProjects = bc.getProjects()
+        span.stop()
+        markers = {}
+        for project in allProjects:
+            markers[str(project.id)] = changeMarker(project)
+        delta = not self.full and None not in markers.values()
+
+        # storage is loaded lazily when sync cursor limits the sync, todos
+        # of projects which are not changed since then are not even
+        # parsed; otherwise all of them are parsed anyway
         karm = KArm()
-        karm.load(self.storage)
-        bc = Basecamp(self.url, self.user, self.password)
+        karm.load(self.storage, lazy=delta and
+                  readCursor(headerProperties(self.storage)) is not None)
+        if self.cmdutil.debug:
+            for todo in karm.orphans:
+                print "Skipped task <%s> [%s]: parent task [%s] not found" % (
+                    todo.summary, todo.uid, todo.related_to)
+            for cycle in karm.cycles:
+                print "Skipped tasks related to each other in a cycle: %s" % \
+                    ', '.join(['[%s]' % todo.uid for todo in cycle])
+            for todo in karm.duplicates:
+                print "Skipped task <%s> [%s]: there already exists task " \
+                      "with the same id" % (todo.summary, todo.uid)
 
-        # flag that will show at the end whether something has been
-        # updated eventually and if we really need to dump new storage
-        updated = False
+        cursor = None
+        if delta:
+            cursor = readCursor(karm.properties)
 
-        # update projects
-        projects = bc.getProjects()
-        todolists = bc.getTodoLists()
+        span = timing.start('fetch')
+        if cursor is None:
+            projects = allProjects
+            todolists = bc.getTodoLists()
+            scope = None
+        else:
+            projects = [project for project in allProjects
+                           if cursor.get(str(project.id)) !=
+                              markers[str(project.id)]]
+            todolists = self.fetchTodoLists(bc, [project.id
+                                                 for project in projects])
+            # projects deleted in basecamp are looked for removed tasks
+            scope = [(u'project', str(project.id)) for project in projects] + \
+                    [todo._key() for uid, todo in karm.todos.items()
+                        if not markers.has_key(uid) and
+                           todo.x_kde_ktimetracker_bctype == 'project']
+            if self.cmdutil.debug:
+                print "%d of %d projects changed since the last update" % (
+                    len(projects), len(allProjects))
+        synced = dict([(str(project.id), True) for project in projects])
         if self.active_projects:
             active_ids = [todolist.project_id for todolist in todolists]
+            inactive = dict([(str(project.id), True) for project in projects
+                                if project.id not in active_ids])
             projects = [project for project in projects
                            if project.id in active_ids]
+            # subtrees of inactive projects are not in basecamp data,
+            # they are not looked for removed tasks
+            if inactive:
+                if scope is None:
+                    scope = [todo._key() for todo in karm.todos.values()]
+                scope = [(bctype, uid) for bctype, uid in scope
+                            if bctype != 'project' or
+                               not inactive.has_key(uid)]
         
-        # firstly update projects
-        for project in projects:
-            task = karm.todos.get(str(project.id), None)
-            if task is None:
-                karm.add(Todo(
-                    str(project.id),
-                    project.name,
-                    x_kde_ktimetracker_bctype='project'
-                ))
-                updated = True
-                if self.cmdutil.debug:
-                    print "Added project: <%s> [%d]" % (project.name,
-                                                        project.id)
-            else:
-                if task.summary != project.name:
-                    task.summary = project.name
-                    updated = True
-                    if self.cmdutil.debug:
-                        print "Updated project: <%s> [%d]" % (project.name,
-                                                              project.id)
-
-        # then update todo lists with their todo items
-        for todolist in todolists:
-            project_id = str(todolist.project_id)
-            task = karm.todos[project_id].todos.get(str(todolist.id), None)
-            if task is None:
-                task = karm.todos[project_id].add(Todo(
-                    str(todolist.id),
-                    todolist.name,
-                    related_to=project_id,
-                    x_kde_ktimetracker_bctype='todolist'
-                ))
-                updated = True
+        # time of all todo items at once
+        hours = None
+        if self.update_time and self.bulk_time:
+            project_ids = []
+            for todolist in todolists:
+                if todolist.project_id not in project_ids:
+                    project_ids.append(todolist.project_id)
+            hours = self.fetchHours(bc, project_ids)
+            if hours is None and self.cmdutil.debug:
+                print "Basecamp client can't fetch time entries of todo " \
+                      "items by project, fetching them for each todo item"
+        span.stop()
+
+        # skip merging if it was already done with the same data, time
+        # entries requested for each todo item are not known beforehand
+        # and nothing is known if client's requests bypassed the cache
+        if cache is not None:
+            marker = 'update %s' % os.path.abspath(self.storage)
+            state = (cache.signature(), self.storageState())
+            if not self.full and cache.served and \
+               (not self.update_time or hours is not None) and \
+               cache.recall(marker) == state:
                 if self.cmdutil.debug:
-                    print "Added todo list to project <%s> [%d]: <%s> [%d]" % (
-                        karm.todos[project_id].summary,
-                        todolist.project_id,
-                        todolist.name,
-                        todolist.id
-                    )
-            else:
-                if task.summary != todolist.name:
-                    task.summary = todolist.name
-                    updated = True
-                    if self.cmdutil.debug:
-                        print "Updated todo list: <%s> [%d] " \
-                              "(project <%s> [%d])" % (
-                        todolist.name,
-                        todolist.id,
-                        karm.todos[project_id].summary,
-                        todolist.project_id
-                    )
-            
-            for todo in todolist.todo_items:
-                new_todo = False
-                subtask = task.todos.get(str(todo.id), None)
-                if subtask is None:
-                    new_todo = True
-                    subtask = task.add(Todo(
-                        str(todo.id),
-                        todo.content,
-                        related_to=task.uid,
-                        x_kde_ktimetracker_bctype='todoitem'
-                    ))
-                    updated = True
-                    if self.cmdutil.debug:
-                        print "Added todo item <%s> to <%s> [%d] todolist " \
-                              "(project <%s> [%d])" % (
-                            todo.content,
-                            todolist.name,
-                            todolist.id,
-                            karm.todos[project_id].summary,
-                            todolist.project_id
-                        )
-                else:
-                    # TODO: todo.content string should be escaped
-                    #       before comparison
-                    if subtask.summary != todo.content:
-                        subtask.summary = todo.content
-                        updated = True
-                        if self.cmdutil.debug:
-                            print "Updated todoitem #%d " \
-                                  "from <%s> todolist [%d] " \
-                                  "(<%s> project [%d])" % (
-                                todolist.todo_items.index(todo),
-                                todolist.name,
-                                todolist.id,
-                                karm.todos[project_id].summary,
-                                todolist.project_id
-                            )
-
-                # update todo item's time
-                if self.update_time:
-                    if subtask.x_kde_ktimetracker_totalsessiontime is None:
-                        subtask.x_kde_ktimetracker_totalsessiontime = '0'
-                    if subtask.x_kde_ktimetracker_totaltasktime is None:
-                        subtask.x_kde_ktimetracker_totaltasktime = '0'
-                    sessionMinutes = int(subtask.x_kde_ktimetracker_totalsessiontime)
-                    totalMinutes = int(subtask.x_kde_ktimetracker_totaltasktime)
-                    
-                    # fetch total todo item's time from basecamp
-                    hours = 0.0
+                    print timingReport(getPool())
+                    print "Nothing has changed on basecamp..."
+                return
+
+        # time of todo items one by one, if it's not requested yet
+        if self.update_time and hours is None:
+            span = timing.start('fetch')
+            hours = {}
+            for todolist in todolists:
+                for todo in todolist.todo_items:
+                    todoHours = 0.0
                     for time_entry in bc.getEntriesForTodoItem(todo.id):
-                        hours += float(time_entry.hours)
-                        
-                    if int(hours * 60.0) != totalMinutes - sessionMinutes:
-                        subtask.x_kde_ktimetracker_totaltasktime = str(
-                            sessionMinutes + int(hours * 60.0)
-                        )
-                        updated = True
-                        if new_todo and self.cmdutil.debug:
-                            print "Added total time to a newly created <%s> " \
-                                  "todo item to <%s> todo list [%d] " \
-                                  "(project <%s> [%d])" % (
-                                todo.content,
-                                todolist.name,
-                                todolist.id,
-                                karm.todos[project_id].summary,
-                                todolist.project_id
-                            )
-                        else:
-                            if self.cmdutil.debug:
-                                print "Updated todoitem's <%s> total time " \
-                                      "(todolist <%s> [%d], " \
-                                      "project <%s> [%d])" % (
-                                todo.content,
-                                todolist.name,
-                                todolist.id,
-                                karm.todos[project_id].summary,
-                                todolist.project_id
-                            )
+                        todoHours += float(time_entry.hours)
+                    hours[str(todo.id)] = todoHours
+            span.stop()
+
+        span = timing.start('merge')
+        changes = diff(karm, snapshot(projects, todolists), hours, scope)
+        timing.count('changes', len(changes))
+        if self.cmdutil.debug or self.dry_run:
+            for change in changes:
+                print change
+        if self.dry_run:
+            span.stop()
+            return
+        updated = applyChanges(karm, changes)
+
+        # cursor keeps markers of synced projects and of the ones which
+        # are not changed since they were synced
+        if None not in markers.values():
+            current = {}
+            for id, value in markers.items():
+                if synced.has_key(id) or \
+                   (cursor is not None and cursor.get(id) == value):
+                    current[id] = value
+            if current != readCursor(karm.properties):
+                writeCursor(karm.properties, current)
+                updated = True
+        span.stop()
+
+        if self.cmdutil.debug:
+            print timingReport(getPool())
 
         # dump result if something has changed
         if updated:
@@ -199,3 +354,6 @@ class Update(Command):
                 print "Done..."
         elif self.cmdutil.debug:
                 print "Nothing has changed..."
+
+        if cache is not None:
+            cache.remember(marker, (state[0], self.storageState()))
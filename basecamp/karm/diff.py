@@ -0,0 +1,156 @@
+"""Difference between basecamp data and KArm storage
+
+Basecamp projects, todo lists and todo items are indexed by their types
+and ids once, storage tasks of the same types are found through KArm's
+(bctype, uid) index, so the whole change set is computed in a single
+pass over both of them:
+
+    added      task is in basecamp, but not in storage
+    renamed    task's summary is different in basecamp
+    moved      task is in another project or todo list in basecamp
+    time       total time logged for todo item in basecamp is different
+    completed  todo item is completed in basecamp, but not in storage
+    removed    task of basecamp type is in storage, but not in basecamp
+
+diff doesn't change the storage, so changes could be just previewed.
+applyChanges applies them, removed and completed tasks are only
+reported and stay in storage as they are.
+"""
+from todo import Todo, BCTYPES, PARENT_BCTYPES
+
+class Change(object):
+    """Change of a single task
+
+    parent, summary and minutes are the new values from basecamp, old
+    is the replaced value of the storage.
+    """
+
+    def __init__(self, kind, uid, bctype, summary=None, parent=None,
+                 minutes=None, old=None):
+        self.kind = kind
+        self.uid = uid
+        self.bctype = bctype
+        self.summary = summary
+        self.parent = parent
+        self.minutes = minutes
+        self.old = old
+
+    def __str__(self):
+        if self.kind == 'added' and self.parent is not None:
+            detail = 'into [%s]' % self.parent
+        elif self.kind == 'renamed':
+            detail = 'from <%s>' % self.old
+        elif self.kind == 'moved':
+            detail = 'from [%s] to [%s]' % (self.old, self.parent)
+        elif self.kind == 'time':
+            detail = '%s minutes, was %s' % (self.minutes, self.old)
+        else:
+            detail = ''
+        return ('%s %s <%s> [%s] %s' % (self.kind.capitalize(), self.bctype,
+            self.summary, self.uid, detail)).rstrip().encode('utf-8')
+
+def snapshot(projects, todolists):
+    """Yield (uid, bctype, summary, parent, completed) tuple for every
+    task of basecamp data, after it's parent
+    """
+    for project in projects:
+        yield str(project.id), u'project', project.name, None, False
+    for todolist in todolists:
+        yield (str(todolist.id), u'todolist', todolist.name,
+               str(todolist.project_id), False)
+    for todolist in todolists:
+        parent = str(todolist.id)
+        for todo in todolist.todo_items:
+            yield (str(todo.id), u'todoitem', todo.content, parent,
+                   bool(getattr(todo, 'completed', False)))
+
+def diff(karm, tasks, hours=None, scope=None):
+    """Return list of changes which make storage match basecamp
+
+    tasks is a snapshot of basecamp data (any iterable of snapshot's
+    tuples, so it's not kept in memory as a whole). hours maps todo item
+    id to hours logged for it, times are not compared without it.
+    Changes of every task go after the changes of it's parent.
+
+    scope is a list of (bctype, uid) keys of storage tasks whose
+    subtrees are covered by the snapshot, only they are looked for
+    removed tasks. By default snapshot covers the whole storage.
+    """
+    changes = []
+    index = karm._index
+    remote = {}
+    for uid, bctype, summary, parent, completed in tasks:
+        remote[(bctype, uid)] = True
+        minutes = None
+        if hours is not None and bctype == 'todoitem':
+            minutes = int(hours.get(uid, 0.0) * 60.0)
+        todo = index.get((bctype, uid))
+        if todo is None:
+            changes.append(Change('added', uid, bctype, summary, parent,
+                                  minutes))
+            continue
+        if todo.summary != summary:
+            changes.append(Change('renamed', uid, bctype, summary, parent,
+                                  old=todo.summary))
+        if todo.related_to != parent:
+            changes.append(Change('moved', uid, bctype, summary, parent,
+                                  old=todo.related_to))
+        if minutes is not None:
+            session = todo.x_kde_ktimetracker_totalsessiontime or 0
+            total = todo.x_kde_ktimetracker_totaltasktime or 0
+            if minutes != total - session:
+                changes.append(Change('time', uid, bctype, summary, parent,
+                                      minutes, total - session))
+        if completed and not todo.isCompleted():
+            changes.append(Change('completed', uid, bctype, summary, parent))
+
+    # parents are walked before their children
+    if scope is None:
+        stack = karm.todos.values()
+    else:
+        stack = [index[key] for key in scope if key in index]
+    stack.reverse()
+    candidates = []
+    while stack:
+        todo = stack.pop()
+        candidates.append(todo)
+        children = todo.todos.values()
+        children.reverse()
+        stack.extend(children)
+    for todo in candidates:
+        if todo.x_kde_ktimetracker_bctype in BCTYPES and \
+           (todo.x_kde_ktimetracker_bctype, todo.uid) not in remote:
+            changes.append(Change('removed', todo.uid,
+                                  todo.x_kde_ktimetracker_bctype,
+                                  todo.summary, todo.related_to))
+    return changes
+
+def applyChanges(karm, changes):
+    """Apply changes to storage, return True if storage has changed
+    """
+    updated = False
+    for change in changes:
+        if change.kind == 'added':
+            todo = Todo(change.uid, change.summary, related_to=change.parent,
+                        x_kde_ktimetracker_bctype=change.bctype)
+            if change.minutes is not None:
+                todo.x_kde_ktimetracker_totalsessiontime = 0
+                todo.x_kde_ktimetracker_totaltasktime = change.minutes
+            if change.parent is None:
+                karm.add(todo)
+            else:
+                karm.find(change.parent,
+                          PARENT_BCTYPES.get(change.bctype)).add(todo)
+        elif change.kind == 'renamed':
+            karm.find(change.uid, change.bctype).summary = change.summary
+        elif change.kind == 'moved':
+            karm.move(change.uid, change.parent, change.bctype)
+        elif change.kind == 'time':
+            todo = karm.find(change.uid, change.bctype)
+            session = todo.x_kde_ktimetracker_totalsessiontime or 0
+            todo.x_kde_ktimetracker_totalsessiontime = session
+            todo.x_kde_ktimetracker_totaltasktime = session + change.minutes
+        else:
+            continue
+        updated = True
+    return updated
@@ -9,4 +9,7 @@ class DuplicationError(KArmError):
     pass
 
 class NotFoundError(KArmError):
-    pass
\ No newline at end of file
+    pass
+
+class ParseError(KArmError):
+    pass
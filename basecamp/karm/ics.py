@@ -0,0 +1,487 @@
+"""Native iCalendar reader and writer for KArm storage files
+
+vobject parses the whole storage into a tree of components and content
+lines, and only after that KArm walks the tree to create its todos.
+KTimeTracker storages may contain tens of thousands of tasks, so here we
+read the file line by line, unfold content lines and create Todo objects
+straight away in one pass.
+
+Only properties KArm itself knows about are decoded, everything else is
+skipped. Whenever reader meets something that could change the meaning
+of a VTODO and that it doesn't handle the same way vobject does
+(parameters on known properties, non UTC date-times, broken encoding,
+etc.) it raises ParseError, so that caller can fall back to vobject.
+
+Writer does the opposite: it streams folded content lines of todos
+straight to the file instead of building vobject calendar first. Output
+is the same as vobject (patched by patch module) would produce.
+"""
+import re
+import datetime
+from cStringIO import StringIO
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+
+from todo import Todo
+from errors import ParseError
+
+# VTODO content lines we are interested in mapped to Todo attributes
+TODO_PROPERTIES = {
+    'uid': 'uid',
+    'summary': 'summary',
+    'dtstamp': 'dtstamp',
+    'created': 'created',
+    'last-modified': 'last_modified',
+    'related-to': 'related_to',
+    'completed': 'completed',
+    'percent-complete': 'percent_complete',
+    'x-kde-ktimetracker-totalsessiontime': 'x_kde_ktimetracker_totalsessiontime',
+    'x-kde-ktimetracker-totaltasktime': 'x_kde_ktimetracker_totaltasktime',
+    'x-kde-ktimetracker-bctype': 'x_kde_ktimetracker_bctype',
+}
+
+# properties vobject decodes as TEXT and as UTC date-time values
+TEXT_PROPERTIES = ('uid', 'summary', 'related-to')
+DATETIME_PROPERTIES = ('dtstamp', 'created', 'last-modified', 'completed')
+# properties todo keeps as integers: percents and minutes
+INTEGER_PROPERTIES = ('percent-complete',
+                      'x-kde-ktimetracker-totalsessiontime',
+                      'x-kde-ktimetracker-totaltasktime')
+INTEGER_ATTRIBUTES = tuple([TODO_PROPERTIES[name]
+                            for name in INTEGER_PROPERTIES])
+
+# VTODO content lines in the order vobject serializes them
+TODO_LINES = (
+    ('completed', 'COMPLETED'),
+    ('created', 'CREATED'),
+    ('dtstamp', 'DTSTAMP'),
+    ('last_modified', 'LAST-MODIFIED'),
+    ('percent_complete', 'PERCENT-COMPLETE'),
+    ('related_to', 'RELATED-TO'),
+    ('summary', 'SUMMARY'),
+    ('uid', 'UID'),
+    ('x_kde_ktimetracker_bctype', 'X-KDE-ktimetracker-bctype'),
+    ('x_kde_ktimetracker_totalsessiontime', 'X-KDE-ktimetracker-totalSessionTime'),
+    ('x_kde_ktimetracker_totaltasktime', 'X-KDE-ktimetracker-totalTaskTime'),
+)
+
+_textToken = re.compile(r'\\(.?)|,', re.DOTALL)
+
+# vobject takes a while to import, so it's imported only when it's
+# needed to write calendar header or not UTC date-time, see _importVObject
+PRODID = dateTimeToString = None
+
+def _importVObject():
+    global PRODID, dateTimeToString
+    from vobject.icalendar import PRODID, dateTimeToString
+
+_zero = datetime.timedelta(0)
+
+class UTC(datetime.tzinfo):
+    """UTC time zone of date-times read by native reader
+
+    It's equal to vobject's (dateutil's) UTC time zone, so date-times
+    read natively and with vobject compare and serialize the same way.
+    """
+
+    def utcoffset(self, dt):
+        return _zero
+
+    def dst(self, dt):
+        return _zero
+
+    def tzname(self, dt):
+        return 'UTC'
+
+    def __eq__(self, other):
+        if not isinstance(other, datetime.tzinfo):
+            return NotImplemented
+        try:
+            return other.utcoffset(None) == _zero
+        except (TypeError, ValueError, AttributeError):
+            return False
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    def __hash__(self):
+        return hash(_zero)
+
+    def __repr__(self):
+        return 'UTC()'
+
+utc = UTC()
+
+def unfold(stream):
+    """Yield logical content lines of stream
+
+    Folded lines (those starting with space or tab) are joined with
+    the previous one, line breaks and empty lines are dropped.
+    Together with the line it's start and end byte offsets in stream
+    and it's raw (folded) data are yielded: (start, end, line, data).
+    """
+    line = None
+    start = end = 0
+    for raw in stream:
+        offset = end
+        end += len(raw)
+        text = raw.rstrip('\r\n')
+        if not text:
+            continue
+        if text[0] in ' \t':
+            if line is None:
+                raise ParseError, 'Folded line without content line to continue'
+            line.append(text[1:])
+            data.append(raw)
+            last = end
+        else:
+            if line is not None:
+                yield start, last, ''.join(line), ''.join(data)
+            line = [text]
+            data = [raw]
+            start = offset
+            last = end
+    if line is not None:
+        yield start, last, ''.join(line), ''.join(data)
+
+def unescapeText(value):
+    """Remove backslash escaping from TEXT value
+
+    Just like vobject only the first of comma separated values is taken.
+    """
+    if '\\' not in value and ',' not in value:
+        return value
+    out = []
+    pos = 0
+    for match in _textToken.finditer(value):
+        out.append(value[pos:match.start()])
+        pos = match.end()
+        if match.group(0) == ',':
+            return u''.join(out)
+        char = match.group(1)
+        if char and char in 'nN':
+            out.append(u'\n')
+        elif char and char in '\\;,"':
+            out.append(char)
+        else:
+            # leave unrecognized escaped characters as they are
+            out.append(match.group(0))
+    out.append(value[pos:])
+    return u''.join(out)
+
+def escapeText(value):
+    """Backslash escape TEXT value
+    """
+    value = value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+    return value.replace('\r\n', '\\n').replace('\n', '\\n').replace('\r', '\\n')
+
+def parseDateTime(value):
+    """Parse UTC date-time value in YYYYMMDDTHHMMSSZ format
+    """
+    if len(value) != 16 or value[8] != 'T' or value[15] != 'Z':
+        raise ParseError, 'Unsupported date-time value "%s"' % value
+    try:
+        return datetime.datetime(int(value[0:4]), int(value[4:6]),
+                                 int(value[6:8]), int(value[9:11]),
+                                 int(value[11:13]), int(value[13:15]),
+                                 tzinfo=utc)
+    except ValueError:
+        raise ParseError, 'Invalid date-time value "%s"' % value
+
+def parseInteger(value):
+    """Parse INTEGER value
+    """
+    try:
+        return int(value)
+    except ValueError:
+        raise ParseError, 'Invalid integer value "%s"' % value
+
+def _splitLine(line):
+    """Split content line to it's lower cased name, flag whether it
+    has any parameters and value
+    """
+    colon = line.find(':')
+    if colon < 0:
+        raise ParseError, 'Invalid content line "%s"' % line
+    name = line[:colon]
+    semicolon = name.find(';')
+    params = semicolon >= 0
+    if params:
+        name = name[:semicolon]
+    return name.lower(), params, line[colon+1:]
+
+def _calendarProperty(properties, name, params, value):
+    """Add calendar level extension property to properties
+    """
+    if name.startswith('x-') and not params:
+        try:
+            properties[name.upper()] = unescapeText(value.decode('utf-8'))
+        except UnicodeDecodeError:
+            raise ParseError, 'Value of "%s" is not UTF-8 encoded' % name
+
+def scanTodos(stream, properties=None):
+    """Yield (start, end, lines, key) for every VTODO of the calendar
+    in stream
+
+    start and end are byte offsets of VTODO in stream, lines are it's
+    unfolded content lines, BEGIN and END lines are included, key is
+    digest of it's data. Todos are not parsed, only calendar structure
+    is checked.
+
+    Calendar level X- properties (without parameters) are collected
+    into properties dict if it's given, see readProperties.
+    """
+    stack = []
+    lines = None
+    for start, end, line, data in unfold(stream):
+        name, params, value = _splitLine(line)
+        if lines is not None:
+            lines.append(line)
+            hash.update(data)
+        elif properties is not None and len(stack) == 1:
+            _calendarProperty(properties, name, params, value)
+
+        if name == 'begin':
+            value = value.upper()
+            if not stack and value != 'VCALENDAR':
+                raise ParseError, 'Calendar should start with VCALENDAR'
+            stack.append(value)
+            if len(stack) == 2 and value == 'VTODO':
+                lines = [line]
+                hash = md5(data)
+                todoStart = start
+        elif name == 'end':
+            value = value.upper()
+            if not stack or stack.pop() != value:
+                raise ParseError, 'Unexpected "END:%s" line' % value
+            if lines is not None and len(stack) == 1:
+                yield todoStart, end, lines, hash.digest()
+                lines = None
+            elif not stack:
+                # only the first calendar is read, just like readOne does
+                return
+
+    if stack:
+        raise ParseError, 'Unexpected end of calendar data'
+    raise ParseError, 'No calendar data found'
+
+def parseTodo(lines):
+    """Create todo from VTODO content lines given by scanTodos
+    """
+    properties = {}
+    depth = 0
+    for line in lines[1:-1]:
+        name, params, value = _splitLine(line)
+        if name == 'begin':
+            depth += 1
+        elif name == 'end':
+            depth -= 1
+        if depth or name in properties:
+            continue
+        if name not in TODO_PROPERTIES:
+            if '.' in name and name.split('.', 1)[1] in TODO_PROPERTIES:
+                raise ParseError, 'Grouped content lines are not supported'
+            continue
+        if params:
+            raise ParseError, 'Parameters of "%s" are not supported' % name
+        try:
+            value = value.decode('utf-8')
+        except UnicodeDecodeError:
+            raise ParseError, 'Value of "%s" is not UTF-8 encoded' % name
+        if name in TEXT_PROPERTIES:
+            value = unescapeText(value)
+        elif name in DATETIME_PROPERTIES:
+            value = parseDateTime(value)
+        elif name in INTEGER_PROPERTIES:
+            value = parseInteger(value)
+        properties[name] = value
+
+    if 'uid' not in properties or 'summary' not in properties:
+        raise ParseError, 'VTODO without UID or SUMMARY'
+    kw = {}
+    for name, value in properties.items():
+        kw[TODO_PROPERTIES[name]] = value
+    return Todo(**kw)
+
+def digest(data):
+    """Return digest of component data to find out whether
+    it was changed
+    """
+    return md5(data).digest()
+
+def readProperties(stream, depth=0):
+    """Return dict of calendar level X- properties found in stream
+
+    Names are upper cased, values are unescaped TEXT. Stream is a part
+    of calendar, which starts at the given depth of components (0 for
+    the beginning of the calendar, 1 for the content of VCALENDAR).
+    """
+    properties = {}
+    for start, end, line, data in unfold(stream):
+        name, params, value = _splitLine(line)
+        if name == 'begin':
+            depth += 1
+        elif name == 'end':
+            depth -= 1
+        elif depth == 1:
+            _calendarProperty(properties, name, params, value)
+    return properties
+
+def copyCalendar(stream, out, names, insert='', depth=0):
+    """Copy part of calendar from stream to out without calendar level
+    properties of the given (lower cased) names
+
+    insert is written right after BEGIN:VCALENDAR line, stream starts
+    at the given depth of components (see readProperties).
+    """
+    for start, end, line, data in unfold(stream):
+        name, params, value = _splitLine(line)
+        if name == 'begin':
+            depth += 1
+        elif name == 'end':
+            depth -= 1
+        elif depth == 1 and name in names:
+            continue
+        out.write(data)
+        if name == 'begin' and depth == 1:
+            out.write(insert)
+
+def readTodos(stream, properties=None):
+    """Yield Todo object for every VTODO of the calendar in stream
+
+    Todos are yielded in the order they appear in the file, without
+    any hierarchy. Stream should yield lines of UTF-8 encoded data,
+    opened file will do. Byte offsets and digest of the VTODO are kept
+    on the todo, so that it could be copied as is during the dump or
+    skipped during the reload if it isn't changed. Calendar properties
+    are collected into properties dict if it's given.
+    """
+    for start, end, lines, key in scanTodos(stream, properties):
+        todo = parseTodo(lines)
+        todo._span = (start, end)
+        todo._digest = key
+        todo._clean()
+        yield todo
+
+def formatDateTime(value):
+    """Format date-time value, values which are already strings
+    are left as they are
+    """
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None and value.utcoffset() == _zero:
+            # the same as vobject writes UTC date-times
+            return '%04d%02d%02dT%02d%02d%02dZ' % (value.year, value.month,
+                value.day, value.hour, value.minute, value.second)
+        if dateTimeToString is None:
+            _importVObject()
+        return dateTimeToString(value, True)
+    return value
+
+def timeStamp():
+    """Return current UTC date-time formatted for iCalendar
+    """
+    return formatDateTime(datetime.datetime.now(utc))
+
+def foldLine(stream, line, lineLength=75):
+    """Fold UTF-8 encoded content line and write it to stream
+    
+    Output is the same as of vobject's foldOneLine, multi-byte characters
+    are not broken across lines, but line is cut in slices instead of
+    being written character by character.
+    """
+    start = 0
+    limit = lineLength
+    while len(line) - start > limit:
+        end = start + limit
+        # step back to the first byte of character which doesn't fit
+        while end > start and '\x80' <= line[end] <= '\xbf':
+            end -= 1
+        stream.write(line[start:end])
+        stream.write('\r\n ')
+        start = end
+        # the leading space takes one byte of the next line
+        limit = lineLength - 1
+    stream.write(line[start:])
+    stream.write('\r\n')
+
+def writeHeader(stream, lineLength=75):
+    """Write beginning of the calendar to stream
+    """
+    stream.write('BEGIN:VCALENDAR\r\n')
+    stream.write('VERSION:2.0\r\n')
+    if PRODID is None:
+        _importVObject()
+    foldLine(stream, ('PRODID:' + escapeText(PRODID)).encode('utf-8'),
+             lineLength)
+
+def writeProperties(stream, properties, lineLength=75):
+    """Write calendar level properties to stream, sorted by name
+    """
+    names = properties.keys()
+    names.sort()
+    for name in names:
+        foldLine(stream, (name + ':' + escapeText(properties[name])).encode(
+            'utf-8'), lineLength)
+
+def writeFooter(stream):
+    """Write end of the calendar to stream
+    """
+    stream.write('END:VCALENDAR\r\n')
+
+def formatTodo(todo, dtstamp):
+    """Return list of UTF-8 encoded (not folded) content lines of todo
+
+    Children of the todo are not taken into account. Just like vobject
+    does we add required DTSTAMP if todo doesn't have it, dtstamp is
+    used as it's value.
+    """
+    lines = ['BEGIN:VTODO']
+    for attr, name in TODO_LINES:
+        value = getattr(todo, attr)
+        if value is None:
+            if attr != 'dtstamp':
+                continue
+            value = dtstamp
+        elif attr in ('summary', 'uid', 'related_to'):
+            value = escapeText(value)
+        elif attr in ('completed', 'created', 'dtstamp', 'last_modified'):
+            value = formatDateTime(value)
+        elif attr in INTEGER_ATTRIBUTES:
+            value = str(value)
+        line = name + ':' + value
+        if isinstance(line, unicode):
+            line = line.encode('utf-8')
+        lines.append(line)
+    lines.append('END:VTODO')
+    return lines
+
+def writeTodo(stream, todo, dtstamp, lineLength=75):
+    """Write VTODO component of todo to stream
+
+    Return written data.
+    """
+    buf = StringIO()
+    for line in formatTodo(todo, dtstamp):
+        foldLine(buf, line, lineLength)
+    data = buf.getvalue()
+    stream.write(data)
+    return data
+
+def writeTodos(stream, todos, lineLength=75):
+    """Write calendar with given todos to stream
+
+    Todos are written in the given order. Content lines are written as
+    soon as they are formatted, so stream should be buffered, opened
+    file will do.
+    """
+    writeHeader(stream, lineLength)
+    dtstamp = timeStamp()
+    for todo in todos:
+        writeTodo(stream, todo, dtstamp, lineLength)
+    writeFooter(stream)
@@ -11,12 +11,23 @@ data file. After reading, processing, altering KArm data (mainly
 tasks) you can dump back KArm data into it's file storage.
 
 At the moment only tasks (todos) are taken into account. Events or
-any other KArm (iCalendar) components are not implemented yet.
+any other KArm (iCalendar) components are not implemented yet. Though
+they are kept in the storage file when it is dumped incrementally,
+that is when only changed todos are re-written.
 """
-from vobject import iCalendar, readOne
+import os
+import stat
+import shutil
+import tempfile
+from cStringIO import StringIO
 
+import timing
 from utils import prettyTime
-from todo import Todo
+from todo import Todo, FIELDS, PARENT_BCTYPES
+from lazy import MappedStorage
+from ics import readTodos, scanTodos, parseTodo, parseInteger, digest, \
+                writeHeader, writeFooter, writeTodo, timeStamp, \
+                writeProperties, copyCalendar
 from errors import *
 
 class DummyProperty(object):
@@ -25,6 +36,62 @@ class DummyProperty(object):
     value = None
 
 
+def _equal(value, other):
+    """Compare attribute values, naive and aware date-times
+    are not equal
+    """
+    try:
+        return value == other
+    except TypeError:
+        return False
+
+def isOpen(todo):
+    """Filter for KArm.render: only not completed tasks
+    """
+    return not todo.isCompleted()
+
+def hasSessionTime(todo):
+    """Filter for KArm.render: only tasks with session time logged
+    by themselves or any of their contained tasks
+    """
+    return todo.getSubtreeSessionTime() > 0
+
+# any basecamp type of tasks for KArm.find, and the order types are
+# looked up in
+_any = object()
+_lookupOrder = (u'todoitem', u'todolist', u'project', None)
+
+def _related(todo, candidates, order):
+    """Return the one of candidate todos with the same uid todo is
+    related to
+    
+    The one of basecamp type todo's type belongs to is preferred, then
+    the nearest one stored before todo, parents are stored before their
+    children. order maps id of todo to it's position in the storage.
+    """
+    if len(candidates) > 1:
+        candidates = [candidate for candidate in candidates
+                      if candidate is not todo] or candidates
+    if len(candidates) > 1:
+        bctype = PARENT_BCTYPES.get(todo.x_kde_ktimetracker_bctype)
+        candidates = [candidate for candidate in candidates
+                      if candidate.x_kde_ktimetracker_bctype == bctype] or \
+                     candidates
+    if len(candidates) == 1:
+        return candidates[0]
+    position = order[id(todo)]
+    before = [candidate for candidate in candidates
+              if order[id(candidate)] < position]
+    if before:
+        return before[-1]
+    return candidates[0]
+
+def summaryOrder(todo):
+    """Default sort key for KArm.render
+    """
+    return (todo.summary, todo.uid)
+
+
 class KArm(object):
     """KArm class to work with iCalendar formatted data storage
     """
@@ -37,41 +104,223 @@ class KArm(object):
         And during dump karm will create a new file.
         """
         self.file = ''
-        self._calendar = iCalendar()
+        self._calendar = None
         self.todos = {}
+        self.orphans = []
+        self.cycles = []
+        self.duplicates = []
+        # calendar level X- properties (upper cased name -> unicode
+        # value) and the ones which are there in the storage file
+        self.properties = {}
+        self._properties = {}
+        # (bctype, uid) -> todo index of the whole tasks hierarchy
+        self._index = {}
+        # (path, size, mtime) of the file todos were loaded from or dumped
+        # to, and the todos which are there in the order they are stored
+        self._source = None
+        self._stored = []
+        # memory mapped storage todos are lazily loaded from
+        self._storage = None
+        # number of todos written (not copied) by the last dump
+        self._written = 0
     
-    def load(self, file=''):
+    def load(self, file='', native=True, lazy=False):
         """Load data from the file
         
         If file is None then use file path set on initialization.
+        
+        By default file is read with native streaming reader (see ics
+        module). If it finds something it is not able to handle, or
+        native is False, then the whole file is parsed with vobject.
+        
+        If lazy is True then file is memory mapped and todos are only
+        indexed, their attributes are parsed on demand (see lazy
+        module). If file can't be loaded lazily it's loaded as usual.
+        Empty file is loaded as storage without todos.
         """
         if file:
             self.file = file
         
-        # parse iCalendar format into _calendar vobject
-        f = open(self.file, 'r')
-        self._calendar = readOne(f.read())
-        f.close()
+        span = timing.start('load')
+        todos = None
+        properties = {}
+        self._source = None
+        self._stored = []
+        # lazy todos of previous load keep storage mapped while needed
+        self._storage = None
+        if native and lazy:
+            storage = None
+            try:
+                storage = MappedStorage(self.file)
+                todos = list(storage.todos())
+                properties = storage.properties(todos)
+                self._calendar = None
+                self._storage = storage
+                self._source = self._stat(self.file)
+                self._stored = todos
+            except ParseError:
+                if storage is not None:
+                    storage.close()
+                todos = None
+        
+        f = open(self.file, 'rb')
+        try:
+            if todos is not None:
+                pass
+            elif native:
+                try:
+                    todos = list(readTodos(f, properties))
+                    self._calendar = None
+                    self._source = self._stat(self.file)
+                    self._stored = todos
+                except ParseError:
+                    f.seek(0)
+                    properties = {}
+            if todos is None:
+                data = f.read()
+                if not data.strip():
+                    # empty storage has no todos yet
+                    todos = []
+                    self._calendar = None
+                    self._source = self._stat(self.file)
+                else:
+                    # parse iCalendar format into _calendar vobject
+                    # vobject is imported and patched only when it's needed
+                    from vobject import readOne
+                    import patch
+                    self._calendar = readOne(data)
+                    todos = self._calendar2Todos()
+                    properties = self._calendar2Properties()
+        finally:
+            f.close()
         # actuall load of karm tasks
-        self._calendar2Tasks()
+        self._todos2Tasks(todos)
+        self.properties = properties
+        self._properties = properties.copy()
+        timing.count('todos loaded', len(self._index))
+        span.stop()
 
-    def _calendar2Tasks(self):
+    def _calendar2Properties(self):
+        """Return calendar level X- properties of loaded vobject's data
+        """
+        properties = {}
+        for name, lines in self._calendar.contents.items():
+            if name.startswith('x-') and lines and not lines[0].params:
+                properties[name.upper()] = lines[0].value
+        return properties
+
+    def _calendar2Todos(self):
         """Loop through the loaded vobject's data and create
-        appropriate hierarchy of todos
+        todo for each of it's vtodo components
         """
-        todos = {}
-        for item in self._calendar.contents.get('vtodo', []):
-            related_to = item.contents.get('related-to', [DummyProperty,])[0].value
-            todos[related_to] = todos.get(related_to, []) + [item,]
+        return [self._component2Todo(item)
+                for item in self._calendar.contents.get('vtodo', [])]
+
+    def _todos2Tasks(self, todos):
+        """Create appropriate hierarchy of todos from the plain
+        list of them
+        
+        Hierarchy is built in linear time and without recursion, so
+        it's depth is not limited. Todos which can't be reached from
+        the root ones are not added to KArm, but collected (together
+        with their children) into:
+            orphans - todos with not existing parent task
+            cycles - lists of todos related to each other in a cycle,
+                     the first todo of the list is the top of it's subtree
+            duplicates - todos with the same uid and basecamp type as
+                         already added ones, or with the same uid as
+                         another task of the same container
+        
+        Tasks of different basecamp types may have the same uid, todo
+        is related to the one of the type it's basecamp type belongs
+        to, or to the nearest one stored before it.
+        """
+        # uid -> todo, and uid -> todos for uids shared by several todos
+        known = {}
+        same = {}
+        for todo in todos:
+            other = known.setdefault(todo.uid, todo)
+            if other is not todo:
+                same.setdefault(todo.uid, [other]).append(todo)
+        # positions of todos are needed only to choose among the same ones
+        order = None
+        if same:
+            order = dict([(id(todo), i) for i, todo in enumerate(todos)])
+        
+        def related(todo):
+            """Return todo's parent, None if there is no such todo
+            """
+            candidates = same.get(todo.related_to)
+            if candidates is not None:
+                return _related(todo, candidates, order)
+            return known.get(todo.related_to)
+        
+        self.orphans = []
+        self.cycles = []
+        self.duplicates = []
+        
+        # children are grouped by id of their parent todo
+        children = {}
+        orphans = []
+        for todo in todos:
+            parent = None
+            if todo.related_to is not None:
+                parent = related(todo)
+                if parent is None:
+                    orphans.append(todo)
+                    continue
+                parent = id(parent)
+            children.setdefault(parent, []).append(todo)
         
-        # recursively create hierarchy of tasks
-        # starting from the root ones
-        for item in todos.get(None, []):
-            self._component2Task(self, item, todos)
+        # create hierarchy of tasks starting from the root ones
+        self._addTasks(self, children.pop(None, []), children)
+        
+        # whatever is left can't be reached from root tasks,
+        # firstly look for todos which parent doesn't exist
+        for todo in orphans:
+            self.orphans.append(todo)
+            self._addTasks(todo, children.pop(id(todo), []), children)
+        
+        # then walk up from the rest of them, every such path
+        # ends in a cycle
+        for key in children.keys():
+            if not children.get(key):
+                continue
+            path = []
+            index = {}
+            todo = related(children[key][0])
+            while id(todo) in children and id(todo) not in index:
+                index[id(todo)] = len(path)
+                path.append(todo)
+                todo = related(todo)
+            if id(todo) in index:
+                cycle = path[index[id(todo)]:]
+                # break the cycle at it's first task
+                children[id(related(cycle[0]))].remove(cycle[0])
+                self.cycles.append(cycle)
+                self._addTasks(cycle[0], children.pop(id(cycle[0]), []),
+                               children)
+
+    def _addTasks(self, container, todos, children):
+        """Add todos to container together with their children, which
+        are grouped by id of their parent todo
+        
+        Todos which can't be added to the container are collected into
+        duplicates instead.
+        """
+        stack = [(container, todo) for todo in reversed(todos)]
+        while stack:
+            container, todo = stack.pop()
+            try:
+                container.add(todo)
+            except DuplicationError:
+                self.duplicates.append(todo)
+            # now it's time to collect all todo's children
+            for child in reversed(children.pop(id(todo), [])):
+                stack.append((todo, child))
             
-    def _component2Task(self, container, component, data):
-        """Create todo and adds it to container together
-        with it's children
+    def _component2Todo(self, component):
+        """Create todo from vobject's component
         """
         # create todo item
         todo = Todo(uid=component.contents['uid'][0].value,
@@ -87,33 +336,255 @@ class KArm(object):
         if component.contents.get('completed', None) is not None:
             todo.completed = component.contents['completed'][0].value
         if component.contents.get('percent-complete', None) is not None:
-            todo.percent_complete = component.contents['percent-complete'][0].value
+            todo.percent_complete = parseInteger(
+                component.contents['percent-complete'][0].value)
         if component.contents.get('x-kde-ktimetracker-totalsessiontime', None) is not None:
-            todo.x_kde_ktimetracker_totalsessiontime = component.contents['x-kde-ktimetracker-totalsessiontime'][0].value
+            todo.x_kde_ktimetracker_totalsessiontime = parseInteger(
+                component.contents['x-kde-ktimetracker-totalsessiontime'][0].value)
         if component.contents.get('x-kde-ktimetracker-totaltasktime', None) is not None:
-            todo.x_kde_ktimetracker_totaltasktime = component.contents['x-kde-ktimetracker-totaltasktime'][0].value
+            todo.x_kde_ktimetracker_totaltasktime = parseInteger(
+                component.contents['x-kde-ktimetracker-totaltasktime'][0].value)
         if component.contents.get('x-kde-ktimetracker-bctype', None) is not None:
             todo.x_kde_ktimetracker_bctype = component.contents['x-kde-ktimetracker-bctype'][0].value
         
-        # add it to container
-        todo = container.add(todo)
-        
-        # now it's time to collect all todo's children
-        for item in data.get(todo.uid, []):
-            child = self._component2Task(todo, item, data)
-        
         return todo
 
-    def dump(self, file=''):
+    def dump(self, file='', native=True):
         """Dump data back into KArm storage file
+        
+        By default content lines are streamed straight into the file
+        (see ics module), if native is False then vobject calendar is
+        built and serialized instead.
+        
+        If storage file wasn't changed by anyone else since it was
+        loaded or dumped last time, then only new, changed and deleted
+        todos are written, the rest of the file is copied as it is.
         """
         if file:
             self.file = file
         
-        self._tasks2Calendar()
-        f = open(self.file, 'w')
-        f.write(self._calendar.serialize())
-        f.close()
+        span = timing.start('dump')
+        self._written = 0
+        if not native:
+            self._tasks2Calendar()
+            f = open(self.file, 'w')
+            f.write(self._calendar.serialize())
+            f.close()
+            self._source = None
+            self._stored = []
+            self._written = len(self._index)
+        elif self._source is not None and self._stored and \
+             self._source == self._stat(self._source[0]):
+            source = open(self._source[0], 'rb')
+            try:
+                self._stored = self._replace(self._writeChanges, source)
+            finally:
+                source.close()
+            self._source = self._stat(self.file)
+        else:
+            self._stored = self._replace(self._writeTodos, self._walk())
+            self._source = self._stat(self.file)
+        self._properties = self.properties.copy()
+        timing.count('todos written', self._written)
+        span.stop()
+
+    def _replace(self, write, *args):
+        """Call write(f, *args) with temporary file f and then replace
+        storage file with it, return whatever write returns
+        
+        Storage file is never truncated while it's written, so it could
+        be safely memory mapped (see lazy module) or read during the
+        dump. Temporary file replaces the file symbolic link points to
+        and gets it's permissions and owner. Storage file with other hard
+        links is re-written in place instead, so that all of them still
+        refer to the same file.
+        """
+        path = os.path.realpath(self.file)
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(path))
+        f = os.fdopen(fd, 'wb')
+        try:
+            try:
+                result = write(f, *args)
+            finally:
+                f.close()
+            try:
+                info = os.stat(path)
+            except OSError:
+                info = None
+            if info is not None and info.st_nlink > 1:
+                self._rewrite(temp, path)
+                os.remove(temp)
+                return result
+            if info is not None:
+                os.chmod(temp, stat.S_IMODE(info.st_mode))
+                try:
+                    os.chown(temp, info.st_uid, info.st_gid)
+                except OSError:
+                    # only owner could be kept by ordinary user
+                    pass
+            else:
+                umask = os.umask(0)
+                os.umask(umask)
+                os.chmod(temp, 0666 & ~umask)
+            os.rename(temp, path)
+        except:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+        return result
+
+    def _rewrite(self, source, path):
+        """Copy file at source path over the file at path in place
+        """
+        if self._storage is not None:
+            # lazy todos are read while mapped file is still the same
+            for todo in self._stored:
+                if getattr(todo, '_storage', None) is not None:
+                    todo._unmap()
+            self._storage = None
+        f = open(path, 'r+b')
+        try:
+            data = open(source, 'rb')
+            try:
+                shutil.copyfileobj(data, f)
+            finally:
+                data.close()
+            f.truncate()
+        finally:
+            f.close()
+
+    def _writeChanges(self, f, source):
+        """Write changed todos into the copy of the source file
+        
+        Return list of written todos.
+        """
+        todos = list(self._walk())
+        new = dict([(id(todo), todo) for todo in todos])
+        dtstamp = timeStamp()
+        stored = []
+        
+        # source file is copied in the order of stored todos, with
+        # content between them (calendar header, other components)
+        # left as it is, unless calendar properties have changed
+        position = 0
+        for todo in self._stored:
+            start, end = todo._span
+            if position == 0 and self.properties != self._properties:
+                self._copyCalendar(source, f, position, start, 0)
+            else:
+                self._copy(source, f, position, start)
+            position = end
+            if new.pop(id(todo), None) is None:
+                # todo was deleted
+                continue
+            offset = f.tell()
+            data = None
+            if todo.dirty:
+                data = writeTodo(f, todo, dtstamp)
+            else:
+                self._copy(source, f, start, end)
+            self._store(todo, offset, f.tell(), stored, data)
+        # added todos go right after the last stored one
+        for todo in todos:
+            if id(todo) in new:
+                offset = f.tell()
+                data = writeTodo(f, todo, dtstamp)
+                self._store(todo, offset, f.tell(), stored, data)
+        if self.properties != self._properties:
+            # without stored todos the whole calendar is the tail
+            self._copyCalendar(source, f, position, None,
+                               self._stored and 1 or 0)
+        else:
+            self._copy(source, f, position, None)
+        return stored
+
+    def _writeTodos(self, f, todos):
+        """Write whole calendar with given todos to f
+        
+        Return list of written todos.
+        """
+        stored = []
+        dtstamp = timeStamp()
+        writeHeader(f)
+        writeProperties(f, self.properties)
+        for todo in todos:
+            offset = f.tell()
+            data = writeTodo(f, todo, dtstamp)
+            self._store(todo, offset, f.tell(), stored, data)
+        writeFooter(f)
+        return stored
+
+    def _store(self, todo, start, end, stored, data=None):
+        """Remember where todo is in the storage file, data is what
+        was written for todo, None if it was copied
+        """
+        todo._span = (start, end)
+        if data is not None:
+            todo._digest = digest(data)
+            self._written += 1
+        todo._clean()
+        stored.append(todo)
+
+    def _copy(self, source, f, start, end, size=65536):
+        """Copy source file bytes from start till end offsets to f,
+        if end is None copy till the end of source
+        """
+        if source.tell() != start:
+            source.seek(start)
+        while end is None or start < end:
+            if end is None:
+                data = source.read(size)
+            else:
+                data = source.read(min(size, end - start))
+            if not data:
+                break
+            f.write(data)
+            start += len(data)
+
+    def _copyCalendar(self, source, f, start, end, depth):
+        """Copy source file bytes from start till end offsets to f with
+        calendar properties replaced by the current ones
+        
+        Properties are written right after BEGIN:VCALENDAR line, copied
+        part of the source starts at the given depth of components.
+        """
+        source.seek(start)
+        if end is None:
+            data = source.read()
+        else:
+            data = source.read(end - start)
+        names = dict.fromkeys([name.lower() for name in
+                               self.properties.keys() +
+                               self._properties.keys()])
+        insert = StringIO()
+        writeProperties(insert, self.properties)
+        copyCalendar(data.splitlines(True), f, names, insert.getvalue(),
+                     depth)
+
+    def _stat(self, path):
+        """Return path together with size and modification time of it
+        """
+        try:
+            info = os.stat(path)
+        except OSError:
+            return None
+        return (path, info.st_size, info.st_mtime)
+
+    def _walk(self):
+        """Iterate over all todos in the order they are dumped
+        """
+        # keep orphaned, cycled and duplicated tasks in the storage
+        # as they are
+        for todo in self.todos.values() + self._unreachable():
+            for item in todo.walk():
+                yield item
+
+    def _unreachable(self):
+        """Return top todos of subtrees which are not in the tasks
+        hierarchy
+        """
+        return self.orphans + [cycle[0] for cycle in self.cycles] + \
+               self.duplicates
 
     def _tasks2Calendar(self):
         """Loop through the todos hierarchy and transform them
@@ -121,9 +592,18 @@ class KArm(object):
         """
         # TODO: it would be great to have here some smart merging
         # instead of simple purge
+        # vobject is imported and patched only when it's needed
+        from vobject import iCalendar
+        import patch
         self._calendar = iCalendar()
+        for name, value in self.properties.items():
+            self._calendar.add(name).value = value
         for todo in self.todos.values():
             self._task2Component(todo, self._calendar)
+        # keep orphaned, cycled and duplicated tasks in the storage
+        # as they are
+        for todo in self._unreachable():
+            self._task2Component(todo, self._calendar)
     
     def _task2Component(self, todo, calendar):
         """Serialize todo together with it's children back
@@ -144,11 +624,11 @@ class KArm(object):
         if todo.completed is not None:
             component.add('completed').value = todo.completed
         if todo.percent_complete is not None:
-            component.add('percent-complete').value = todo.percent_complete
+            component.add('percent-complete').value = str(todo.percent_complete)
         if todo.x_kde_ktimetracker_totalsessiontime is not None:
-            component.add('X-KDE-ktimetracker-totalSessionTime').value = todo.x_kde_ktimetracker_totalsessiontime
+            component.add('X-KDE-ktimetracker-totalSessionTime').value = str(todo.x_kde_ktimetracker_totalsessiontime)
         if todo.x_kde_ktimetracker_totaltasktime is not None:
-            component.add('X-KDE-ktimetracker-totalTaskTime').value = todo.x_kde_ktimetracker_totaltasktime
+            component.add('X-KDE-ktimetracker-totalTaskTime').value = str(todo.x_kde_ktimetracker_totaltasktime)
         if todo.x_kde_ktimetracker_bctype is not None:
             component.add('X-KDE-ktimetracker-bctype').value = todo.x_kde_ktimetracker_bctype
         
@@ -161,14 +641,235 @@ class KArm(object):
     def reload(self):
         """Reload data merging data from changed file with already
         loaded (and maybe changed) data.
+        
+        Nothing is done if size and modification time of the file are
+        the same as they were after load or last dump. Otherwise only
+        those VTODOs of the file which are changed (their content
+        differs from what was loaded or dumped) are parsed and merged
+        into loaded todos:
+            - attribute changed only in the file is taken from the file
+            - attribute changed only in memory is kept
+            - attribute changed in both places is kept as well, except
+              session and total times: time logged into the file since
+              load is added to the in-memory value
+            - task moved to another parent in the file is moved in
+              memory as well unless it's related_to is changed in memory
+            - task added to the file is added to it's parent task, or
+              to orphans if the parent is not found, though if task
+              with the same uid was added in memory it is kept
+            - task deleted from the file is deleted in memory unless
+              it has changes in memory, it's remaining children
+              become orphans
+            - task deleted in memory stays deleted
+            - calendar property changed only in the file is taken from
+              the file, the one changed in memory is kept
+        
+        Return True if file was changed and merged, False otherwise.
+        Only storage loaded with native reader can be reloaded, if
+        changed VTODO can't be parsed by it ParseError is raised and
+        loaded data is left untouched.
+        """
+        if self._source is None:
+            raise KArmError, 'Storage was not loaded with native reader'
+        path = self._source[0]
+        source = self._stat(path)
+        if source == self._source:
+            return False
+        span = timing.start('reload')
+        
+        # find out which of the stored todos are still there, and
+        # parse changed and added ones
+        previous = {}
+        for todo in self._stored:
+            key = todo._digest
+            if key is None:
+                # lazily loaded todo which is not parsed yet
+                key = todo._digest = self._storage.digest(todo._where)
+            previous[key] = todo
+        stored = []
+        properties = {}
+        f = open(path, 'rb')
+        try:
+            for start, end, lines, key in scanTodos(f, properties):
+                todo = previous.pop(key, None)
+                if todo is None:
+                    todo = parseTodo(lines)
+                    todo._clean()
+                    todo._digest = key
+                    stored.append((start, end, todo, True))
+                else:
+                    stored.append((start, end, todo, False))
+        finally:
+            f.close()
+        
+        # whatever left in previous todos is changed or deleted
+        # from the file, look them up by uid and basecamp type they
+        # were stored with
+        removed = {}
+        for todo in previous.values():
+            removed[(todo.dirty.get('x_kde_ktimetracker_bctype',
+                                    todo.x_kde_ktimetracker_bctype),
+                     todo.dirty.get('uid', todo.uid))] = todo
+        present = dict([(id(todo), todo) for todo in self._walk()])
+        
+        added = []
+        for i in range(len(stored)):
+            start, end, todo, changed = stored[i]
+            if changed:
+                incoming = todo
+                todo = removed.pop(incoming._key(), None)
+                if todo is None:
+                    todo = self._index.get(incoming._key())
+                if todo is None:
+                    added.append(incoming)
+                    todo = incoming
+                else:
+                    self._mergeTodo(todo, incoming)
+                todo._digest = incoming._digest
+            todo._span = (start, end)
+            stored[i] = todo
+        
+        self._addTodos(added)
+        self._removeTodos(removed.values(), present)
+        self._mergeProperties(properties)
+        
+        self._source = source
+        self._stored = stored
+        span.stop()
+        return True
+
+    def _mergeProperties(self, properties):
+        """Merge calendar properties of changed file into loaded ones
+        """
+        for name in dict.fromkeys(properties.keys() +
+                                  self._properties.keys()):
+            if self.properties.get(name) != self._properties.get(name):
+                # changed in memory
+                continue
+            if properties.has_key(name):
+                self.properties[name] = properties[name]
+            elif self.properties.has_key(name):
+                del self.properties[name]
+        self._properties = properties
+
+    def _mergeTodo(self, todo, incoming):
+        """Merge attributes of the todo changed in file into loaded one
+        """
+        related_to = todo.related_to
+        # todo could be added in memory, not loaded from the file
+        stored = todo._span is not None
+        for name in FIELDS:
+            value = getattr(incoming, name)
+            if todo.dirty.has_key(name):
+                base = todo.dirty[name]
+                if _equal(value, base):
+                    continue
+                if stored and name in ('x_kde_ktimetracker_totalsessiontime',
+                                       'x_kde_ktimetracker_totaltasktime'):
+                    logged = (value or 0) - (base or 0)
+                    setattr(todo, name, (getattr(todo, name) or 0) + logged)
+                # from now on file's value is the stored one
+                todo.dirty[name] = value
+            elif not _equal(getattr(todo, name), value):
+                setattr(todo, name, value)
+                del todo.dirty[name]
+        
+        if self._index.get(todo._key()) is todo and \
+           not _equal(related_to, todo.related_to):
+            self._relocate(todo)
+
+    def _relocate(self, todo):
+        """Move loaded todo to the parent it is related to
+        """
+        try:
+            self.move(todo.uid, todo.related_to,
+                      todo.x_kde_ktimetracker_bctype)
+        except NotFoundError:
+            # parent task is not loaded
+            self._container(todo).delete(todo.uid)
+            self.orphans.append(todo)
+        except KArmError:
+            # task can't be moved into it's own child
+            pass
+        # related_to is the same as stored one
+        if todo.dirty.has_key('related_to'):
+            del todo.dirty['related_to']
+
+    def _addTodos(self, todos):
+        """Add todos created from the file to the tasks hierarchy
+        """
+        known = {}
+        order = {}
+        for todo in todos:
+            known.setdefault(todo.uid, []).append(todo)
+            order[id(todo)] = len(order)
+        # children of added todos are grouped by id of their parent,
+        # the rest are added to loaded containers
+        children = {}
+        containers = []
+        for todo in todos:
+            if todo.related_to is None:
+                containers.append((self, todo))
+            elif todo.related_to in known:
+                parent = _related(todo, known[todo.related_to], order)
+                children.setdefault(id(parent), []).append(todo)
+            else:
+                try:
+                    parent = self._findParent(todo, todo.related_to)
+                except NotFoundError:
+                    parent = None
+                containers.append((parent, todo))
+        for container, todo in containers:
+            if container is None:
+                self.orphans.append(todo)
+                self._addTasks(todo, children.pop(id(todo), []), children)
+            else:
+                self._addTasks(container, [todo], children)
+        # the rest are related to each other in cycles
+        for todos in children.values():
+            for todo in todos:
+                self.orphans.append(todo)
+
+    def _findParent(self, todo, uid):
+        """Find task of the given uid todo could be contained in, the one
+        of basecamp type todo's type belongs to is preferred
+        """
+        bctype = PARENT_BCTYPES.get(todo.x_kde_ktimetracker_bctype)
+        if bctype is not None:
+            try:
+                return self.find(uid, bctype)
+            except NotFoundError:
+                pass
+        return self.find(uid)
+
+    def _removeTodos(self, todos, present):
+        """Delete todos which were deleted from the file
         """
+        removed = dict([(id(todo), todo) for todo in todos])
+        for todo in todos:
+            if id(todo) not in present or todo.dirty:
+                continue
+            if todo in self.orphans:
+                self.orphans.remove(todo)
+            elif todo in self.duplicates:
+                self.duplicates.remove(todo)
+            else:
+                self._container(todo).delete(todo.uid)
+            for child in todo.todos.values():
+                if id(child) not in removed:
+                    todo.todos.pop(child.uid)
+                    child._parent = None
+                    self.orphans.append(child)
+            todo._invalidate()
 
     def add(self, todo):
         """Add a root todo to KArm
         """
         if self.todos.has_key(todo.uid):
             raise DuplicationError, 'There already exists root task with "%s" id' % todo.uid
+        todo._attach(self._index)
         self.todos[todo.uid] = todo
+        todo._parent = None
         return todo
     
     def delete(self, uid):
@@ -178,25 +879,140 @@ class KArm(object):
             raise NotFoundError, 'Root task with "%s" id not found' % uid
         todo = self.todos[uid]
         del self.todos[uid]
+        todo._detach()
+        return todo
+
+    def find(self, uid, bctype=_any):
+        """Find todo on any level of tasks hierarchy
+        
+        Basecamp projects, todo lists and todo items have ids of their
+        own, so tasks of different basecamp types may have the same uid.
+        Without bctype the first task of todoitem, todolist, project and
+        no type at all which has the uid is returned, tasks of other
+        types are found only with their bctype.
+        """
+        if bctype is _any:
+            for bctype in _lookupOrder:
+                todo = self._index.get((bctype, uid))
+                if todo is not None:
+                    return todo
+        else:
+            todo = self._index.get((bctype, uid))
+            if todo is not None:
+                return todo
+        raise NotFoundError, 'Task with "%s" id not found' % uid
+
+    def move(self, uid, parent=None, bctype=_any):
+        """Move todo together with it's children into another task
+        
+        If parent is None todo becomes a root one. Todo is looked up
+        with the given bctype (see find), it's new parent is the task of
+        the basecamp type todo's type belongs to, if there's such.
+        """
+        todo = self.find(uid, bctype)
+        if parent is None:
+            container = self
+        else:
+            container = self._findParent(todo, parent)
+            ancestor = container
+            while ancestor is not None:
+                if ancestor is todo:
+                    raise KArmError, 'Task with "%s" id can not be moved ' \
+                        'into itself or it\'s child task' % uid
+                ancestor = ancestor._parent
+        if container.todos.get(uid, todo) is not todo:
+            raise DuplicationError, 'There already exists task with "%s" ' \
+                'id in "%s" task' % (uid, parent)
+        
+        self._container(todo).todos.pop(uid)
+        if todo._parent is not None:
+            todo._parent._invalidate()
+        if not container.todos:
+            # leaf todos share the same empty mapping
+            container.todos = {}
+        container.todos[uid] = todo
+        if parent is None:
+            todo._parent = None
+            todo.related_to = None
+        else:
+            todo._parent = container
+            todo.related_to = container.uid
+            container._invalidate()
+        return todo
+
+    def rekey(self, old_uid, new_uid, bctype=_any):
+        """Change todo's uid keeping it on it's place in tasks hierarchy
+        
+        Todo is looked up with the given bctype (see find). Children of
+        the todo are related to the new uid as well.
+        """
+        todo = self.find(old_uid, bctype)
+        container = self._container(todo)
+        if container.todos.has_key(new_uid):
+            raise DuplicationError, 'There already exists task with "%s" id' % new_uid
+        
+        # uid index is updated by todo itself
+        todo.uid = new_uid
+        del container.todos[old_uid]
+        container.todos[new_uid] = todo
+        for child in todo.todos.values():
+            child.related_to = new_uid
         return todo
+
+    def _container(self, todo):
+        """Return task or KArm itself todo is contained in
+        """
+        if todo._parent is None:
+            return self
+        return todo._parent
     
     def __str__(self):
         """Print hierarchy of tasks
         """
-        out = ""
-        for todo in self.todos.values():
-            out += self._strTask(todo)
-        return out.encode('utf-8')
-    
-    def _strTask(self, todo, indent=""):
-        sessionTime = todo.x_kde_ktimetracker_totalsessiontime or '0'
-        totalTime = todo.x_kde_ktimetracker_totaltasktime or '0'
-        out = '%s%s [%s] (%s, total:%s)\n' % (indent,
-                                              todo.summary,
-                                              todo.uid,
-                                              prettyTime(int(sessionTime)),
-                                              prettyTime(int(totalTime)))
-        # loop through the children recursively
-        for todo in todo.todos.values():
-            out += self._strTask(todo, '%s    ' % indent)
-        return out
+        out = StringIO()
+        self.render(out)
+        return out.getvalue()
+
+    def render(self, stream, depth=None, filter=None, key=summaryOrder,
+               indent='    '):
+        """Write hierarchy of tasks to stream, line by line
+        
+        Each task is written as UTF-8 encoded line with it's summary,
+        uid, session and total time, contained tasks are indented.
+            depth - how many levels of tasks to write, all by default
+            filter - callable which gets a task and returns whether it
+                     should be written, tasks it filters out are skipped
+                     together with their contained tasks (see isOpen
+                     and hasSessionTime)
+            key - sort key for tasks of the same level, tasks with equal
+                  keys are written in the same order on every run
+        """
+        stack = [(todo, 0) for todo in self._children(self, filter, key)]
+        stack.reverse()
+        while stack:
+            todo, level = stack.pop()
+            sessionTime = todo.x_kde_ktimetracker_totalsessiontime or 0
+            totalTime = todo.x_kde_ktimetracker_totaltasktime or 0
+            line = u'%s%s [%s] (%s, total:%s)\n' % (indent * level,
+                                                     todo.summary,
+                                                     todo.uid,
+                                                     prettyTime(sessionTime),
+                                                     prettyTime(totalTime))
+            stream.write(line.encode('utf-8'))
+            level += 1
+            if depth is not None and level >= depth:
+                continue
+            children = self._children(todo, filter, key)
+            children.reverse()
+            stack.extend([(child, level) for child in children])
+
+    def _children(self, container, filter, key):
+        """Return sorted list of container's tasks which pass filter
+        """
+        todos = container.todos.values()
+        if filter is not None:
+            todos = [todo for todo in todos if filter(todo)]
+        # uid makes order of tasks with equal keys stable
+        todos = [(key(todo), todo.uid, todo) for todo in todos]
+        todos.sort()
+        return [todo for k, uid, todo in todos]
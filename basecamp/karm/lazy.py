@@ -0,0 +1,216 @@
+"""Lazy loading of KArm storage
+
+Storage file is memory mapped and scanned once for VTODO components.
+Only UID, RELATED-TO and basecamp type of each VTODO are decoded,
+that's enough to build the hierarchy of tasks. The rest of todo's
+attributes are parsed from the mapped file when any of them is
+accessed for the first time, and digest of VTODO (see KArm.reload)
+is calculated only when storage is reloaded.
+
+Storage with something native reader can't handle may still fail
+(with ParseError) when todo is parsed. Mapped file should not be
+changed in place while it is in use (any later access to not yet
+parsed todos raises KArmError then). Replacing the file with another
+one, the way KArm and KTimeTracker dump their storages, is fine.
+"""
+import os
+import re
+import mmap
+
+from todo import BaseTodo, _fields, _empty, _bctypes
+from ics import TODO_PROPERTIES, unfold, unescapeText, parseTodo, digest, \
+     readProperties
+from errors import KArmError, ParseError
+
+_skeletonLine = re.compile(r'^(?:(BEGIN|END):VTODO\r?$|'
+                           r'(UID|RELATED-TO|X-KDE-KTIMETRACKER-BCTYPE):)',
+                           re.M | re.I)
+_calendarStart = re.compile(r'\s*BEGIN:VCALENDAR\r?\n', re.I)
+# attributes of lazy todo which are known without parsing it
+_skeleton = ('uid', 'related_to', 'x_kde_ktimetracker_bctype')
+# parameters of these properties are not supported by native parser
+_unsupported = re.compile(r'^(?:%s);' % '|'.join([re.escape(name) for name in
+                          TODO_PROPERTIES.keys()]), re.M | re.I)
+
+
+class MappedStorage(object):
+    """Memory mapped storage file
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.stat = self._fstat()
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError), e:
+            self.file.close()
+            raise ParseError, 'Can not map storage file: %s' % e
+
+    def _fstat(self):
+        info = os.fstat(self.file.fileno())
+        return (info.st_size, info.st_mtime)
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def _value(self, pos):
+        """Return unfolded value of content line which starts at pos
+        """
+        data = self.data
+        chunks = []
+        while True:
+            end = data.find('\n', pos)
+            if end < 0:
+                end = len(data)
+            chunks.append(data[pos:end].rstrip('\r'))
+            if data[end+1:end+2] not in (' ', '\t'):
+                break
+            pos = end + 2
+        try:
+            return unescapeText(''.join(chunks).decode('utf-8'))
+        except UnicodeDecodeError:
+            raise ParseError, 'Value is not UTF-8 encoded'
+
+    def todos(self):
+        """Yield LazyTodo for every VTODO in the storage
+        """
+        data = self.data
+        if _calendarStart.match(data) is None:
+            raise ParseError, 'Calendar should start with VCALENDAR'
+        if _unsupported.search(data) is not None:
+            raise ParseError, 'Parameters of todo properties are not supported'
+        start = None
+        parents = {}
+        for match in _skeletonLine.finditer(data):
+            kind = match.group(1)
+            if kind is not None:
+                kind = kind.upper()
+                if kind == 'BEGIN':
+                    if start is not None:
+                        raise ParseError, 'Nested VTODO components'
+                    start = match.start()
+                    uid = related_to = bctype = None
+                    continue
+                if start is None:
+                    raise ParseError, 'Unexpected "END:VTODO" line'
+                end = data.find('\n', match.end()) + 1 or len(data)
+                if uid is None:
+                    raise ParseError, 'VTODO without UID'
+                yield LazyTodo(self, uid, related_to, bctype, (start, end))
+                start = None
+            elif start is not None:
+                name = match.group(2).upper()
+                if name == 'UID':
+                    if uid is None:
+                        uid = self._value(match.end())
+                elif name == 'RELATED-TO':
+                    if related_to is None:
+                        related_to = self._value(match.end())
+                        # children of the same task share it's uid
+                        related_to = parents.setdefault(related_to,
+                                                        related_to)
+                elif bctype is None:
+                    bctype = self._value(match.end())
+        if start is not None:
+            raise ParseError, 'Unexpected end of calendar data'
+
+    def properties(self, todos):
+        """Return calendar level X- properties, todos are the ones
+        yielded by todos method
+
+        Only the calendar header and the tail after the last todo are
+        read, properties are not expected among todos.
+        """
+        data = self.data
+        if not todos:
+            return readProperties(data[:].splitlines(True))
+        properties = readProperties(
+            data[:todos[0]._span[0]].splitlines(True))
+        properties.update(readProperties(
+            data[todos[-1]._span[1]:].splitlines(True), 1))
+        return properties
+
+    def _check(self):
+        """Make sure mapped file is still the one which was loaded
+        """
+        if self._fstat() != self.stat:
+            raise KArmError, 'Storage file was changed since it was ' \
+                'loaded, todo can not be read'
+
+    def digest(self, span):
+        """Return digest of todo stored in the given span of the file
+        """
+        self._check()
+        start, end = span
+        return digest(self.data[start:end])
+
+    def parse(self, span):
+        """Parse todo stored in the given span of the file
+        """
+        self._check()
+        start, end = span
+        lines = [line for line_start, line_end, line, data
+                 in unfold(self.data[start:end].splitlines(True))]
+        return parseTodo(lines)
+
+
+class LazyTodo(BaseTodo):
+    """Todo with only uid, related_to and basecamp type attributes loaded
+
+    Other attributes are parsed from the storage into a separate Todo
+    on the first access to any of them. Until then lazy todo keeps
+    nothing but it's place in the tasks hierarchy and in the storage.
+    """
+    __slots__ = _skeleton + ('_storage', '_where', '_todo')
+
+    def __init__(self, storage, uid, related_to, bctype, span):
+        setattr = object.__setattr__
+        setattr(self, 'dirty', _empty)
+        setattr(self, 'uid', uid)
+        setattr(self, 'related_to', related_to)
+        setattr(self, 'x_kde_ktimetracker_bctype', _bctypes.get(bctype, bctype))
+        setattr(self, 'todos', _empty)
+        setattr(self, '_parent', None)
+        setattr(self, '_index', None)
+        setattr(self, '_span', span)
+        # digest is calculated only when it's needed (see digest method)
+        setattr(self, '_digest', None)
+        setattr(self, '_totals', None)
+        setattr(self, '_storage', storage)
+        # _span changes when todo is dumped, while storage stays the same
+        setattr(self, '_where', span)
+        setattr(self, '_todo', None)
+
+    def __getattr__(self, name):
+        # called only for attributes which are not set on lazy todo
+        if name not in _fields:
+            raise AttributeError, name
+        return getattr(self._load(), name)
+
+    def _setattr(self, name, value):
+        if name in _fields and name not in _skeleton:
+            object.__setattr__(self._load(), name, value)
+        else:
+            object.__setattr__(self, name, value)
+
+    def _load(self):
+        """Return todo with the rest of attributes parsed from the storage
+        """
+        todo = self._todo
+        if todo is None:
+            todo = self._storage.parse(self._where)
+            todo._clean()
+            object.__setattr__(self, '_todo', todo)
+        return todo
+
+    def _unmap(self):
+        """Read whatever is still needed from the storage, so that
+        todo doesn't depend on the mapped file any more
+        """
+        self._load()
+        if self._digest is None:
+            object.__setattr__(self, '_digest',
+                               self._storage.digest(self._where))
+        object.__setattr__(self, '_storage', None)
@@ -0,0 +1,379 @@
+"""Outbox journal of basecamp operations
+
+Checkin first plans what should be sent to basecamp and writes all of
+the operations into the journal, then submits them concurrently. Each
+operation is marked sent in the journal right before its request is
+made, and each confirmed one is marked done right away, so if checkin
+is interrupted, the next run submits only operations which were not
+sent yet and doesn't post the same time entries once again.
+
+Journal is a text file, one record per line, every line is appended
+and synced to disk at once:
+
+    op <id> <method> <uid> <depends> <argument>...
+    minutes <id> <minutes>
+    sent <id>
+    unsent <id>
+    done <id> <result>
+    applied <id>
+
+Arguments are name=value pairs, positional ones are named by their
+index. Values are tagged with their type and quoted (see encode). Line
+without trailing newline is the one which was being written during the
+crash and it's ignored.
+
+Request which failed before reaching basecamp (see notSent) is marked
+unsent again. Operation which was sent but not marked done, because of
+a crash or an error which could come after basecamp has processed the
+request, is unconfirmed: basecamp API has no way to tell whether it was
+received. Unconfirmed operations, except IDEMPOTENT ones, are not
+submitted again until the person checks basecamp and either confirms
+them as done or asks to send them again (see execute).
+
+Time entry operations keep minutes of session time they log, done ones
+are marked applied once these minutes are taken off the storage, so
+that resumed checkin doesn't take them off once again.
+"""
+import os
+import time
+import errno
+import socket
+import urllib
+import threading
+
+from workers import concurrentMap
+from errors import KArmError
+
+# basecamp methods which could be called again with the same result
+IDEMPOTENT = frozenset(('completeTodoItem',))
+# errors of connecting to basecamp, request was not sent then
+_connectErrors = (errno.ECONNREFUSED, errno.ENETUNREACH, errno.EHOSTUNREACH)
+
+def notSent(error):
+    """Whether error means request didn't reach basecamp at all, it
+    failed while connecting to it
+    """
+    # imported only once request has failed, not on karm startup
+    import urllib2
+    if isinstance(error, urllib2.URLError):
+        error = getattr(error, 'reason', None)
+    if isinstance(error, socket.gaierror):
+        return True
+    return isinstance(error, socket.error) and \
+           not isinstance(error, socket.timeout) and \
+           bool(error.args) and error.args[0] in _connectErrors
+
+class Reference(object):
+    """Result of another operation used as an argument
+    """
+
+    def __init__(self, id):
+        self.id = id
+
+    def __eq__(self, other):
+        return isinstance(other, Reference) and self.id == other.id
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '@%d' % self.id
+
+def encode(value):
+    """Return journal representation of None, bool, int, str, unicode
+    or Reference value
+    """
+    if value is None:
+        return 'n:'
+    if isinstance(value, bool):
+        return 'b:%d' % value
+    if isinstance(value, (int, long)):
+        return 'i:%d' % value
+    if isinstance(value, Reference):
+        return 'r:%d' % value.id
+    if isinstance(value, unicode):
+        return 'u:' + urllib.quote(value.encode('utf-8'), safe='')
+    if isinstance(value, str):
+        return 's:' + urllib.quote(value, safe='')
+    raise KArmError, 'Value %r can not be written to outbox' % (value,)
+
+def decode(data):
+    tag, value = data.split(':', 1)
+    if tag == 'n':
+        return None
+    if tag == 'b':
+        return bool(int(value))
+    if tag == 'i':
+        return int(value)
+    if tag == 'r':
+        return Reference(int(value))
+    if tag == 'u':
+        return urllib.unquote(value).decode('utf-8')
+    if tag == 's':
+        return urllib.unquote(value)
+    raise ValueError, 'Unknown value tag: %s' % tag
+
+
+class Operation(object):
+    """Call of basecamp client's method
+
+    uid is the storage task which is updated once operation is done,
+    minutes is session time of the task the operation logs, if any.
+    sent tells whether operation's request was made, it could have
+    been processed by basecamp then.
+    Operation is submitted only after all the operations it depends on
+    are done, Reference arguments are replaced with their results.
+    """
+
+    def __init__(self, id, method, uid, args=(), kw={}, depends=(),
+                 minutes=None):
+        self.id = id
+        self.method = method
+        self.uid = uid
+        self.args = tuple(args)
+        self.kw = dict(kw)
+        self.depends = list(depends)
+        for value in self.args + tuple(self.kw.values()):
+            if isinstance(value, Reference) and \
+               value.id not in self.depends:
+                self.depends.append(value.id)
+        self.minutes = minutes
+        self.sent = False
+        self.done = False
+        self.applied = False
+        self.result = None
+        self.error = None
+
+    def isUnconfirmed(self):
+        """Whether operation was sent, but basecamp didn't confirm it and
+        it can't be just sent again
+        """
+        return self.sent and not self.done and self.method not in IDEMPOTENT
+
+    def __str__(self):
+        args = [repr(value) for value in self.args]
+        names = self.kw.keys()
+        names.sort()
+        args.extend(['%s=%r' % (name, self.kw[name]) for name in names])
+        return '%s(%s)' % (self.method, ', '.join(args))
+
+
+class Outbox(object):
+    """Journal of operations stored in the file at path
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def create(self, operations):
+        """Start new journal with the given operations
+        """
+        f = open(self.path, 'wb')
+        try:
+            for op in operations:
+                fields = ['op', str(op.id), op.method, encode(op.uid),
+                          ','.join(map(str, op.depends)) or '-']
+                fields.extend(['%d=%s' % (index, encode(value))
+                               for index, value in enumerate(op.args)])
+                fields.extend(['%s=%s' % (name, encode(value))
+                               for name, value in op.kw.items()])
+                f.write(' '.join(fields) + '\n')
+                if op.minutes is not None:
+                    f.write('minutes %d %d\n' % (op.id, op.minutes))
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+
+    def load(self):
+        """Return operations of the journal, the ones marked as done
+        have their results set
+        """
+        f = open(self.path, 'rb')
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        operations = []
+        byId = {}
+        try:
+            for line in data.split('\n')[:-1]:
+                fields = line.split(' ')
+                if fields[0] == 'op':
+                    args = []
+                    kw = {}
+                    for field in fields[5:]:
+                        name, value = field.split('=', 1)
+                        if name.isdigit():
+                            args.append(decode(value))
+                        else:
+                            kw[name] = decode(value)
+                    depends = []
+                    if fields[4] != '-':
+                        depends = map(int, fields[4].split(','))
+                    op = Operation(int(fields[1]), fields[2],
+                                   decode(fields[3]), args, kw, depends)
+                    operations.append(op)
+                    byId[op.id] = op
+                elif fields[0] == 'minutes':
+                    byId[int(fields[1])].minutes = int(fields[2])
+                elif fields[0] == 'sent':
+                    byId[int(fields[1])].sent = True
+                elif fields[0] == 'unsent':
+                    byId[int(fields[1])].sent = False
+                elif fields[0] == 'done':
+                    op = byId[int(fields[1])]
+                    op.done = True
+                    op.result = decode(fields[2])
+                elif fields[0] == 'applied':
+                    byId[int(fields[1])].applied = True
+                else:
+                    raise ValueError, 'Unknown record: %s' % fields[0]
+        except (ValueError, IndexError, KeyError), e:
+            raise KArmError, 'Outbox journal %s is broken: %s' % (
+                self.path, e)
+        return operations
+
+    def _append(self, data):
+        # called with the lock held
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def markSent(self, op, sent=True):
+        """Append sent record of the operation, or unsent one if it's
+        request has failed before reaching basecamp
+        """
+        self._lock.acquire()
+        try:
+            self._append('%s %d\n' % (sent and 'sent' or 'unsent', op.id))
+            op.sent = sent
+        finally:
+            self._lock.release()
+
+    def markDone(self, op, result):
+        """Append done record of the operation
+        """
+        self._lock.acquire()
+        try:
+            self._append('done %d %s\n' % (op.id, encode(result)))
+            op.done = True
+            op.result = result
+        finally:
+            self._lock.release()
+
+    def markApplied(self, operations):
+        """Append applied records of the operations, their changes are
+        in the storage
+        """
+        operations = [op for op in operations if not op.applied]
+        if not operations:
+            return
+        self._lock.acquire()
+        try:
+            self._append(''.join(['applied %d\n' % op.id
+                                  for op in operations]))
+            for op in operations:
+                op.applied = True
+        finally:
+            self._lock.release()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        self.close()
+        os.remove(self.path)
+
+
+def execute(operations, client, outbox, workers=4, retries=2, result=None,
+            resend=False):
+    """Submit not yet done operations and mark them done in outbox
+
+    client() returns basecamp client for the calling thread. Operations
+    which don't depend on each other are submitted concurrently. Failed
+    operations are retried up to retries times only if their request
+    didn't reach basecamp (see notSent), or if their method is one of
+    IDEMPOTENT ones: any other failure, like error status or broken
+    connection, could come after basecamp has processed the request.
+    Operation which still fails keeps its error and operations depending
+    on it are not submitted.
+    result(op, value) converts value returned by basecamp client into
+    journal value, by default it's dropped. If it fails, operation keeps
+    the error as well.
+    Unconfirmed operations (see Operation.isUnconfirmed) are not sent
+    again unless resend is True, so they and operations depending on
+    them stay not done.
+
+    Return list of operations which are not done.
+    """
+    byId = dict([(op.id, op) for op in operations])
+    held = dict([(op.id, True) for op in operations
+                 if op.isUnconfirmed() and not resend])
+
+    def resolve(value):
+        if isinstance(value, Reference):
+            return byId[value.id].result
+        return value
+
+    def submit(op):
+        args = [resolve(value) for value in op.args]
+        kw = dict([(name, resolve(value)) for name, value in op.kw.items()])
+        attempt = 0
+        while True:
+            if op.method not in IDEMPOTENT:
+                outbox.markSent(op)
+            try:
+                value = getattr(client(), op.method)(*args, **kw)
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except Exception, e:
+                unsent = notSent(e)
+                if unsent and op.sent:
+                    outbox.markSent(op, False)
+                if attempt >= retries or not (op.method in IDEMPOTENT or
+                                              unsent):
+                    op.error = e
+                    return
+                time.sleep(0.5 * 2 ** attempt)
+                attempt += 1
+                continue
+            try:
+                if result is not None:
+                    value = result(op, value)
+                else:
+                    value = None
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except Exception, e:
+                op.error = e
+                return
+            outbox.markDone(op, value)
+            return
+
+    attempted = {}
+    while True:
+        ready = []
+        for op in operations:
+            if op.done or attempted.has_key(op.id) or held.has_key(op.id):
+                continue
+            for id in op.depends:
+                if not byId[id].done:
+                    break
+            else:
+                ready.append(op)
+        if not ready:
+            break
+        for op in ready:
+            attempted[op.id] = True
+        concurrentMap(submit, ready, workers)
+    return [op for op in operations if not op.done]
@@ -19,10 +19,34 @@ file for KArm.
 """
 
 import cStringIO
-import codecs
 
 import vobject.base
-from vobject.base import ContentLine, Component, foldOneLine, dquoteEscape
+from vobject.base import ContentLine, Component, dquoteEscape, \
+    backslashEscape
+from vobject.icalendar import TextBehavior
+
+from ics import foldLine
+
+def _plainLine(obj):
+    """Return unfolded UTF-8 encoded content line if obj is plain text
+    or extension property which could be written as it is, else None
+    
+    For such lines behavior's encode and decode round-trip is just
+    backslash escaping of the value, so we escape it right here without
+    touching the line itself.
+    """
+    if obj.group is not None or obj.params or obj.isNative:
+        return None
+    value = obj.value
+    if obj.behavior is TextBehavior:
+        if not obj.encoded:
+            value = backslashEscape(value)
+    elif obj.behavior is not None:
+        return None
+    line = obj.name + ':' + value
+    if isinstance(line, unicode):
+        line = line.encode('utf-8')
+    return line
 
 def karm_defaultSerialize(obj, buf, lineLength):
     """Encode and fold obj and its children, write to buf or return a string."""
@@ -35,30 +59,36 @@ def karm_defaultSerialize(obj, buf, lineLength):
         else:
             groupString = obj.group + '.'
         if obj.useBegin:
-            foldOneLine(outbuf, str(groupString + u"BEGIN:" + obj.name), lineLength)
-        for child in obj.getSortedChildren():
-            #validate is recursive, we only need to validate once
-            child.serialize(outbuf, lineLength, validate=False)
+            foldLine(outbuf, str(groupString + u"BEGIN:" + obj.name), lineLength)
+        for key in obj.sortChildKeys():
+            for child in obj.contents[key]:
+                line = None
+                if isinstance(child, ContentLine):
+                    line = _plainLine(child)
+                if line is not None:
+                    foldLine(outbuf, line, lineLength)
+                else:
+                    #validate is recursive, we only need to validate once
+                    child.serialize(outbuf, lineLength, validate=False)
         if obj.useBegin:
-            foldOneLine(outbuf, str(groupString + u"END:" + obj.name), lineLength)
+            foldLine(outbuf, str(groupString + u"END:" + obj.name), lineLength)
     elif isinstance(obj, ContentLine):
         startedEncoded = obj.encoded
         if obj.behavior and not startedEncoded: obj.behavior.encode(obj)
-        s=codecs.getwriter('utf-8')(cStringIO.StringIO()) #unfolded buffer
+        s = [] #unfolded line
         if obj.group is not None:
-            s.write(obj.group + '.')
+            s.append(obj.group + '.')
         ####################################################################
-        # this is an actual patch: make name uppercase unless it's extension
-        name = obj.name
-        if not name.startswith('X-'):
-            name = name.upper()
-        s.write(obj.name)
+        # this is an actual patch: name is not made uppercase, it's done
+        # in ContentLine constructor unless it's extension
+        s.append(obj.name)
         ####################################################################
         for key, paramvals in obj.params.iteritems():
-            s.write(';' + key + '=' + ','.join(dquoteEscape(p) for p in paramvals))
-        s.write(':' + obj.value)
+            s.append(';' + key + '=' + ','.join(dquoteEscape(p) for p in paramvals))
+        s.append(':' + obj.value)
         if obj.behavior and not startedEncoded: obj.behavior.decode(obj)
-        foldOneLine(outbuf, s.getvalue(), lineLength)
+        line = u''.join(s)
+        foldLine(outbuf, line.encode('utf-8'), lineLength)
 
     return buf or outbuf.getvalue()
 
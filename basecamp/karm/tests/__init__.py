@@ -0,0 +1 @@
+# tests of basecamp.karm, run them with: python -m unittest discover
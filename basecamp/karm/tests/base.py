@@ -0,0 +1,119 @@
+"""Helpers of karm tests: temporary storage, fake basecamp client and
+commands created without command line parsing
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from basecamp.karm import KArm
+
+class Record(object):
+    """Object returned by basecamp client
+    """
+
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+class Client(object):
+    """Fake basecamp client, calls of it's methods are recorded
+
+    Projects and todo lists are returned as they are given, time entries
+    of todo items are taken from entries mapping of todo item ids.
+    """
+
+    def __init__(self, projects=(), todolists=(), entries=None):
+        self.projects = list(projects)
+        self.todolists = list(todolists)
+        self.entries = entries or {}
+        self.calls = []
+        self.ids = 9000
+
+    def getAuthenticatedPerson(self):
+        self.calls.append(('getAuthenticatedPerson',))
+        return Record(id=1)
+
+    def getProjects(self):
+        self.calls.append(('getProjects',))
+        return self.projects
+
+    def getTodoLists(self):
+        self.calls.append(('getTodoLists',))
+        return self.todolists
+
+    def getTodoListsForProject(self, project_id):
+        self.calls.append(('getTodoListsForProject', project_id))
+        return [todolist for todolist in self.todolists
+                if todolist.project_id == project_id]
+
+    def getEntriesForTodoItem(self, todo_id):
+        self.calls.append(('getEntriesForTodoItem', todo_id))
+        return self.entries.get(todo_id, [])
+
+    def createTimeEntryForProject(self, project_id, hours, **kw):
+        self.calls.append(('createTimeEntryForProject', project_id, hours))
+        return Record(id=None)
+
+    def createTimeEntryForTodoItem(self, todo_id, hours, **kw):
+        self.calls.append(('createTimeEntryForTodoItem', todo_id, hours))
+        return Record(id=None)
+
+    def createTodoItem(self, list_id, content, notify=True):
+        self.calls.append(('createTodoItem', list_id, content))
+        self.ids += 1
+        return Record(id=self.ids)
+
+    def completeTodoItem(self, todo_id):
+        self.calls.append(('completeTodoItem', todo_id))
+
+class Options(object):
+    # command line options of karm utility
+    debug = False
+
+def command(cls, storage, **options):
+    """Return karm command of cls with default and the given options
+    """
+    instance = cls.__new__(cls)
+    instance.initialize_options()
+    instance.url = 'http://localhost'
+    instance.user = instance.password = 'test'
+    instance.storage = storage
+    instance.pool_size = 4
+    instance.timeout = None
+    instance.cmdutil = Options()
+    for name, value in options.items():
+        setattr(instance, name, value)
+    return instance
+
+
+class StorageTestCase(unittest.TestCase):
+    """Test with storage path in temporary directory, commands talk to
+    the client
+    """
+
+    def setUp(self):
+        from basecamp.karm import transport
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'karm.ics')
+        self.client = Client()
+        self._connect = transport.connect
+        transport.connect = lambda url, user, password, pool=None, \
+            cache=None: self.client
+
+    def tearDown(self):
+        from basecamp.karm import transport
+        transport.connect = self._connect
+        shutil.rmtree(self.directory)
+
+    def write(self, data):
+        f = open(self.path, 'wb')
+        f.write(data)
+        f.close()
+
+    def read(self):
+        return open(self.path, 'rb').read()
+
+    def load(self, **kw):
+        karm = KArm()
+        karm.load(self.path, **kw)
+        return karm
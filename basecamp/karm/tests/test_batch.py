@@ -0,0 +1,105 @@
+"""Global options of karm utility, batch jobs and profiling
+"""
+import os
+import sys
+import unittest
+from cStringIO import StringIO
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from basecamp.karm import KArm
+from basecamp.karm.todo import Todo
+from basecamp.karm.batch import runJob
+from basecamp.karm.command.checkin import CheckIn
+from basecamp.karm.bin import karm as utility
+
+from basecamp.karm.tests.base import StorageTestCase, command
+
+class SplitOptionsTests(unittest.TestCase):
+
+    def test_values_of_options(self):
+        self.assertEqual(utility.splitOptions(['-U', 'http://x', '-u', 'u',
+            '-s', 'k.ics', '--profile=r.json', 'up']),
+            ({'profile': 'r.json'}, ['-U', 'http://x', '-u', 'u',
+                                     '-s', 'k.ics'], ['up']))
+
+    def test_batch_options(self):
+        self.assertEqual(utility.splitOptions(['--url', 'http://x', '-dB',
+            'jobs.txt', '-j2', '--password', 'secret', 'ci', '-w', '2']),
+            ({'batch': 'jobs.txt', 'jobs': '2', 'password': 'secret'},
+             ['--url=http://x', '-d'], ['ci', '-w', '2']))
+
+    def test_missing_value(self):
+        self.assertRaises(SystemExit, utility.splitOptions, ['-U'])
+
+class ProfileTests(StorageTestCase):
+
+    def test_profile_after_option_values(self):
+        from basecamp.karm import timing
+        def run(argv):
+            timing.start('fetch').stop()
+            timing.count('todos added', 2)
+        report = os.path.join(self.directory, 'report.json')
+        runCommand, argv = utility.runCommand, sys.argv
+        utility.runCommand = run
+        sys.argv = ['karmcmd', '-U', 'http://x', '-u', 'u', '-p', 'p',
+                    '-s', self.path, '--profile=' + report, 'up']
+        try:
+            utility.main()
+        finally:
+            utility.runCommand, sys.argv = runCommand, argv
+        f = open(report, 'rb')
+        try:
+            data = json.load(f)
+        finally:
+            f.close()
+        self.assertEqual(data['phases']['fetch']['count'], 1)
+        self.assertEqual(data['counters'], {'todos added': 2})
+
+class BatchCheckinTests(StorageTestCase):
+
+    def setUp(self):
+        StorageTestCase.setUp(self)
+        karm = KArm()
+        project = karm.add(Todo(u'1', u'Project',
+                                x_kde_ktimetracker_bctype=u'project'))
+        todolist = project.add(Todo(u'10', u'List', related_to=u'1',
+                                    x_kde_ktimetracker_bctype=u'todolist'))
+        todolist.add(Todo(u'100', u'Item', related_to=u'10',
+                          x_kde_ktimetracker_bctype=u'todoitem',
+                          x_kde_ktimetracker_totalsessiontime=30))
+        karm.dump(self.path)
+        self.manifest = os.path.join(self.directory, 'jobs.txt')
+        f = open(self.manifest, 'wb')
+        f.write('http://localhost test %s secret\n' % self.path)
+        f.close()
+
+    def checkin(self, argv):
+        ci = command(CheckIn, self.path)
+        ci.cmdutil.no_input = '--no-input' in argv
+        ci.run()
+
+    def test_jobs_dont_wait_for_input(self):
+        runCommand, stdout = utility.runCommand, sys.stdout
+        utility.runCommand = self.checkin
+        sys.stdout = StringIO()
+        try:
+            status = utility.runBatch({'batch': self.manifest}, [], ['ci'])
+        finally:
+            utility.runCommand, sys.stdout = runCommand, stdout
+        self.assertEqual(status, 0)
+        self.assertEqual(self.client.calls[-1],
+                         ('createTimeEntryForTodoItem', 100, '0.50'))
+
+    def test_questions_fail_job(self):
+        def ask(argv):
+            raw_input('Description: ')
+        index, status, seconds, output = runJob(ask, 0, [])
+        self.assertEqual(status, 'failed')
+        self.failUnless('EOFError' in output)
+
+if __name__ == '__main__':
+    unittest.main()
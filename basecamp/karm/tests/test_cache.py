@@ -0,0 +1,233 @@
+"""Cached basecamp responses and their revalidation
+"""
+import os
+import time
+import shutil
+import urllib2
+import httplib
+import tempfile
+import unittest
+import cPickle
+from cStringIO import StringIO
+
+from basecamp.karm.cache import ResponseCache
+from basecamp.karm.transport import PooledHandler
+
+URL = 'http://localhost/projects.xml'
+
+class FakePool(object):
+    """Connection pool answering requests with the given responses,
+    requests are recorded as (method, path, headers)
+    """
+
+    def __init__(self):
+        self.responses = []
+        self.requests = []
+
+    def respond(self, status, body='', **headers):
+        lines = ['%s: %s\r\n' % (name.replace('_', '-').title(), value)
+                 for name, value in headers.items()]
+        self.responses.append((status, body, lines))
+
+    def request(self, method, scheme, host, path, body=None, headers={}):
+        self.requests.append((method, path, headers))
+        status, data, lines = self.responses.pop(0)
+        msg = httplib.HTTPMessage(StringIO(''.join(lines)))
+        return status, 'Reason', msg, data
+
+class CacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.pool = FakePool()
+        self.open(ttl=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def open(self, ttl):
+        self.cache = ResponseCache(os.path.join(self.directory, 'cache'), ttl)
+        self.opener = urllib2.build_opener(PooledHandler(self.pool,
+                                                         self.cache))
+
+    def get(self, url=URL, credentials=None, data=None):
+        request = urllib2.Request(url, data)
+        if credentials is not None:
+            request.add_header('Authorization', credentials)
+        return self.opener.open(request).read()
+
+    def headers(self):
+        return self.pool.requests[-1][2]
+
+class RevalidationTests(CacheTestCase):
+
+    def test_fresh(self):
+        self.open(ttl=60)
+        self.pool.respond(200, 'projects')
+        self.assertEqual(self.get(), 'projects')
+        # fresh entry is served without request
+        self.assertEqual(self.get(), 'projects')
+        self.assertEqual(len(self.pool.requests), 1)
+        self.assertEqual(len(self.cache.served), 2)
+
+    def test_expired(self):
+        self.open(ttl=60)
+        self.pool.respond(200, 'projects', etag='"1"')
+        self.get()
+        key = self.cache.key(URL, '')
+        entry = self.cache.lookup(key)
+        entry['fetched'] = time.time() - 61
+        self.cache._write(self.cache._path(key, '.response'), entry)
+        self.pool.respond(304)
+        self.assertEqual(self.get(), 'projects')
+        self.assertEqual(self.headers()['If-None-Match'], '"1"')
+        # revalidated entry is fresh again
+        self.failUnless(self.cache.isFresh(self.cache.lookup(key)))
+        self.assertEqual(self.get(), 'projects')
+        self.assertEqual(len(self.pool.requests), 2)
+
+    def test_not_modified(self):
+        self.pool.respond(200, 'projects', etag='"1"',
+                          last_modified='Sat, 14 Feb 2009 10:00:00 GMT')
+        self.assertEqual(self.get(), 'projects')
+        self.failIf(self.headers().has_key('If-None-Match'))
+        self.pool.respond(304)
+        self.assertEqual(self.get(), 'projects')
+        self.assertEqual(self.headers()['If-None-Match'], '"1"')
+        self.assertEqual(self.headers()['If-Modified-Since'],
+                         'Sat, 14 Feb 2009 10:00:00 GMT')
+
+    def test_modified(self):
+        self.pool.respond(200, 'projects', etag='"1"')
+        self.get()
+        self.pool.respond(200, 'changed projects', etag='"2"')
+        self.assertEqual(self.get(), 'changed projects')
+        self.pool.respond(304)
+        self.assertEqual(self.get(), 'changed projects')
+        self.assertEqual(self.headers()['If-None-Match'], '"2"')
+
+    def test_without_validators(self):
+        # with ttl 0 response without validators is never used
+        self.pool.respond(200, 'projects')
+        self.get()
+        self.assertEqual(self.cache.lookup(self.cache.key(URL, '')), None)
+        self.pool.respond(200, 'projects')
+        self.get()
+        self.failIf(self.headers().has_key('If-None-Match'))
+
+    def test_not_found(self):
+        self.pool.respond(404, etag='"1"')
+        self.assertRaises(urllib2.HTTPError, self.get)
+        self.assertEqual(self.cache.lookup(self.cache.key(URL, '')), None)
+        self.assertEqual(self.cache.served, [])
+
+    def test_post(self):
+        self.open(ttl=60)
+        for i in range(2):
+            self.pool.respond(201, 'created', etag='"1"')
+            self.assertEqual(self.get(data='<time-entry/>'), 'created')
+        self.assertEqual(len(self.pool.requests), 2)
+        self.assertEqual(os.listdir(self.cache.directory), [])
+
+    def test_credentials(self):
+        self.open(ttl=60)
+        self.pool.respond(200, 'projects of 1')
+        self.assertEqual(self.get(credentials='Basic MTox'), 'projects of 1')
+        # the same url requested by another person is not served from
+        # the cache of the first one
+        self.pool.respond(200, 'projects of 2')
+        self.assertEqual(self.get(credentials='Basic Mjoy'), 'projects of 2')
+        self.assertEqual(self.get(credentials='Basic MTox'), 'projects of 1')
+        self.assertEqual(len(self.pool.requests), 2)
+        self.assertEqual(self.pool.requests[0][2]['Authorization'],
+                         'Basic MTox')
+
+class CacheTests(CacheTestCase):
+
+    def test_signature(self):
+        self.pool.respond(200, 'projects', etag='"1"')
+        self.pool.respond(200, 'todo lists', etag='"1"')
+        self.get()
+        self.get('http://localhost/todo_lists.xml')
+        signature = self.cache.signature()
+
+        self.open(ttl=0)
+        self.pool.respond(304)
+        self.pool.respond(304)
+        self.get()
+        self.get('http://localhost/todo_lists.xml')
+        self.assertEqual(self.cache.signature(), signature)
+
+        self.open(ttl=0)
+        self.pool.respond(304)
+        self.pool.respond(200, 'changed todo lists', etag='"2"')
+        self.get()
+        self.get('http://localhost/todo_lists.xml')
+        self.assertNotEqual(self.cache.signature(), signature)
+
+    def test_remember(self):
+        self.assertEqual(self.cache.recall('update'), None)
+        self.assertEqual(self.cache.recall('update', ()), ())
+        self.cache.remember('update', ('signature', (10, 1234567890.0)))
+        self.open(ttl=0)
+        self.assertEqual(self.cache.recall('update'),
+                         ('signature', (10, 1234567890.0)))
+        self.assertEqual(self.cache.recall('checkin'), None)
+
+    def test_private(self):
+        self.assertEqual(os.stat(self.cache.directory).st_mode & 0777, 0700)
+
+class BrokenCacheTests(CacheTestCase):
+
+    def setUp(self):
+        CacheTestCase.setUp(self)
+        self.open(ttl=60)
+        self.pool.respond(200, 'projects', etag='"1"')
+        self.get()
+        self.cache.remember('update', ('signature', None))
+        self.paths = [os.path.join(self.cache.directory, name)
+                      for name in os.listdir(self.cache.directory)]
+        self.assertEqual(len(self.paths), 2)
+
+    def spoil(self, data):
+        for path in self.paths:
+            f = open(path, 'wb')
+            f.write(data)
+            f.close()
+
+    def assertMissed(self):
+        self.assertEqual(self.cache.recall('update'), None)
+        self.pool.respond(200, 'projects', etag='"1"')
+        self.assertEqual(self.get(), 'projects')
+        self.assertEqual(len(self.pool.requests), 2)
+        self.failIf(self.headers().has_key('If-None-Match'))
+
+    def test_truncated(self):
+        data = open(self.paths[0], 'rb').read()
+        self.spoil(data[:len(data) / 2])
+        self.assertMissed()
+
+    def test_corrupt(self):
+        self.spoil('\x80\x02garbage')
+        self.assertMissed()
+
+    def test_empty(self):
+        self.spoil('')
+        self.assertMissed()
+
+    def test_other_value(self):
+        self.spoil(cPickle.dumps(['projects'], 2))
+        self.assertEqual(self.cache.recall('update'), ['projects'])
+        self.pool.respond(200, 'projects', etag='"1"')
+        self.assertEqual(self.get(), 'projects')
+        self.assertEqual(len(self.pool.requests), 2)
+
+    def test_stored_again(self):
+        self.spoil('garbage')
+        self.assertMissed()
+        # response replaces broken entry
+        self.assertEqual(self.get(), 'projects')
+        self.assertEqual(len(self.pool.requests), 2)
+
+if __name__ == '__main__':
+    unittest.main()
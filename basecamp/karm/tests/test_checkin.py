@@ -0,0 +1,166 @@
+"""Checkin resumed after interruption, and checkin with plan file
+"""
+import os
+import shutil
+import unittest
+
+from basecamp.karm import KArm
+from basecamp.karm.todo import Todo
+from basecamp.karm.errors import KArmError
+from basecamp.karm.outbox import Outbox
+from basecamp.karm.command import checkin
+from basecamp.karm.command.checkin import CheckIn
+
+from basecamp.karm.tests.base import StorageTestCase, command
+
+class CheckInTestCase(StorageTestCase):
+    """Storage with session time of a todo item to check in
+    """
+
+    def setUp(self):
+        StorageTestCase.setUp(self)
+        # descriptions of time entries are not asked
+        checkin.raw_input = lambda prompt: ''
+        karm = KArm()
+        project = karm.add(Todo(u'1', u'Project',
+                                x_kde_ktimetracker_bctype=u'project'))
+        todolist = project.add(Todo(u'10', u'List', related_to=u'1',
+                                    x_kde_ktimetracker_bctype=u'todolist'))
+        todolist.add(Todo(u'100', u'Item', related_to=u'10',
+                          x_kde_ktimetracker_bctype=u'todoitem',
+                          x_kde_ktimetracker_totalsessiontime=30))
+        karm.dump(self.path)
+
+    def tearDown(self):
+        del checkin.raw_input
+        StorageTestCase.tearDown(self)
+
+    def sessionTime(self):
+        karm = KArm()
+        karm.load(self.path)
+        return karm.find(u'100').x_kde_ktimetracker_totalsessiontime
+
+class ResumeTests(CheckInTestCase):
+
+    def interrupt(self, minutes):
+        """Post time of the storage and stop before storage is updated,
+        then track more minutes
+        """
+        karm = KArm()
+        karm.load(self.path)
+        ci = command(CheckIn, self.path)
+        operations = ci.collect(karm, 1, ask=False)
+        outbox = Outbox(self.path + '.outbox')
+        outbox.create(operations)
+        ci.submit(outbox, operations)
+        outbox.close()
+        karm.find(u'100').x_kde_ktimetracker_totalsessiontime += minutes
+        karm.dump()
+
+    def test_time_tracked_since_is_kept(self):
+        self.interrupt(10)
+        command(CheckIn, self.path).run()
+        self.assertEqual(self.sessionTime(), 10)
+        self.assertEqual(self.client.calls,
+                         [('createTimeEntryForTodoItem', 100, '0.50')])
+
+        command(CheckIn, self.path).run()
+        self.assertEqual(self.sessionTime(), 0)
+        self.assertEqual(self.client.calls[-1],
+                         ('createTimeEntryForTodoItem', 100, '0.17'))
+
+    def test_applied_time_is_not_taken_off_twice(self):
+        self.interrupt(10)
+        karm = KArm()
+        karm.load(self.path)
+        outbox = Outbox(self.path + '.outbox')
+        operations = outbox.load()
+        ci = command(CheckIn, self.path)
+        self.failUnless(ci.updateStorage(karm, operations))
+        outbox.markApplied(operations)
+        outbox.close()
+
+        operations = outbox.load()
+        self.failUnless(operations[0].applied)
+        self.assertEqual(operations[0].minutes, 30)
+        self.failIf(ci.updateStorage(karm, operations))
+        self.assertEqual(karm.find(u'100').x_kde_ktimetracker_totalsessiontime,
+                         10)
+
+class UnconfirmedTests(CheckInTestCase):
+
+    def setUp(self):
+        CheckInTestCase.setUp(self)
+        # time entry was sent right before the crash
+        karm = KArm()
+        karm.load(self.path)
+        operations = command(CheckIn, self.path).collect(karm, 1, ask=False)
+        outbox = Outbox(self.path + '.outbox')
+        outbox.create(operations)
+        outbox.markSent(operations[0])
+        outbox.close()
+
+    def test_not_sent_again(self):
+        self.assertRaises(KArmError, command(CheckIn, self.path).run)
+        self.assertEqual(self.client.calls, [])
+        self.assertEqual(self.sessionTime(), 30)
+        self.failUnless(os.path.exists(self.path + '.outbox'))
+
+    def test_confirm_sent(self):
+        command(CheckIn, self.path, confirm_sent=True).run()
+        self.assertEqual(self.client.calls, [])
+        self.assertEqual(self.sessionTime(), 0)
+        self.failIf(os.path.exists(self.path + '.outbox'))
+
+    def test_resume_sent(self):
+        command(CheckIn, self.path, resume_sent=True).run()
+        self.assertEqual(self.client.calls,
+                         [('createTimeEntryForTodoItem', 100, '0.50')])
+        self.assertEqual(self.sessionTime(), 0)
+
+class PlanTests(CheckInTestCase):
+
+    def setUp(self):
+        CheckInTestCase.setUp(self)
+        self.plan = os.path.join(self.directory, 'plan.json')
+        command(CheckIn, self.path, plan=self.plan).run()
+
+    def edit(self, old, new):
+        data = open(self.plan, 'rb').read()
+        self.failUnless(old in data, old)
+        f = open(self.plan, 'wb')
+        f.write(data.replace(old, new))
+        f.close()
+
+    def apply(self, storage=None):
+        command(CheckIn, storage or self.path, apply=self.plan).run()
+
+    def test_apply(self):
+        self.apply()
+        self.assertEqual(self.client.calls[-1],
+                         ('createTimeEntryForTodoItem', 100, '0.50'))
+        self.assertEqual(self.sessionTime(), 0)
+
+    def test_unknown_method(self):
+        self.edit('"createTimeEntryForTodoItem"', '"__init__"')
+        self.assertRaises(KArmError, self.apply)
+        self.edit('"__init__"', '["createTimeEntryForTodoItem"]')
+        self.assertRaises(KArmError, self.apply)
+        self.assertEqual(self.client.calls, [])
+
+    def test_another_storage(self):
+        copy = os.path.join(self.directory, 'copy.ics')
+        shutil.copy(self.path, copy)
+        self.assertRaises(KArmError, self.apply, copy)
+        self.assertEqual(self.client.calls, [])
+        # the same storage under relative path is fine
+        cwd = os.getcwd()
+        os.chdir(self.directory)
+        try:
+            self.apply('karm.ics')
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(self.sessionTime(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
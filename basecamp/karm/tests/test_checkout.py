@@ -0,0 +1,89 @@
+"""Checkout fetching time of todo items concurrently
+"""
+import time
+import threading
+import unittest
+
+from basecamp.karm import KArm
+from basecamp.karm.command.checkout import CheckOut
+
+from basecamp.karm.tests.base import StorageTestCase, Client, Record, command
+
+class SlowClient(Client):
+    """Fake basecamp client which answers time entries requests with
+    latency, like remote server does
+    """
+    latency = 0.05
+
+    def __init__(self, *args, **kw):
+        Client.__init__(self, *args, **kw)
+        self.lock = threading.Lock()
+        self.running = self.concurrent = 0
+
+    def getEntriesForTodoItem(self, todo_id):
+        self.lock.acquire()
+        self.running += 1
+        self.concurrent = max(self.concurrent, self.running)
+        self.lock.release()
+        try:
+            time.sleep(self.latency)
+            if todo_id == 'broken':
+                raise IOError, 'Connection reset'
+            return Client.getEntriesForTodoItem(self, todo_id)
+        finally:
+            self.lock.acquire()
+            self.running -= 1
+            self.lock.release()
+
+class FetchHoursTests(StorageTestCase):
+
+    def setUp(self):
+        StorageTestCase.setUp(self)
+        self.todo_ids = range(100, 116)
+        entries = {}
+        for todo_id in self.todo_ids:
+            entries[todo_id] = [Record(hours='0.5')] * (todo_id - 100)
+        self.client = SlowClient(entries=entries)
+
+    def fetch(self, workers, todo_ids=None):
+        if todo_ids is None:
+            todo_ids = self.todo_ids
+        start = time.time()
+        hours = command(CheckOut, self.path,
+                        workers=workers).fetchHours(todo_ids)
+        return hours, time.time() - start
+
+    def test_concurrent(self):
+        hours, elapsed = self.fetch(4)
+        # hours are in the order of todo items
+        self.assertEqual(hours, [i * 0.5 for i in range(16)])
+        self.assertEqual(self.client.concurrent, 4)
+        # 16 requests in 4 workers take about 4 latencies, not 16
+        self.failUnless(elapsed < SlowClient.latency * 10, elapsed)
+
+    def test_single_worker(self):
+        hours, elapsed = self.fetch(1)
+        self.assertEqual(hours, [i * 0.5 for i in range(16)])
+        self.assertEqual(self.client.concurrent, 1)
+        self.failUnless(elapsed >= SlowClient.latency * 16, elapsed)
+
+    def test_error(self):
+        self.assertRaises(IOError, self.fetch, 4,
+                          self.todo_ids[:6] + ['broken'] + self.todo_ids[6:])
+
+    def test_checkout(self):
+        self.client.projects = [Record(id=1, name=u'Project')]
+        self.client.todolists = [Record(id=10, name=u'List', project_id=1,
+            todo_items=[Record(id=todo_id, content=u'Item %d' % todo_id)
+                        for todo_id in self.todo_ids])]
+        command(CheckOut, self.path, fetch_time=True).run()
+        karm = KArm()
+        karm.load(self.path)
+        self.assertEqual(karm.find(u'103').x_kde_ktimetracker_totaltasktime,
+                         90)
+        self.assertEqual(karm.find(u'100').x_kde_ktimetracker_totaltasktime,
+                         0)
+        self.failUnless(self.client.concurrent > 1)
+
+if __name__ == '__main__':
+    unittest.main()
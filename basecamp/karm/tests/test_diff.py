@@ -0,0 +1,128 @@
+"""Difference between basecamp data and storage
+"""
+import unittest
+
+from basecamp.karm import KArm
+from basecamp.karm.todo import Todo
+from basecamp.karm.diff import snapshot, diff, applyChanges
+
+from basecamp.karm.tests.base import Record
+
+def storage():
+    karm = KArm()
+    project = karm.add(Todo(u'1', u'Project',
+                            x_kde_ktimetracker_bctype=u'project'))
+    todolist = project.add(Todo(u'10', u'List', related_to=u'1',
+                                x_kde_ktimetracker_bctype=u'todolist'))
+    todolist.add(Todo(u'100', u'Item', related_to=u'10',
+                      x_kde_ktimetracker_bctype=u'todoitem',
+                      x_kde_ktimetracker_totalsessiontime=15,
+                      x_kde_ktimetracker_totaltasktime=75))
+    todolist.add(Todo(u'101', u'Gone', related_to=u'10',
+                      x_kde_ktimetracker_bctype=u'todoitem'))
+    # task of no basecamp type is never removed
+    project.add(Todo(u'7', u'Personal', related_to=u'1'))
+    karm.add(Todo(u'2', u'Other', x_kde_ktimetracker_bctype=u'project'))
+    # project, todo list and todo item with the same id
+    karm.add(Todo(u'5', u'Five', x_kde_ktimetracker_bctype=u'project'))
+    todolist = project.add(Todo(u'5', u'List five', related_to=u'1',
+                                x_kde_ktimetracker_bctype=u'todolist'))
+    todolist.add(Todo(u'5', u'Item five', related_to=u'5',
+                      x_kde_ktimetracker_bctype=u'todoitem'))
+    return karm
+
+def basecamp():
+    projects = [Record(id=1, name=u'Project'),
+                Record(id=5, name=u'Five renamed'),
+                Record(id=3, name=u'New')]
+    todolists = [
+        Record(id=10, name=u'List', project_id=5, todo_items=[
+            Record(id=100, content=u'Item renamed', completed=True),
+            Record(id=102, content=u'Added')]),
+        Record(id=5, name=u'List five', project_id=1, todo_items=[
+            Record(id=5, content=u'Item five')])]
+    return list(snapshot(projects, todolists))
+
+HOURS = {'100': 1.5, '102': 0.5}
+
+class DiffTests(unittest.TestCase):
+
+    def setUp(self):
+        self.karm = storage()
+        self.tasks = basecamp()
+
+    def changes(self, **kw):
+        return [str(change) for change in diff(self.karm, self.tasks, **kw)]
+
+    def test_snapshot(self):
+        self.assertEqual(self.tasks[:4], [
+            ('1', u'project', u'Project', None, False),
+            ('5', u'project', u'Five renamed', None, False),
+            ('3', u'project', u'New', None, False),
+            ('10', u'todolist', u'List', '5', False)])
+        self.assertEqual(self.tasks[5],
+                         ('100', u'todoitem', u'Item renamed', '10', True))
+
+    def test_changes(self):
+        changes = self.changes(hours=HOURS)
+        self.assertEqual(changes[:7], [
+            # only the project is renamed, not the todo list of that id
+            'Renamed project <Five renamed> [5] from <Five>',
+            'Added project <New> [3]',
+            'Moved todolist <List> [10] from [1] to [5]',
+            'Renamed todoitem <Item renamed> [100] from <Item>',
+            'Time todoitem <Item renamed> [100] 90 minutes, was 60',
+            'Completed todoitem <Item renamed> [100]',
+            'Added todoitem <Added> [102] into [10]'])
+        self.assertEqual(sorted(changes[7:]),
+                         ['Removed project <Other> [2]',
+                          'Removed todoitem <Gone> [101]'])
+
+    def test_without_hours(self):
+        changes = self.changes()
+        self.failIf([change for change in changes
+                     if change.startswith('Time')])
+
+    def test_scope(self):
+        changes = self.changes(scope=[(u'project', '1')])
+        self.assertEqual([change for change in changes
+                          if change.startswith('Removed')],
+                         ['Removed todoitem <Gone> [101]'])
+
+    def test_removed_after_parents(self):
+        self.tasks = []
+        changes = self.changes(scope=[(u'project', '1')])
+        self.failUnless(changes.index('Removed todolist <List> [10]') <
+                        changes.index('Removed todoitem <Item> [100]'))
+        self.failUnless(changes.index('Removed todolist <List five> [5]') <
+                        changes.index('Removed todoitem <Item five> [5]'))
+
+    def test_apply(self):
+        self.failUnless(applyChanges(self.karm,
+                                     diff(self.karm, self.tasks, HOURS)))
+        karm = self.karm
+        self.assertEqual(karm.find(u'5', u'project').summary, u'Five renamed')
+        self.assertEqual(karm.find(u'5', u'todolist').summary, u'List five')
+        # todo list is moved into the project, not into the todo list or
+        # todo item with the same id
+        todolist = karm.find(u'10')
+        self.failUnless(todolist._parent is karm.find(u'5', u'project'))
+        self.assertEqual(todolist.related_to, u'5')
+        item = karm.find(u'100')
+        self.assertEqual(item.summary, u'Item renamed')
+        self.assertEqual(item.x_kde_ktimetracker_totalsessiontime, 15)
+        self.assertEqual(item.x_kde_ktimetracker_totaltasktime, 105)
+        added = karm.find(u'102')
+        self.failUnless(added._parent is todolist)
+        self.assertEqual(added.x_kde_ktimetracker_totaltasktime, 30)
+        self.assertEqual(karm.find(u'3').x_kde_ktimetracker_bctype,
+                         u'project')
+        # completed and removed tasks are only reported
+        self.assertEqual(sorted(self.changes(hours=HOURS)),
+                         ['Completed todoitem <Item renamed> [100]',
+                          'Removed project <Other> [2]',
+                          'Removed todoitem <Gone> [101]'])
+        self.failIf(applyChanges(karm, diff(karm, self.tasks, HOURS)))
+
+if __name__ == '__main__':
+    unittest.main()
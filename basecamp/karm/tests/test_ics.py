@@ -0,0 +1,75 @@
+"""Native iCalendar reader and writer
+"""
+import os
+import sys
+import shutil
+import datetime
+import tempfile
+import unittest
+import subprocess
+
+from basecamp.karm.ics import utc, parseDateTime, formatDateTime, timeStamp
+from basecamp.karm.errors import ParseError
+
+STORAGE = ('BEGIN:VCALENDAR\r\n'
+           'VERSION:2.0\r\n'
+           'BEGIN:VTODO\r\n'
+           'COMPLETED:20090203T232709Z\r\n'
+           'DTSTAMP:20081206T203902Z\r\n'
+           'SUMMARY:Project\r\n'
+           'UID:1\r\n'
+           'END:VTODO\r\n'
+           'END:VCALENDAR\r\n')
+
+class DateTimeTests(unittest.TestCase):
+
+    def test_parse(self):
+        value = parseDateTime('20090203T232709Z')
+        self.assertEqual(value, datetime.datetime(2009, 2, 3, 23, 27, 9,
+                                                  tzinfo=utc))
+        self.assertEqual(value.utcoffset(), datetime.timedelta(0))
+        self.assertRaises(ParseError, parseDateTime, '20090203T232709')
+        self.assertRaises(ParseError, parseDateTime, '20091303T232709Z')
+
+    def test_same_as_vobject(self):
+        from vobject.icalendar import utc as vutc, dateTimeToString
+        value = parseDateTime('20090203T232709Z')
+        self.assertEqual(value, datetime.datetime(2009, 2, 3, 23, 27, 9,
+                                                  tzinfo=vutc))
+        self.assertEqual(utc, vutc)
+        self.assertEqual(vutc, utc)
+        self.assertEqual(formatDateTime(value), '20090203T232709Z')
+        self.assertEqual(dateTimeToString(value, True), '20090203T232709Z')
+
+    def test_time_stamp(self):
+        stamp = timeStamp()
+        self.assertEqual(len(stamp), 16)
+        self.assertEqual(formatDateTime(parseDateTime(stamp)), stamp)
+
+    def test_load_without_vobject(self):
+        # storage with date-times is loaded and dumped without vobject
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'karm.ics')
+            f = open(path, 'wb')
+            f.write(STORAGE)
+            f.close()
+            script = ('import sys\n'
+                      'from basecamp.karm import KArm\n'
+                      'karm = KArm()\n'
+                      'karm.load(sys.argv[1])\n'
+                      'karm.find("1").summary = u"Changed"\n'
+                      'karm.dump()\n'
+                      'print "vobject" in sys.modules\n')
+            root = os.path.dirname(os.path.dirname(os.path.dirname(
+                os.path.dirname(os.path.abspath(__file__)))))
+            process = subprocess.Popen([sys.executable, '-c', script, path],
+                                       stdout=subprocess.PIPE, cwd=root)
+            output = process.communicate()[0]
+            self.assertEqual(output.strip(), 'False')
+            self.assertTrue('SUMMARY:Changed' in open(path, 'rb').read())
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,724 @@
+"""KArm storage loading and dumping
+"""
+import os
+import sys
+import shutil
+import time
+import tempfile
+import unittest
+
+from basecamp.karm import KArm
+from basecamp.karm.todo import Todo
+from basecamp.karm.errors import DuplicationError, NotFoundError, KArmError, \
+     ParseError
+
+from basecamp.karm.tests.base import StorageTestCase
+
+class EmptyStorageTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'karm.ics')
+        open(self.path, 'wb').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertEmptyStorage(self, **kw):
+        karm = KArm()
+        karm.load(self.path, **kw)
+        self.assertEqual(karm.todos, {})
+        self.assertEqual(karm.properties, {})
+        karm.add(Todo(u'1', u'Project', x_kde_ktimetracker_bctype=u'project'))
+        karm.dump()
+        karm = KArm()
+        karm.load(self.path, **kw)
+        self.assertEqual(karm.todos.keys(), [u'1'])
+        self.assertEqual(karm.todos[u'1'].summary, u'Project')
+
+    def test_eager(self):
+        self.assertEmptyStorage()
+
+    def test_lazy(self):
+        self.assertEmptyStorage(lazy=True)
+
+
+def vtodo(uid, summary, related_to=None, bctype=None):
+    lines = ['BEGIN:VTODO', 'UID:' + uid, 'SUMMARY:' + summary]
+    if related_to is not None:
+        lines.append('RELATED-TO:' + related_to)
+    if bctype is not None:
+        lines.append('X-KDE-ktimetracker-bctype:' + bctype)
+    lines.append('END:VTODO')
+    return ''.join([line + '\r\n' for line in lines])
+
+def calendar(*todos):
+    return 'BEGIN:VCALENDAR\r\nVERSION:2.0\r\n%sEND:VCALENDAR\r\n' % \
+        ''.join(todos)
+
+# project, todo list and todo item with the same id
+SAME_IDS = calendar(vtodo('5', 'Project 5', bctype='project'),
+                    vtodo('7', 'Project 7', bctype='project'),
+                    vtodo('5', 'List 5', '7', 'todolist'),
+                    vtodo('5', 'Item 5', '5', 'todoitem'),
+                    vtodo('6', 'List 6', '5', 'todolist'),
+                    vtodo('8', 'Entry', '5'))
+
+class IndexTests(StorageTestCase):
+
+    def setUp(self):
+        StorageTestCase.setUp(self)
+        self.write(SAME_IDS)
+
+    def assertSameIds(self, karm):
+        self.assertEqual(karm.orphans, [])
+        self.assertEqual(karm.cycles, [])
+        self.assertEqual(karm.duplicates, [])
+        self.assertEqual(len(karm._index), 6)
+        project = karm.find(u'5', u'project')
+        todolist = karm.find(u'5', u'todolist')
+        item = karm.find(u'5', u'todoitem')
+        self.assertEqual(project.summary, u'Project 5')
+        self.failUnless(todolist._parent is karm.find(u'7'))
+        self.failUnless(item._parent is todolist)
+        self.failUnless(karm.find(u'6')._parent is project)
+        # plain task is related to the nearest task stored before it
+        self.failUnless(karm.find(u'8')._parent is item)
+        # without type todo item goes first
+        self.failUnless(karm.find(u'5') is item)
+        self.assertRaises(NotFoundError, karm.find, u'6', u'project')
+
+    def test_same_ids_native(self):
+        self.assertSameIds(self.load())
+
+    def test_same_ids_vobject(self):
+        self.assertSameIds(self.load(native=False))
+
+    def test_same_ids_lazy(self):
+        self.assertSameIds(self.load(lazy=True))
+
+    def test_same_ids_dumped(self):
+        karm = self.load()
+        karm.find(u'5', u'project').x_kde_ktimetracker_totalsessiontime = 5
+        karm.dump()
+        self.assertSameIds(self.load())
+        karm.dump(native=False)
+        self.assertSameIds(self.load())
+
+    def test_duplicates_are_kept(self):
+        self.write(calendar(vtodo('1', 'Project', bctype='project'),
+                            vtodo('2', 'Project', bctype='project'),
+                            vtodo('3', 'List', '1', 'todolist'),
+                            vtodo('3', 'Copy', '2', 'todolist'),
+                            vtodo('4', 'Item', '3', 'todoitem')))
+        for kw in ({}, {'native': False}, {'lazy': True}):
+            karm = self.load(**kw)
+            self.assertEqual([todo.summary for todo in karm.duplicates],
+                             [u'Copy'])
+            self.assertEqual(karm.find(u'3').summary, u'List')
+            # todo item is related to the nearest todo list before it
+            self.assertEqual(karm.duplicates[0].todos.keys(), [u'4'])
+            self.assertEqual(len(karm._index), 3)
+            karm.dump()
+            self.assertEqual(self.read().count('BEGIN:VTODO'), 5)
+
+    def test_add_duplicate(self):
+        karm = self.load()
+        project = karm.find(u'7')
+        self.assertRaises(DuplicationError, project.add,
+                          Todo(u'6', u'List', x_kde_ktimetracker_bctype=u'todolist'))
+        self.assertRaises(DuplicationError, karm.add,
+                          Todo(u'7', u'Project', x_kde_ktimetracker_bctype=u'project'))
+        project.add(Todo(u'6', u'Item', x_kde_ktimetracker_bctype=u'todoitem'))
+        self.assertEqual(karm.find(u'6', u'todoitem').summary, u'Item')
+        self.assertEqual(len(karm._index), 7)
+
+    def test_delete(self):
+        karm = self.load()
+        project = karm.delete(u'7')
+        self.assertEqual(len(karm._index), 2)
+        self.assertRaises(NotFoundError, karm.find, u'5', u'todoitem')
+        self.assertEqual(project._index, None)
+        karm.find(u'5', u'project').delete(u'6')
+        self.assertEqual(sorted(karm._index.keys()), [(u'project', u'5')])
+
+    def test_move(self):
+        karm = self.load()
+        item = karm.move(u'5', u'6', u'todoitem')
+        self.failUnless(item._parent is karm.find(u'6'))
+        self.assertEqual(item.related_to, u'6')
+        self.assertEqual(item.todos.keys(), [u'8'])
+        self.assertEqual(karm.find(u'5', u'todolist').todos, {})
+        # todo list is moved into the project, not into the todo item
+        todolist = karm.move(u'5', u'5', u'todolist')
+        self.failUnless(todolist._parent is karm.find(u'5', u'project'))
+        root = karm.move(u'6', None)
+        self.failUnless(karm.todos[u'6'] is root)
+        self.assertEqual(root.related_to, None)
+        self.assertRaises(KArmError, karm.move, u'6', u'8')
+        self.assertRaises(NotFoundError, karm.move, u'6', u'missing')
+
+    def test_rekey(self):
+        karm = self.load()
+        item = karm.rekey(u'5', u'50', u'todoitem')
+        self.assertEqual(item.uid, u'50')
+        self.failUnless(karm.find(u'50') is item)
+        self.assertRaises(NotFoundError, karm.find, u'5', u'todoitem')
+        self.failUnless(karm.find(u'5', u'todolist').todos[u'50'] is item)
+        self.assertEqual(karm.find(u'8').related_to, u'50')
+        self.assertRaises(DuplicationError, karm.rekey, u'6', u'5',
+                          u'todolist')
+        # basecamp type change moves todo in the index as well
+        item.x_kde_ktimetracker_bctype = u'todolist'
+        self.failUnless(karm.find(u'50', u'todolist') is item)
+        self.assertRaises(NotFoundError, karm.find, u'50', u'todoitem')
+        self.assertRaises(DuplicationError, setattr, item, 'uid', u'6')
+        self.assertEqual(item.uid, u'50')
+
+# KTimeTracker writes unknown properties, other components and line
+# endings of it's own, which dump should keep
+KTIMETRACKER = ('BEGIN:VCALENDAR\n'
+                'PRODID:-//K Desktop Environment//NONSGML KTimeTracker//EN\n'
+                'VERSION:2.0\n'
+                'X-KDE-ktimetracker-version:4.2\n'
+                'BEGIN:VTODO\n'
+                'UID:1\n'
+                'SUMMARY:Project\n'
+                'X-KDE-ktimetracker-bctype:project\n'
+                'X-KDE-custom:kept\n'
+                'END:VTODO\n'
+                'BEGIN:VEVENT\n'
+                'UID:event\n'
+                'SUMMARY:Event\n'
+                'END:VEVENT\n'
+                'BEGIN:VTODO\n'
+                'UID:10\n'
+                'RELATED-TO:1\n'
+                'SUMMARY:List\n'
+                'X-KDE-ktimetracker-bctype:todolist\n'
+                'END:VTODO\n'
+                'BEGIN:VTODO\n'
+                'UID:100\n'
+                'RELATED-TO:10\n'
+                'SUMMARY:Item with a long summary which is folded by '
+                'KTimeTracker in\n'
+                ' its own way\n'
+                'X-KDE-ktimetracker-bctype:todoitem\n'
+                'X-KDE-ktimetracker-totalSessionTime:30\n'
+                'END:VTODO\n'
+                'BEGIN:VTODO\n'
+                'UID:101\n'
+                'RELATED-TO:10\n'
+                'SUMMARY:Done\n'
+                'X-KDE-ktimetracker-bctype:todoitem\n'
+                'END:VTODO\n'
+                'END:VCALENDAR\n')
+
+def components(data):
+    """Return list of components in data, each is a string
+    """
+    result = []
+    for part in data.split('BEGIN:')[2:]:
+        result.append('BEGIN:' + part.split('END:VCALENDAR')[0])
+    return result
+
+class DumpTests(StorageTestCase):
+
+    def setUp(self):
+        StorageTestCase.setUp(self)
+        self.write(KTIMETRACKER)
+
+    def test_unchanged(self):
+        karm = self.load()
+        karm.dump()
+        self.assertEqual(self.read(), KTIMETRACKER)
+        self.assertEqual(karm._written, 0)
+
+    def test_changed_todos_only(self):
+        karm = self.load()
+        karm.find(u'100').x_kde_ktimetracker_totalsessiontime = 0
+        karm.find(u'10').delete(u'101')
+        karm.find(u'10').add(Todo(u'102', u'New', related_to=u'10',
+                                  x_kde_ktimetracker_bctype=u'todoitem'))
+        karm.dump()
+        self.assertEqual(karm._written, 2)
+        data = self.read()
+        before = components(KTIMETRACKER)
+        after = components(data)
+        # project, event and todo list are copied byte by byte
+        self.assertEqual(after[:3], before[:3])
+        self.failUnless(data.startswith(KTIMETRACKER[
+            :KTIMETRACKER.index('BEGIN:VTODO')]))
+        self.failUnless('UID:100\r\n' in after[3])
+        self.failUnless('X-KDE-ktimetracker-totalSessionTime:0\r\n' in
+                        after[3])
+        self.failUnless('UID:102\r\n' in after[4])
+        self.assertEqual(len(after), 5)
+        self.failIf('UID:101' in data)
+        self.failUnless(data.endswith('END:VCALENDAR\n'))
+
+        # and the result is loaded back the same
+        karm = self.load()
+        self.assertEqual(karm.find(u'100').x_kde_ktimetracker_totalsessiontime,
+                         0)
+        self.assertEqual(sorted(karm.find(u'10').todos.keys()),
+                         [u'100', u'102'])
+        karm.dump()
+        self.assertEqual(karm._written, 0)
+        self.assertEqual(self.read(), data)
+
+    def test_changed_back(self):
+        karm = self.load()
+        todo = karm.find(u'100')
+        todo.summary = u'Changed'
+        karm.dump()
+        todo.summary = u'Changed again'
+        karm.dump()
+        self.assertEqual(karm._written, 1)
+        self.assertEqual(self.load().find(u'100').summary, u'Changed again')
+        self.assertEqual(components(self.read())[:3],
+                         components(KTIMETRACKER)[:3])
+
+    def test_changed_properties(self):
+        karm = self.load()
+        karm.properties['X-KARM-CURSOR'] = u'1'
+        karm.dump()
+        self.assertEqual(karm._written, 0)
+        data = self.read()
+        self.assertEqual(components(data), components(KTIMETRACKER))
+        self.failUnless('X-KARM-CURSOR:1\r\n' in data)
+        self.assertEqual(self.load().properties['X-KARM-CURSOR'], u'1')
+
+    def test_file_changed_since_load(self):
+        karm = self.load()
+        time.sleep(0.01)
+        self.write(KTIMETRACKER.replace('SUMMARY:Done', 'SUMMARY:Other'))
+        os.utime(self.path, (0, 0))
+        karm.dump()
+        # the whole storage is written from memory
+        self.assertEqual(karm._written, 4)
+        self.failIf('VEVENT' in self.read())
+        self.assertEqual(self.load().find(u'101').summary, u'Done')
+
+    def test_permissions(self):
+        os.chmod(self.path, 0640)
+        karm = self.load()
+        karm.find(u'100').summary = u'Changed'
+        karm.dump()
+        self.assertEqual(os.stat(self.path).st_mode & 0777, 0640)
+
+    def test_symbolic_link(self):
+        link = os.path.join(self.directory, 'link.ics')
+        os.symlink(self.path, link)
+        karm = KArm()
+        karm.load(link)
+        karm.find(u'100').summary = u'Changed'
+        karm.dump()
+        self.failUnless(os.path.islink(link))
+        self.assertEqual(self.load().find(u'100').summary, u'Changed')
+
+    def test_hard_link(self):
+        link = os.path.join(self.directory, 'link.ics')
+        os.link(self.path, link)
+        for lazy in (False, True):
+            karm = KArm()
+            karm.load(link, lazy=lazy)
+            karm.find(u'100').summary = u'Changed %s' % lazy
+            karm.dump()
+            self.assertEqual(os.stat(link).st_ino, os.stat(self.path).st_ino)
+            self.assertEqual(self.load().find(u'100').summary,
+                             u'Changed %s' % lazy)
+            self.assertEqual(karm.find(u'101').summary, u'Done')
+
+class ReloadTests(StorageTestCase):
+
+    def setUp(self):
+        StorageTestCase.setUp(self)
+        self.write(KTIMETRACKER)
+        self.karm = self.load()
+        self.mtime = 1000000000
+
+    def change(self, *replacements):
+        """Change storage file the way KTimeTracker does
+        """
+        data = self.read()
+        for old, new in replacements:
+            self.failUnless(old in data, old)
+            data = data.replace(old, new)
+        self.write(data)
+        # modification time is different, even if size is the same
+        self.mtime += 1
+        os.utime(self.path, (self.mtime, self.mtime))
+
+    def test_not_changed(self):
+        self.failIf(self.karm.reload())
+        self.karm.find(u'100').summary = u'Changed'
+        self.failIf(self.karm.reload())
+        self.assertEqual(self.karm.find(u'100').summary, u'Changed')
+
+    def test_changed_in_file(self):
+        self.change(('SUMMARY:List', 'SUMMARY:Renamed'))
+        self.failUnless(self.karm.reload())
+        todo = self.karm.find(u'10')
+        self.assertEqual(todo.summary, u'Renamed')
+        # it's the same as stored value now
+        self.failIf(todo.dirty)
+        self.failIf(self.karm.reload())
+
+    def test_changed_in_memory(self):
+        self.karm.find(u'10').summary = u'Mine'
+        self.change(('SUMMARY:Done', 'SUMMARY:Theirs'))
+        self.failUnless(self.karm.reload())
+        self.assertEqual(self.karm.find(u'10').summary, u'Mine')
+        self.assertEqual(self.karm.find(u'101').summary, u'Theirs')
+
+    def test_changed_in_both(self):
+        todo = self.karm.find(u'100')
+        todo.summary = u'Mine'
+        todo.x_kde_ktimetracker_totalsessiontime = 40
+        todo.x_kde_ktimetracker_totaltasktime = 10
+        self.change(('SUMMARY:Item with', 'SUMMARY:Their item with'),
+                    ('totalSessionTime:30', 'totalSessionTime:45\n'
+                     'X-KDE-ktimetracker-totalTaskTime:5'))
+        self.failUnless(self.karm.reload())
+        self.assertEqual(todo.summary, u'Mine')
+        # time logged into the file is added to time logged in memory
+        self.assertEqual(todo.x_kde_ktimetracker_totalsessiontime, 55)
+        self.assertEqual(todo.x_kde_ktimetracker_totaltasktime, 15)
+        self.karm.dump()
+        todo = self.load().find(u'100')
+        self.assertEqual(todo.summary, u'Mine')
+        self.assertEqual(todo.x_kde_ktimetracker_totalsessiontime, 55)
+
+    def test_moved_in_file(self):
+        self.karm.find(u'1').add(Todo(u'11', u'Other', related_to=u'1',
+                                      x_kde_ktimetracker_bctype=u'todolist'))
+        self.karm.dump()
+        self.change(('UID:101\nRELATED-TO:10', 'UID:101\nRELATED-TO:11'),
+                    ('UID:100\nRELATED-TO:10', 'UID:100\nRELATED-TO:11'))
+        # todo moved in memory stays where it is
+        self.karm.move(u'100', u'1', u'todoitem')
+        self.failUnless(self.karm.reload())
+        self.failUnless(self.karm.find(u'101')._parent is
+                        self.karm.find(u'11'))
+        self.failUnless(self.karm.find(u'100')._parent is
+                        self.karm.find(u'1'))
+
+    def test_added_in_file(self):
+        self.change(('END:VCALENDAR',
+                     'BEGIN:VTODO\nUID:102\nRELATED-TO:10\nSUMMARY:Theirs\n'
+                     'X-KDE-ktimetracker-bctype:todoitem\nEND:VTODO\n'
+                     'BEGIN:VTODO\nUID:103\nRELATED-TO:missing\n'
+                     'SUMMARY:Orphan\nEND:VTODO\n'
+                     'BEGIN:VTODO\nUID:104\nRELATED-TO:102\n'
+                     'SUMMARY:Entry\nEND:VTODO\n'
+                     'BEGIN:VTODO\nUID:105\nSUMMARY:Same\nEND:VTODO\n'
+                     'END:VCALENDAR'))
+        self.karm.add(Todo(u'105', u'Mine'))
+        self.failUnless(self.karm.reload())
+        todo = self.karm.find(u'102')
+        self.failUnless(todo._parent is self.karm.find(u'10'))
+        self.assertEqual(todo.todos.keys(), [u'104'])
+        self.assertEqual([todo.uid for todo in self.karm.orphans], [u'103'])
+        self.assertEqual(self.karm.find(u'105').summary, u'Mine')
+        self.failIf(self.karm.find(u'102').dirty)
+
+    def test_deleted_in_file(self):
+        self.karm.find(u'101').add(Todo(u'1010', u'Entry', related_to=u'101'))
+        self.karm.dump()
+        self.change(('BEGIN:VTODO\nUID:101\nRELATED-TO:10\nSUMMARY:Done\n'
+                     'X-KDE-ktimetracker-bctype:todoitem\nEND:VTODO\n', ''),
+                    ('BEGIN:VTODO\nUID:10\nRELATED-TO:1\nSUMMARY:List\n'
+                     'X-KDE-ktimetracker-bctype:todolist\nEND:VTODO\n', ''))
+        # todo changed in memory is kept
+        self.karm.find(u'10').summary = u'Mine'
+        self.failUnless(self.karm.reload())
+        self.assertRaises(NotFoundError, self.karm.find, u'101')
+        self.assertEqual(self.karm.find(u'10').summary, u'Mine')
+        # children of deleted todo become orphans
+        self.assertEqual([todo.uid for todo in self.karm.orphans], [u'1010'])
+
+    def test_deleted_in_memory(self):
+        self.karm.find(u'10').delete(u'101')
+        self.change(('SUMMARY:List', 'SUMMARY:Renamed'))
+        self.failUnless(self.karm.reload())
+        self.assertRaises(NotFoundError, self.karm.find, u'101')
+        self.karm.dump()
+        self.failIf('UID:101' in self.read())
+
+    def test_properties(self):
+        self.karm.properties['X-KARM-MINE'] = u'1'
+        self.change(('X-KDE-ktimetracker-version:4.2',
+                     'X-KDE-ktimetracker-version:4.3\nX-KARM-THEIRS:2'))
+        self.failUnless(self.karm.reload())
+        self.assertEqual(self.karm.properties['X-KARM-MINE'], u'1')
+        self.assertEqual(self.karm.properties['X-KARM-THEIRS'], u'2')
+        self.assertEqual(
+            self.karm.properties['X-KDE-KTIMETRACKER-VERSION'], u'4.3')
+
+    def test_unparsable(self):
+        self.change(('SUMMARY:List', 'SUMMARY;LANGUAGE=en:List'))
+        self.assertRaises(ParseError, self.karm.reload)
+        self.assertEqual(self.karm.find(u'10').summary, u'List')
+
+    def test_only_changed_todos_parsed(self):
+        from basecamp.karm import karm as module
+        parsed = []
+        parseTodo = module.parseTodo
+        def parse(lines):
+            parsed.append(lines)
+            return parseTodo(lines)
+        module.parseTodo = parse
+        try:
+            self.change(('SUMMARY:List', 'SUMMARY:Renamed'))
+            self.karm.reload()
+        finally:
+            module.parseTodo = parseTodo
+        self.assertEqual(len(parsed), 1)
+
+    def test_not_native(self):
+        karm = self.load(native=False)
+        self.assertRaises(KArmError, karm.reload)
+
+class LazyTests(StorageTestCase):
+
+    def setUp(self):
+        StorageTestCase.setUp(self)
+        self.write(KTIMETRACKER)
+        self.karm = self.load(lazy=True)
+
+    def replace(self, *replacements):
+        """Replace storage file with changed one, the way it's dumped
+        """
+        data = self.read()
+        for old, new in replacements:
+            self.failUnless(old in data, old)
+            data = data.replace(old, new)
+        temp = self.path + '.new'
+        f = open(temp, 'wb')
+        f.write(data)
+        f.close()
+        os.rename(temp, self.path)
+
+    def test_not_parsed(self):
+        todo = self.karm.find(u'100')
+        self.failIf(isinstance(todo, Todo))
+        self.assertEqual(todo.related_to, u'10')
+        self.assertEqual(todo._todo, None)
+        self.assertEqual(todo._digest, None)
+        self.assertEqual(todo.x_kde_ktimetracker_totalsessiontime, 30)
+        self.failIf(todo._todo is None)
+        self.failIf(todo.dirty)
+        # children of the same task share it's uid
+        self.failUnless(todo.related_to is
+                        self.karm.find(u'101').related_to)
+
+    def test_changed(self):
+        todo = self.karm.find(u'100')
+        todo.summary = u'Changed'
+        self.assertEqual(todo.summary, u'Changed')
+        self.assertEqual(todo.dirty.keys(), ['summary'])
+        self.assertEqual(self.karm.find(u'1').getSubtreeSessionTime(), 30)
+        todo.x_kde_ktimetracker_totalsessiontime = 40
+        self.assertEqual(self.karm.find(u'1').getSubtreeSessionTime(), 40)
+        self.karm.dump()
+        self.failIf(todo.dirty)
+        todo = self.load().find(u'100')
+        self.assertEqual(todo.summary, u'Changed')
+        self.assertEqual(todo.x_kde_ktimetracker_totalsessiontime, 40)
+
+    def test_reload(self):
+        self.karm.find(u'10').summary = u'Mine'
+        self.replace(('SUMMARY:Done', 'SUMMARY:Theirs'))
+        self.failUnless(self.karm.reload())
+        self.assertEqual(self.karm.find(u'10').summary, u'Mine')
+        self.assertEqual(self.karm.find(u'101').summary, u'Theirs')
+        # todos not changed anywhere are still not parsed
+        self.assertEqual(self.karm.find(u'100')._todo, None)
+        self.failIf(self.karm.reload())
+
+    def test_reload_after_dump(self):
+        self.karm.find(u'10').summary = u'Mine'
+        self.karm.dump()
+        self.replace(('SUMMARY:Done', 'SUMMARY:Theirs'))
+        self.failUnless(self.karm.reload())
+        self.assertEqual(self.karm.find(u'10').summary, u'Mine')
+        self.assertEqual(self.karm.find(u'101').summary, u'Theirs')
+        self.assertEqual(self.karm.find(u'100').summary,
+                         self.load().find(u'100').summary)
+
+def wide(size):
+    todos = [Todo(u'0', u'Project')]
+    for uid in xrange(1, size):
+        todos.append(Todo(unicode(uid), u'Todo', related_to=u'0'))
+    return todos
+
+def deep(size):
+    todos = [Todo(u'0', u'Project')]
+    for uid in xrange(1, size):
+        todos.append(Todo(unicode(uid), u'Todo', related_to=unicode(uid - 1)))
+    # children before parents is the worst case for the builder
+    todos.reverse()
+    return todos
+
+def count(container):
+    total = 0
+    stack = [container]
+    while stack:
+        container = stack.pop()
+        total += len(container.todos)
+        stack.extend(container.todos.values())
+    return total
+
+class HierarchyTests(unittest.TestCase):
+
+    def build(self, todos):
+        karm = KArm()
+        karm._todos2Tasks(todos)
+        return karm
+
+    def test_wide(self):
+        karm = self.build(wide(1000))
+        self.assertEqual(karm.todos.keys(), [u'0'])
+        self.assertEqual(len(karm.todos[u'0'].todos), 999)
+        self.assertEqual(karm.orphans, [])
+        self.assertEqual(karm.cycles, [])
+
+    def test_deep(self):
+        # much deeper than recursion limit
+        size = sys.getrecursionlimit() * 3
+        karm = self.build(deep(size))
+        self.assertEqual(count(karm), size)
+        todo = karm.todos[u'0']
+        for uid in xrange(1, size):
+            todo = todo.todos[unicode(uid)]
+        self.assertEqual(todo.todos, {})
+
+    def test_orphans_and_cycles(self):
+        todos = wide(10)
+        todos.append(Todo(u'o1', u'Orphan', related_to=u'missing'))
+        todos.append(Todo(u'o2', u'Orphan child', related_to=u'o1'))
+        for uid, parent in ((u'c1', u'c2'), (u'c2', u'c3'), (u'c3', u'c1')):
+            todos.append(Todo(uid, u'Cycle', related_to=parent))
+        todos.append(Todo(u'c4', u'Cycle child', related_to=u'c2'))
+        karm = self.build(todos)
+        self.assertEqual(count(karm), 10)
+        self.assertEqual([todo.uid for todo in karm.orphans], [u'o1'])
+        self.assertEqual(karm.orphans[0].todos.keys(), [u'o2'])
+        self.assertEqual(len(karm.cycles), 1)
+        self.assertEqual(sorted([todo.uid for todo in karm.cycles[0]]),
+                         [u'c1', u'c2', u'c3'])
+        # cycle is broken at it's top todo, the rest hang below it
+        top = karm.cycles[0][0]
+        self.assertEqual(count(top), 3)
+
+    def test_large_deep(self):
+        # time of building is measured by benchmarks/bench_hierarchy.py
+        size = 100000
+        todos = deep(size)
+        todos.append(Todo(u'o1', u'Orphan', related_to=u'missing'))
+        todos.append(Todo(u'o2', u'Orphan', related_to=u'missing'))
+        for uid, parent in ((u'c1', u'c2'), (u'c2', u'c1')):
+            todos.append(Todo(uid, u'Cycle', related_to=parent))
+        todos.append(Todo(u'c3', u'Cycle child', related_to=u'c1'))
+        karm = self.build(todos)
+        self.assertEqual(count(karm), size)
+        todo = karm.todos[u'0']
+        for uid in xrange(1, size):
+            todo = todo.todos[unicode(uid)]
+            self.assertEqual(len(todo._parent.todos), 1)
+        self.assertEqual(todo.todos, {})
+        # orphans and cycles are not attached
+        self.assertEqual(len(karm._index), size)
+        self.assertEqual([todo.uid for todo in karm.orphans], [u'o1', u'o2'])
+        self.assertEqual(len(karm.cycles), 1)
+        self.assertEqual(count(karm.cycles[0][0]), 2)
+
+class Stream(object):
+    """Stream which remembers every write
+    """
+
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(data)
+
+class RenderTests(unittest.TestCase):
+
+    def setUp(self):
+        self.karm = KArm()
+        project = self.karm.add(Todo(u'1', u'Project',
+                                     x_kde_ktimetracker_totaltasktime=90))
+        todolist = project.add(Todo(u'10', u'List', related_to=u'1'))
+        todolist.add(Todo(u'101', u'B item', related_to=u'10',
+                          x_kde_ktimetracker_totalsessiontime=5))
+        todolist.add(Todo(u'100', u'A item', related_to=u'10'))
+        todolist.add(Todo(u'102', u'A item', related_to=u'10'))
+        self.karm.find(u'100').markAsComplete()
+        self.karm.add(Todo(u'2', u'Caf\xe9'))
+
+    def render(self, **kw):
+        stream = Stream()
+        self.karm.render(stream, **kw)
+        return stream.writes
+
+    def test_lines(self):
+        writes = self.render()
+        self.assertEqual(writes, [
+            'Caf\xc3\xa9 [2] (00:00, total:00:00)\n',
+            'Project [1] (00:00, total:01:30)\n',
+            '    List [10] (00:00, total:00:00)\n',
+            # tasks with the same summary are ordered by uid
+            '        A item [100] (00:00, total:00:00)\n',
+            '        A item [102] (00:00, total:00:00)\n',
+            '        B item [101] (00:05, total:00:00)\n'])
+        for line in writes:
+            self.failUnless(type(line) is str)
+        self.assertEqual(str(self.karm), ''.join(writes))
+
+    def test_streaming(self):
+        # every line is written before tasks below it are looked at
+        stream = Stream()
+        def filter(todo):
+            stream.writes.append(str(todo.uid))
+            return True
+        self.karm.render(stream, filter=filter)
+        events = stream.writes
+        self.failUnless(events.index('Project [1] (00:00, total:01:30)\n') <
+                        events.index('10'))
+        self.failUnless(events.index('    List [10] (00:00, total:00:00)\n') <
+                        events.index('100'))
+
+    def test_depth(self):
+        self.assertEqual(self.render(depth=2), [
+            'Caf\xc3\xa9 [2] (00:00, total:00:00)\n',
+            'Project [1] (00:00, total:01:30)\n',
+            '    List [10] (00:00, total:00:00)\n'])
+
+    def test_filters(self):
+        from basecamp.karm.karm import isOpen, hasSessionTime
+        self.assertEqual(len(self.render(filter=isOpen)), 5)
+        self.failIf('        A item [100] (00:00, total:00:00)\n' in
+                    self.render(filter=isOpen))
+        # subtrees without session time are skipped as a whole
+        self.assertEqual(self.render(filter=hasSessionTime), [
+            'Project [1] (00:00, total:01:30)\n',
+            '    List [10] (00:00, total:00:00)\n',
+            '        B item [101] (00:05, total:00:00)\n'])
+
+    def test_key(self):
+        writes = self.render(depth=1, key=lambda todo: -int(todo.uid))
+        self.assertEqual([line.split()[1] for line in writes],
+                         ['[2]', '[1]'])
+
+    def test_deep(self):
+        karm = KArm()
+        size = sys.getrecursionlimit() * 3
+        karm._todos2Tasks(deep(size))
+        stream = Stream()
+        karm.render(stream, indent='')
+        self.assertEqual(len(stream.writes), size)
+
+if __name__ == '__main__':
+    unittest.main()
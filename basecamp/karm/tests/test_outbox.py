@@ -0,0 +1,176 @@
+"""Retries of outbox operations
+"""
+import os
+import errno
+import socket
+import shutil
+import urllib2
+import tempfile
+import unittest
+
+from basecamp.karm.outbox import Outbox, Operation, Reference, execute, \
+     notSent
+
+from basecamp.karm.tests.base import Client
+
+class FailingClient(Client):
+    """Fake basecamp client which raises the given errors on the first
+    calls of it's methods
+    """
+
+    def __init__(self, **errors):
+        Client.__init__(self)
+        self.errors = errors
+
+    def __getattribute__(self, name):
+        errors = Client.__getattribute__(self, 'errors').get(name)
+        method = Client.__getattribute__(self, name)
+        if not errors:
+            return method
+        def fail(*args, **kw):
+            method(*args, **kw)
+            raise errors.pop(0)
+        return fail
+
+class CrashingOutbox(Outbox):
+    """Outbox of the process which crashes once the request is sent,
+    before it's marked done
+    """
+
+    def markDone(self, op, result):
+        raise SystemExit, 'Crashed'
+
+def connectionError(code):
+    return urllib2.URLError(socket.error(code, os.strerror(code)))
+
+def statusError(code):
+    return urllib2.HTTPError('http://localhost/', code, 'Error', {}, None)
+
+class ExecuteTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.outbox = Outbox(os.path.join(self.directory, 'outbox'))
+
+    def tearDown(self):
+        self.outbox.close()
+        shutil.rmtree(self.directory)
+
+    def execute(self, client, operations, **kw):
+        self.outbox.create(operations)
+        return execute(operations, lambda: client, self.outbox, retries=1,
+                       **kw)
+
+    def calls(self, client):
+        return [call[0] for call in client.calls]
+
+    def crash(self, operations):
+        """Submit operations to outbox which crashes after the first
+        request, return operations loaded from the journal then
+        """
+        outbox = CrashingOutbox(self.outbox.path)
+        outbox.create(operations)
+        client = FailingClient()
+        self.assertRaises(SystemExit, execute, operations, lambda: client,
+                          outbox, workers=1)
+        outbox.close()
+        self.assertEqual(len(client.calls), 1)
+        return self.outbox.load()
+
+    def test_not_sent(self):
+        self.failUnless(notSent(connectionError(errno.ECONNREFUSED)))
+        self.failUnless(notSent(urllib2.URLError(
+            socket.gaierror(-2, 'Name or service not known'))))
+        self.failIf(notSent(connectionError(errno.ECONNRESET)))
+        self.failIf(notSent(urllib2.URLError(socket.timeout('timed out'))))
+        self.failIf(notSent(statusError(500)))
+        self.failIf(notSent(ValueError('Response can not be parsed')))
+
+    def test_post_is_not_sent_twice(self):
+        for error in (statusError(500), connectionError(errno.ECONNRESET),
+                      urllib2.URLError(socket.timeout('timed out')),
+                      ValueError('Response can not be parsed')):
+            client = FailingClient(createTimeEntryForTodoItem=[error])
+            op = Operation(1, 'createTimeEntryForTodoItem', u'100',
+                           (100, '0.50'))
+            self.assertEqual(self.execute(client, [op]), [op])
+            self.assertEqual(self.calls(client),
+                             ['createTimeEntryForTodoItem'])
+            self.failUnless(op.error is error)
+
+    def test_not_sent_is_retried(self):
+        client = FailingClient(
+            createTodoItem=[connectionError(errno.ECONNREFUSED)])
+        op = Operation(1, 'createTodoItem', u'new', (10, u'Item'))
+        self.assertEqual(self.execute(client, [op]), [])
+        self.assertEqual(self.calls(client),
+                         ['createTodoItem', 'createTodoItem'])
+        self.failUnless(op.done)
+
+    def test_idempotent_is_retried(self):
+        client = FailingClient(completeTodoItem=[statusError(500)])
+        op = Operation(1, 'completeTodoItem', u'100', (100,))
+        self.assertEqual(self.execute(client, [op]), [])
+        self.assertEqual(self.calls(client),
+                         ['completeTodoItem', 'completeTodoItem'])
+
+    def test_crash_after_send(self):
+        operations = self.crash([Operation(1, 'createTimeEntryForTodoItem',
+                                           u'100', (100, '0.50')),
+                                 Operation(2, 'completeTodoItem', u'100',
+                                           (100,), depends=[1])])
+        self.failUnless(operations[0].isUnconfirmed())
+        client = FailingClient()
+        self.assertEqual(execute(operations, lambda: client, self.outbox),
+                         operations)
+        # neither time entry is posted again, nor operation depending on it
+        self.assertEqual(client.calls, [])
+        self.failUnless(self.outbox.load()[0].isUnconfirmed())
+
+        self.assertEqual(execute(operations, lambda: client, self.outbox,
+                                 resend=True), [])
+        self.assertEqual(self.calls(client), ['createTimeEntryForTodoItem',
+                                              'completeTodoItem'])
+        self.failIf([op for op in self.outbox.load() if not op.done])
+
+    def test_crash_after_idempotent(self):
+        operations = self.crash([Operation(1, 'completeTodoItem', u'100',
+                                           (100,))])
+        self.failIf(operations[0].isUnconfirmed())
+        client = FailingClient()
+        self.assertEqual(execute(operations, lambda: client, self.outbox), [])
+        self.assertEqual(self.calls(client), ['completeTodoItem'])
+
+    def test_unconfirmed_after_error(self):
+        client = FailingClient(createTodoItem=[statusError(500)])
+        op = Operation(1, 'createTodoItem', u'new', (10, u'Item'))
+        self.assertEqual(self.execute(client, [op]), [op])
+        self.failUnless(self.outbox.load()[0].isUnconfirmed())
+
+    def test_not_sent_is_not_unconfirmed(self):
+        client = FailingClient(createTodoItem=[
+            connectionError(errno.ECONNREFUSED)] * 2)
+        op = Operation(1, 'createTodoItem', u'new', (10, u'Item'))
+        self.assertEqual(self.execute(client, [op]), [op])
+        operations = self.outbox.load()
+        self.failIf(operations[0].sent)
+        client = FailingClient()
+        self.assertEqual(execute(operations, lambda: client, self.outbox), [])
+        self.assertEqual(self.calls(client), ['createTodoItem'])
+
+    def test_result_error(self):
+        client = FailingClient()
+        def result(op, value):
+            raise ValueError, 'Response has no id'
+        create = Operation(1, 'createTodoItem', u'new', (10, u'Item'))
+        log = Operation(2, 'createTimeEntryForTodoItem', u'new',
+                        (Reference(1), '0.50'))
+        self.assertEqual(self.execute(client, [create, log], result=result),
+                         [create, log])
+        self.failUnless(isinstance(create.error, ValueError))
+        # operation depending on the failed one is not submitted
+        self.assertEqual(self.calls(client), ['createTodoItem'])
+        self.failIf([op for op in self.outbox.load() if op.done])
+
+if __name__ == '__main__':
+    unittest.main()
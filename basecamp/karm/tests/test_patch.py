@@ -0,0 +1,101 @@
+"""Fast path of patched vobject serializer
+"""
+import unittest
+import datetime
+
+import vobject
+import vobject.base
+from vobject.icalendar import utc
+
+from basecamp.karm import patch
+
+LONG = u'Long summary of the todo item which takes much more than ' \
+       u'seventy five octets of the content line'
+
+def calendar(upper=False):
+    """Return calendar with lines of plain text and extension properties,
+    the ones written by the fast path, and the ones which are not
+
+    Names of extension properties are upper case if upper is True.
+    """
+    def name(name):
+        if upper:
+            return name.upper()
+        return name
+    cal = vobject.iCalendar()
+    for uid, summary in ((u'1', u'Project'),
+                         (u'2', LONG),
+                         (u'3', u'\u041f\u0440\u043e\u0435\u043a\u0442 ' * 12),
+                         (u'4', u'Comma, semicolon; backslash \\ and\n'
+                                u'new line')):
+        todo = cal.add('vtodo')
+        todo.add('uid').value = uid
+        todo.add('summary').value = summary
+        todo.add('dtstamp').value = datetime.datetime(2009, 2, 14, 10, 30,
+                                                      tzinfo=utc)
+        todo.add('related-to').value = u'1'
+        todo.add('percent-complete').value = '100'
+        todo.add(name('X-KDE-ktimetracker-totalSessionTime')).value = '125'
+        todo.add(name('X-KDE-ktimetracker-bctype')).value = u'todoitem'
+    todo = cal.add('vtodo')
+    todo.add('uid').value = u'5'
+    todo.add('dtstamp').value = datetime.datetime(2009, 2, 14, tzinfo=utc)
+    # lines with parameters
+    summary = todo.add('summary')
+    summary.value = u'Zusammenfassung, \xfcbersetzt; ' * 3
+    summary.params['LANGUAGE'] = [u'de']
+    description = todo.add('description')
+    description.value = LONG + u'\n\u0444' * 30
+    description.params['ALTREP'] = [u'http://example.com/todo;5']
+    todo.add('X-KARM-NOTE').value = u'\xe9\xe8' * 50
+    return cal
+
+def serialize(cal, fast=True):
+    plainLine = patch._plainLine
+    if not fast:
+        # every line goes through behavior's encode and decode
+        patch._plainLine = lambda obj: None
+    try:
+        return cal.serialize()
+    finally:
+        patch._plainLine = plainLine
+
+class FastPathTests(unittest.TestCase):
+
+    def test_fast_path(self):
+        cal = calendar()
+        data = serialize(cal)
+        self.assertEqual(data, serialize(cal, fast=False))
+        # serializing doesn't change the calendar
+        self.assertEqual(data, serialize(cal))
+
+    def test_lines(self):
+        data = serialize(calendar())
+        lines = data.split('\r\n')
+        self.failIf([line for line in lines if len(line) > 75])
+        self.failUnless('X-KDE-ktimetracker-totalSessionTime:125' in lines)
+        self.failUnless('SUMMARY:Comma\\, semicolon\\; backslash \\\\ and'
+                        '\\nnew line' in lines)
+        unfolded = data.replace('\r\n ', '')
+        self.failUnless('SUMMARY:' + LONG.encode('utf-8') in unfolded)
+        self.failUnless('SUMMARY;LANGUAGE=de:Zusammenfassung\\, '
+                        '\xc3\xbcbersetzt\\; ' in unfolded)
+        self.failUnless('DESCRIPTION;ALTREP="http://example.com/todo;5":'
+                        in unfolded)
+        # multi-byte characters are not split by folding
+        for line in lines:
+            line.decode('utf-8')
+
+    def test_stock_serializer(self):
+        # stock serializer makes every name upper case
+        cal = calendar(upper=True)
+        data = serialize(cal)
+        patched = vobject.base.defaultSerialize
+        vobject.base.defaultSerialize = vobject.base._old_defaultSerialize
+        try:
+            self.assertEqual(data, cal.serialize())
+        finally:
+            vobject.base.defaultSerialize = patched
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+"""Cached subtree totals of todos
+"""
+import os
+import unittest
+
+from basecamp.karm import KArm
+from basecamp.karm.todo import Todo
+
+from basecamp.karm.tests.base import StorageTestCase
+from basecamp.karm.tests.test_karm import vtodo, calendar
+
+def tree():
+    karm = KArm()
+    project = karm.add(Todo(u'1', u'Project',
+                            x_kde_ktimetracker_bctype=u'project',
+                            x_kde_ktimetracker_totalsessiontime=1,
+                            x_kde_ktimetracker_totaltasktime=10))
+    todolist = project.add(Todo(u'10', u'List', related_to=u'1',
+                                x_kde_ktimetracker_bctype=u'todolist',
+                                x_kde_ktimetracker_totalsessiontime=2))
+    todolist.add(Todo(u'100', u'Done', related_to=u'10',
+                      x_kde_ktimetracker_bctype=u'todoitem',
+                      x_kde_ktimetracker_totalsessiontime=3,
+                      x_kde_ktimetracker_totaltasktime=30))
+    todolist.add(Todo(u'101', u'Open', related_to=u'10',
+                      x_kde_ktimetracker_bctype=u'todoitem',
+                      x_kde_ktimetracker_totalsessiontime=4))
+    karm.find(u'100').markAsComplete()
+    karm.add(Todo(u'2', u'Other', x_kde_ktimetracker_bctype=u'project',
+                  x_kde_ktimetracker_totalsessiontime=5))
+    return karm
+
+def totals(todo):
+    return (todo.getSubtreeSessionTime(), todo.getSubtreeTotalTime(),
+            todo.getOpenCount(), todo.getCompletedCount())
+
+class RollupTests(unittest.TestCase):
+
+    def setUp(self):
+        self.karm = tree()
+        self.project = self.karm.find(u'1')
+        self.other = self.karm.find(u'2')
+        # fill the cache of the whole tree
+        totals(self.project)
+        totals(self.other)
+
+    def assertCached(self, *uids):
+        for uid in uids:
+            self.failIf(self.karm.find(uid)._totals is None, uid)
+
+    def assertNotCached(self, *uids):
+        for uid in uids:
+            self.assertEqual(self.karm.find(uid)._totals, None)
+
+    def test_totals(self):
+        self.assertEqual(totals(self.project), (10, 40, 2, 1))
+        self.assertEqual(totals(self.karm.find(u'10')), (9, 30, 1, 1))
+        self.assertEqual(totals(self.karm.find(u'100')), (3, 30, 0, 0))
+        self.assertEqual(totals(self.other), (5, 0, 0, 0))
+        self.assertCached(u'1', u'10', u'100', u'101', u'2')
+
+    def test_attribute_change(self):
+        self.karm.find(u'101').x_kde_ktimetracker_totalsessiontime = 14
+        self.assertNotCached(u'1', u'10', u'101')
+        # siblings and other tasks keep their totals
+        self.assertCached(u'100', u'2')
+        self.assertEqual(totals(self.project), (20, 40, 2, 1))
+        self.karm.find(u'10').x_kde_ktimetracker_totaltasktime = 5
+        self.assertNotCached(u'1', u'10')
+        self.assertCached(u'100', u'101')
+        self.assertEqual(totals(self.project), (20, 45, 2, 1))
+        # change of any other attribute keeps the cache
+        self.karm.find(u'101').summary = u'Renamed'
+        self.assertCached(u'1', u'10', u'101')
+
+    def test_completion(self):
+        item = self.karm.find(u'101')
+        item.markAsComplete()
+        self.assertEqual(totals(self.project), (10, 40, 1, 2))
+        item.markAsInComplete()
+        self.assertEqual(totals(self.project), (10, 40, 2, 1))
+        self.karm.find(u'100').setPercentComplete(50)
+        self.assertEqual(totals(self.project), (10, 40, 3, 0))
+
+    def test_add_delete(self):
+        todolist = self.karm.find(u'10')
+        todolist.add(Todo(u'102', u'New', related_to=u'10',
+                          x_kde_ktimetracker_totalsessiontime=6))
+        self.assertCached(u'100', u'101', u'2')
+        self.assertEqual(totals(self.project), (16, 40, 3, 1))
+        todolist.delete(u'100')
+        self.assertEqual(totals(self.project), (13, 10, 3, 0))
+        self.project.delete(u'10')
+        self.assertEqual(totals(self.project), (1, 10, 0, 0))
+        self.assertEqual(totals(todolist), (12, 0, 2, 0))
+
+    def test_move(self):
+        self.karm.move(u'10', u'2')
+        self.assertCached(u'10', u'100', u'101')
+        self.assertEqual(totals(self.project), (1, 10, 0, 0))
+        self.assertEqual(totals(self.other), (14, 30, 2, 1))
+        self.karm.move(u'101', None)
+        self.assertEqual(totals(self.other), (10, 30, 1, 1))
+        self.assertEqual(totals(self.karm.find(u'10')), (5, 30, 0, 1))
+
+class ReloadRollupTests(StorageTestCase):
+
+    def setUp(self):
+        StorageTestCase.setUp(self)
+        self.write(calendar(vtodo('1', 'Project', bctype='project'),
+                            vtodo('10', 'List', '1', 'todolist'),
+                            vtodo('100', 'Item', '10', 'todoitem')))
+
+    def change(self, old, new):
+        data = self.read()
+        self.failUnless(old in data, old)
+        temp = self.path + '.new'
+        f = open(temp, 'wb')
+        f.write(data.replace(old, new))
+        f.close()
+        os.rename(temp, self.path)
+        os.utime(self.path, (1000000000, 1000000000))
+
+    def assertReloaded(self, **kw):
+        karm = self.load(**kw)
+        project = karm.find(u'1')
+        self.assertEqual(totals(project), (0, 0, 2, 0))
+        self.change('SUMMARY:Item\r\n', 'SUMMARY:Item\r\n'
+                    'X-KDE-ktimetracker-totalSessionTime:7\r\n')
+        self.failUnless(karm.reload())
+        self.assertEqual(totals(project), (7, 0, 2, 0))
+        self.change('END:VCALENDAR', vtodo('101', 'Added', '10', 'todoitem') +
+                    'END:VCALENDAR')
+        self.failUnless(karm.reload())
+        self.assertEqual(totals(project), (7, 0, 3, 0))
+
+    def test_reload(self):
+        self.assertReloaded()
+
+    def test_reload_lazy(self):
+        self.assertReloaded(lazy=True)
+
+if __name__ == '__main__':
+    unittest.main()
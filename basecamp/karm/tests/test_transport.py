@@ -0,0 +1,73 @@
+"""Retries of pooled transport
+"""
+import time
+import socket
+import threading
+import unittest
+import BaseHTTPServer
+
+from basecamp.karm.transport import ConnectionPool
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.getheader('content-length', 0)))
+        server = self.server
+        server.posts += 1
+        if server.posts in server.slow:
+            time.sleep(0.5)
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write('ok')
+        # closed without telling client, like idle keep-alive connection
+        self.close_connection = server.drop
+
+    def log_message(self, *args):
+        pass
+
+class Server(BaseHTTPServer.HTTPServer):
+
+    def handle_error(self, request, address):
+        # client which timed out has closed the connection
+        pass
+
+class TransportTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.server.posts = 0
+        self.server.slow = ()
+        self.server.drop = False
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self.host = '%s:%d' % self.server.server_address
+        self.pool = ConnectionPool(1, timeout=0.2)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def post(self):
+        return self.pool.request('POST', 'http', self.host, '/entries.xml',
+                                 'hours=1')[3]
+
+    def test_timeout_not_sent_again(self):
+        self.server.slow = (2,)
+        self.assertEqual(self.post(), 'ok')
+        self.assertRaises(socket.timeout, self.post)
+        time.sleep(0.5)
+        self.assertEqual(self.server.posts, 2)
+
+    def test_closed_connection_sent_again(self):
+        self.server.drop = True
+        self.assertEqual(self.post(), 'ok')
+        time.sleep(0.1)
+        self.assertEqual(self.post(), 'ok')
+        self.assertEqual(self.server.posts, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,194 @@
+"""Update merging basecamp data into storage
+"""
+import os
+import sys
+import unittest
+from cStringIO import StringIO
+
+from basecamp.karm import KArm
+from basecamp.karm.todo import Todo
+from basecamp.karm.command import update
+from basecamp.karm.command.update import Update, ENTRIES_PAGE
+
+from basecamp.karm.tests.base import StorageTestCase, Client, Record, \
+     command
+
+class ProjectEntriesClient(Client):
+    """Fake basecamp client which also returns time entries of projects
+    page by page
+    """
+
+    def __init__(self, *args, **kw):
+        Client.__init__(self, *args, **kw)
+        self.projectEntries = {}
+
+    def getEntriesForProject(self, project_id, page=1):
+        self.calls.append(('getEntriesForProject', project_id, page))
+        start = (page - 1) * ENTRIES_PAGE
+        return self.projectEntries.get(project_id, [])[
+            start:start + ENTRIES_PAGE]
+
+def entries(count, todo_id, hours='0.5', first=0):
+    return [Record(id=first + i, todo_item_id=todo_id, hours=hours)
+            for i in range(count)]
+
+class ActiveProjectsTests(StorageTestCase):
+
+    def setUp(self):
+        StorageTestCase.setUp(self)
+        karm = KArm()
+        for id in (u'1', u'2'):
+            project = karm.add(Todo(id, u'Project %s' % id,
+                                    x_kde_ktimetracker_bctype=u'project'))
+            todolist = project.add(Todo(id + u'0', u'List', related_to=id,
+                                        x_kde_ktimetracker_bctype=u'todolist'))
+            todolist.add(Todo(id + u'00', u'Item', related_to=id + u'0',
+                              x_kde_ktimetracker_bctype=u'todoitem'))
+        karm.dump(self.path)
+        # project 2 has no todo lists assigned, it's not active
+        self.client.projects = [Record(id=1, name=u'Project 1'),
+                                Record(id=2, name=u'Project 2')]
+        self.client.todolists = [Record(id=10, name=u'List', project_id=1,
+            todo_items=[Record(id=100, content=u'Item')])]
+
+    def changes(self, **options):
+        stdout = sys.stdout
+        sys.stdout = output = StringIO()
+        try:
+            command(Update, self.path, no_cache=True, dry_run=True,
+                    **options).run()
+        finally:
+            sys.stdout = stdout
+        return output.getvalue().splitlines()
+
+    def test_inactive_projects_are_not_removed(self):
+        self.assertEqual(self.changes(active_projects=True), [])
+
+    def test_removed_without_active_projects(self):
+        self.assertEqual(self.changes(),
+                         ['Removed todolist <List> [20]',
+                          'Removed todoitem <Item> [200]'])
+
+class LazyLoadTests(StorageTestCase):
+
+    def setUp(self):
+        StorageTestCase.setUp(self)
+        karm = KArm()
+        karm.add(Todo(u'1', u'Project', x_kde_ktimetracker_bctype=u'project'))
+        karm.dump(self.path)
+        self.client.projects = [Record(id=1, name=u'Project',
+                                       last_changed_on=u'2009-02-14')]
+        self.loads = loads = []
+        class RecordingKArm(KArm):
+            def load(self, file='', native=True, lazy=False):
+                loads.append(lazy)
+                KArm.load(self, file, native, lazy)
+        update.KArm = RecordingKArm
+
+    def tearDown(self):
+        update.KArm = KArm
+        StorageTestCase.tearDown(self)
+
+    def test_lazy_only_with_cursor(self):
+        command(Update, self.path, no_cache=True).run()
+        command(Update, self.path, no_cache=True).run()
+        command(Update, self.path, no_cache=True, full=True).run()
+        self.assertEqual(self.loads, [False, True, False])
+
+class BulkTimeTests(StorageTestCase):
+
+    def setUp(self):
+        StorageTestCase.setUp(self)
+        self.client = ProjectEntriesClient(
+            projects=[Record(id=1, name=u'Project 1'),
+                      Record(id=2, name=u'Project 2')],
+            todolists=[Record(id=10, name=u'List', project_id=1,
+                              todo_items=[Record(id=100, content=u'Item'),
+                                          Record(id=101, content=u'Other')]),
+                       Record(id=20, name=u'List', project_id=2,
+                              todo_items=[Record(id=200, content=u'Item')])])
+
+    def fetch(self, project_ids=(1, 2)):
+        return command(Update, self.path).fetchHours(self.client,
+                                                     list(project_ids))
+
+    def pages(self):
+        return [call[1:] for call in self.client.calls
+                if call[0] == 'getEntriesForProject']
+
+    def test_aggregation(self):
+        self.client.projectEntries = {
+            1: entries(3, 100) + entries(2, 101, '1.25', 10),
+            2: entries(1, 200, '2', 20)}
+        self.assertEqual(self.fetch(),
+                         {'100': 1.5, '101': 2.5, '200': 2.0})
+        self.assertEqual(self.pages(), [(1, 1), (2, 1)])
+
+    def test_pages(self):
+        self.client.projectEntries = {
+            1: entries(ENTRIES_PAGE * 2 + 1, 100, '1'),
+            2: entries(ENTRIES_PAGE, 200, '1', 1000)}
+        self.assertEqual(self.fetch(), {'100': ENTRIES_PAGE * 2 + 1.0,
+                                        '200': float(ENTRIES_PAGE)})
+        # full page is followed by the request of the next, empty one
+        self.assertEqual(self.pages(), [(1, 1), (1, 2), (1, 3),
+                                        (2, 1), (2, 2)])
+
+    def test_same_page(self):
+        # client ignoring the page returns the first one again, it's
+        # entries are counted once
+        self.client.getEntriesForProject = lambda project_id, page=1: \
+            entries(ENTRIES_PAGE, 100, '1')
+        self.assertEqual(self.fetch([1]), {'100': float(ENTRIES_PAGE)})
+
+    def test_entries_without_todo(self):
+        self.client.projectEntries = {
+            1: entries(2, 100) + entries(1, None, '3', 10) +
+               entries(1, u'', '3', 20)}
+        self.assertEqual(self.fetch([1]), {'100': 1.0})
+
+    def test_without_todo_attribute(self):
+        self.client.projectEntries = {1: [Record(id=1, hours='3')]}
+        self.assertEqual(self.fetch([1]), None)
+
+    def test_without_project_entries(self):
+        self.client = Client()
+        self.assertEqual(self.fetch(), None)
+
+    def update(self):
+        KArm().dump(self.path)
+        command(Update, self.path, no_cache=True, update_time=True,
+                bulk_time=True).run()
+        karm = KArm()
+        karm.load(self.path)
+        return dict([(uid, karm.find(uid).x_kde_ktimetracker_totaltasktime)
+                     for uid in (u'100', u'101', u'200')])
+
+    def test_update(self):
+        self.client.projectEntries = {
+            1: entries(ENTRIES_PAGE + 10, 100) + entries(1, None, '1', 500),
+            2: entries(2, 200, '0.25', 1000)}
+        self.assertEqual(self.update(), {u'100': 1800, u'101': 0,
+                                         u'200': 30})
+        self.failIf([call for call in self.client.calls
+                     if call[0] == 'getEntriesForTodoItem'])
+
+    def test_update_fallback(self):
+        self.client.projectEntries = {1: [Record(id=1, hours='3')]}
+        self.client.entries = {100: [Record(hours='1.5')],
+                               200: [Record(hours='0.5')]}
+        self.assertEqual(self.update(), {u'100': 90, u'101': 0, u'200': 30})
+        self.assertEqual([call[1] for call in self.client.calls
+                          if call[0] == 'getEntriesForTodoItem'],
+                         [100, 101, 200])
+
+class CacheTests(StorageTestCase):
+
+    def test_cache_directory(self):
+        KArm().dump(self.path)
+        directory = os.path.join(self.directory, 'cache')
+        command(Update, self.path, cache_dir=directory).run()
+        self.failUnless(os.listdir(directory))
+
+if __name__ == '__main__':
+    unittest.main()
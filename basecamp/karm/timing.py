@@ -0,0 +1,218 @@
+"""Phase timing of karm commands and library code
+
+Spans measure wall time of named phases (load, fetch, merge, plan,
+submit, dump), counters count whatever is worth counting (todos loaded
+and written, changes, operations) and calls of basecamp client are
+timed per method. Everything goes into the active Profile, when there
+is no active one spans and counters cost next to nothing:
+
+    from basecamp.karm import timing
+
+    profile = timing.activate()
+    karm.load(path)                 # KArm.load and dump have own spans
+    span = timing.start('report')
+    ...
+    span.stop()
+    timing.deactivate()
+    print profile.report()
+
+Spans of the same name don't nest: inner one is a part of outer one and
+is not counted. Spans and counters could be used from any thread.
+"""
+import time
+import threading
+
+# upper bounds of latency histogram buckets, in milliseconds
+BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500)
+
+class Span(object):
+    """Running phase, stop it to add it's time to the profile
+    """
+
+    def __init__(self, profile, name, nested=False):
+        self.profile = profile
+        self.name = name
+        self.nested = nested
+        self.started = time.time()
+
+    def stop(self):
+        """Stop the span, return seconds it took
+        """
+        seconds = time.time() - self.started
+        if self.profile is not None:
+            self.profile.close(self, seconds)
+            self.profile = None
+        return seconds
+
+class NullSpan(object):
+    # span started while profiling is off
+
+    def stop(self):
+        return 0.0
+
+_null = NullSpan()
+
+class Profile(object):
+    """Times of phases, counters and basecamp calls of one run
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.finished = None
+        self.phases = {}
+        self.counters = {}
+        self.calls = {}
+        self._open = {}
+        self._lock = threading.Lock()
+
+    def open(self, name):
+        self._lock.acquire()
+        try:
+            depth = self._open.get(name, 0)
+            self._open[name] = depth + 1
+        finally:
+            self._lock.release()
+        return Span(self, name, depth > 0)
+
+    def close(self, span, seconds):
+        self._lock.acquire()
+        try:
+            self._open[span.name] -= 1
+            if not span.nested:
+                count, total = self.phases.get(span.name, (0, 0.0))
+                self.phases[span.name] = (count + 1, total + seconds)
+        finally:
+            self._lock.release()
+
+    def count(self, name, number=1):
+        self._lock.acquire()
+        try:
+            self.counters[name] = self.counters.get(name, 0) + number
+        finally:
+            self._lock.release()
+
+    def call(self, method, seconds, failed=False):
+        """Add call of basecamp client's method which took seconds
+        """
+        self._lock.acquire()
+        try:
+            calls = self.calls.get(method)
+            if calls is None:
+                calls = self.calls[method] = {
+                    'count': 0, 'failed': 0, 'seconds': 0.0,
+                    'min': seconds, 'max': seconds,
+                    'histogram': [0] * (len(BUCKETS) + 1)}
+            calls['count'] += 1
+            calls['failed'] += failed
+            calls['seconds'] += seconds
+            calls['min'] = min(calls['min'], seconds)
+            calls['max'] = max(calls['max'], seconds)
+            milliseconds = seconds * 1000
+            for index in range(len(BUCKETS)):
+                if milliseconds < BUCKETS[index]:
+                    break
+            else:
+                index = len(BUCKETS)
+            calls['histogram'][index] += 1
+        finally:
+            self._lock.release()
+
+    def finish(self):
+        if self.finished is None:
+            self.finished = time.time()
+
+    def report(self):
+        """Return profile as a dict ready to be written as JSON
+        """
+        end = self.finished or time.time()
+        labels = ['<%dms' % bound for bound in BUCKETS] + \
+                 ['>=%dms' % BUCKETS[-1]]
+        calls = {}
+        for method, stats in self.calls.items():
+            calls[method] = {
+                'count': stats['count'],
+                'failed': stats['failed'],
+                'seconds': stats['seconds'],
+                'mean': stats['seconds'] / stats['count'],
+                'min': stats['min'],
+                'max': stats['max'],
+                'histogram': dict([(label, count) for label, count
+                                   in zip(labels, stats['histogram'])
+                                   if count])}
+        return {'seconds': end - self.started,
+                'phases': dict([(name, {'count': count, 'seconds': seconds})
+                                for name, (count, seconds)
+                                in self.phases.items()]),
+                'counters': dict(self.counters),
+                'calls': calls}
+
+
+class TimedClient(object):
+    """Basecamp client whose method calls are added to the profile
+    """
+
+    def __init__(self, client, profile):
+        self._client = client
+        self._profile = profile
+
+    def __getattr__(self, name):
+        value = getattr(self._client, name)
+        if not callable(value) or name.startswith('_'):
+            return value
+        profile = self._profile
+        def call(*args, **kw):
+            started = time.time()
+            try:
+                result = value(*args, **kw)
+            except:
+                profile.call(name, time.time() - started, True)
+                raise
+            profile.call(name, time.time() - started)
+            return result
+        return call
+
+
+_profile = None
+
+def activate(profile=None):
+    """Make profile (new one by default) active and return it
+    """
+    global _profile
+    if profile is None:
+        profile = Profile()
+    _profile = profile
+    return profile
+
+def deactivate():
+    """Finish and return active profile, None if there is no one
+    """
+    global _profile
+    profile = _profile
+    _profile = None
+    if profile is not None:
+        profile.finish()
+    return profile
+
+def active():
+    return _profile
+
+def start(name):
+    """Start span of the named phase
+    """
+    if _profile is None:
+        return _null
+    return _profile.open(name)
+
+def count(name, number=1):
+    """Add number to the named counter
+    """
+    if _profile is not None:
+        _profile.count(name, number)
+
+def timedClient(client):
+    """Return client timing it's calls when profiling is on, otherwise
+    client itself
+    """
+    if _profile is None:
+        return client
+    return TimedClient(client, _profile)
@@ -20,78 +20,161 @@ Todo schema:
 
 """
 
-from errors import NotFoundError, DuplicationError
+from errors import KArmError, NotFoundError, DuplicationError
 from utils import timeStamp2KArm, unescape
 
+# attributes which are stored in iCalendar file
+FIELDS = ('uid', 'summary', 'dtstamp', 'created', 'last_modified',
+          'related_to', 'completed', 'percent_complete',
+          'x_kde_ktimetracker_totalsessiontime',
+          'x_kde_ktimetracker_totaltasktime', 'x_kde_ktimetracker_bctype')
+_fields = frozenset(FIELDS)
+# attributes subtree rollups depend on
+_rollupFields = frozenset(('completed', 'percent_complete',
+                           'x_kde_ktimetracker_totalsessiontime',
+                           'x_kde_ktimetracker_totaltasktime'))
 
-class Todo(object):
-    """Todo class
-    
-    Todo Attributes:
-        uid - unique id
-        dtstamp - date and time stamp
-        created - date and time of creation
-        last_modified - date and time of last modification
-        summary - task name
-        related_to - parent task uid or None in case it's root task
-        completed - date and time when task was completed
-        percent_complete - how many percents of the task is completed
-        x_kde_ktimetracker_totalsessiontime - KTime session time of the task
-        x_kde_ktimetracker_totaltasktime - KTime time of the task
-        x_kde_ktimetracker-bctype - type of task as it's represented in basecamp
-                              (project, todolist, todoitem or None)
-        
-        todos - contained todos
+# known basecamp types of tasks, every todo refers to one of these
+# strings instead of keeping it's own copy
+BCTYPES = (u'project', u'todolist', u'todoitem')
+_bctypes = dict([(bctype, bctype) for bctype in BCTYPES])
+# basecamp type of the task which contains task of the given type
+PARENT_BCTYPES = {u'todolist': u'project', u'todoitem': u'todolist'}
+# attributes todo is registered in uid index by
+_keyFields = frozenset(('uid', 'x_kde_ktimetracker_bctype'))
+
+
+class _EmptyMapping(dict):
+    """Empty mapping which can't be changed
     
+    Single instance of it is shared by todos as long as they don't have
+    contained todos or changed attributes.
     """
+    __slots__ = ()
     
-    def __init__(self, uid, summary, dtstamp=None, created=None,
-                 last_modified=None, related_to=None, completed=None,
-                 percent_complete=None, x_kde_ktimetracker_totalsessiontime=None,
-                 x_kde_ktimetracker_totaltasktime=None, x_kde_ktimetracker_bctype=None):
-        self.uid = uid
-        self.summary = unescape(summary)
-        self.dtstamp = dtstamp
-        self.created = created
-        self.last_modified = last_modified
-        self.related_to = related_to
-        self.completed = completed
-        self.percent_complete = percent_complete
-        self.x_kde_ktimetracker_totalsessiontime = x_kde_ktimetracker_totalsessiontime
-        self.x_kde_ktimetracker_totaltasktime = x_kde_ktimetracker_totaltasktime
-        self.x_kde_ktimetracker_bctype = x_kde_ktimetracker_bctype
-
-        self.todos = {}
+    def _readonly(self, *args, **kw):
+        raise TypeError, 'Shared empty mapping can not be changed'
+    
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = \
+        update = _readonly
+
+_empty = _EmptyMapping()
+
+
+class BaseTodo(object):
+    """Todo without attributes which are stored in iCalendar file
+
+    Everything but the stored attributes is here: contained todos,
+    changes tracking, subtree totals and uid index registration, so
+    that todo classes could keep stored attributes their own way (see
+    Todo and lazy module's LazyTodo).
+    """
+    __slots__ = ('todos', 'dirty', '_parent', '_index', '_span', '_digest',
+                 '_totals')
+    # sets attribute right on the todo, once it's change is tracked
+    _setattr = object.__setattr__
+
+    def __setattr__(self, name, value):
+        if name in _fields:
+            if name == 'x_kde_ktimetracker_bctype':
+                value = _bctypes.get(value, value)
+            if name in _keyFields and self._index is not None:
+                self._rekey(name, value)
+            if name not in self.dirty:
+                base = getattr(self, name, None)
+                if self.dirty is _empty:
+                    object.__setattr__(self, 'dirty', {})
+                self.dirty[name] = base
+            if name in _rollupFields:
+                self._invalidate()
+        self._setattr(name, value)
+
+    def _key(self):
+        """Return key of the todo in uid index
+
+        Basecamp projects, todo lists and todo items have ids of their
+        own, so uid is unique only among the tasks of the same type.
+        """
+        return (self.x_kde_ktimetracker_bctype, self.uid)
+
+    def _rekey(self, name, value):
+        """Register todo in uid index under the key it gets once
+        attribute of the given name is set to value
+        """
+        old = self._key()
+        if name == 'uid':
+            new = (old[0], value)
+        else:
+            new = (value, old[1])
+        if new == old:
+            return
+        index = self._index
+        if index.get(new, self) is not self:
+            raise DuplicationError, 'There already exists task with "%s" ' \
+                'id and %s type' % (new[1], new[0])
+        if index.get(old) is self:
+            del index[old]
+        index[new] = self
+
+    def _clean(self):
+        """Forget changes, todo is the same as the stored one
+        """
+        self.dirty = _empty
     
     def markAsComplete(self):
         """Mark task as completed
         
         This method set 'completed' datetime attribute and
-        set 'percent_complete' attribute to '100' value
+        set 'percent_complete' attribute to 100 value
         """
         self.completed = timeStamp2KArm()
-        self.percent_complete = '100'
+        self.percent_complete = 100
 
     def markAsInComplete(self):
         """Mark task as not completed
         
         This method set 'completed' datetime attribute to None
-        and set 'percent_complete' attribute to '0' value
+        and set 'percent_complete' attribute to 0 value
         """
         self.completed = None
-        self.percent_complete = '0'
+        self.percent_complete = 0
+    
+    def getPercentComplete(self):
+        """Return how many percents of the task is completed
+        
+        Task without percent_complete set is not completed at all.
+        """
+        return self.percent_complete or 0
+    
+    def setPercentComplete(self, percent):
+        """Set how many percents of the task is completed
+        
+        percent could be anything int() accepts, it should be in
+        0-100 range.
+        """
+        percent = int(percent)
+        if percent < 0 or percent > 100:
+            raise KArmError, 'Percent complete should be in 0-100 range, ' \
+                'got %d' % percent
+        self.percent_complete = percent
     
     def isCompleted(self):
         """Return whether task is already completed
         """
-        return self.completed is not None and self.percent_complete == '100'
+        return self.completed is not None and self.percent_complete == 100
 
     def add(self, todo):
         """Add contained todo
         """
         if self.todos.has_key(todo.uid):
             raise DuplicationError, 'There already exists task with "%s" id in "%s" task' % (todo.uid, self.uid)
+        if self._index is not None:
+            todo._attach(self._index)
+        if self.todos is _empty:
+            self.todos = {}
         self.todos[todo.uid] = todo
+        todo._parent = self
+        self._invalidate()
         return todo
     
     def delete(self, uid):
@@ -101,4 +184,173 @@ class Todo(object):
             raise NotFoundError, 'Task with "%s" id not found in "%s" task' % (uid, self.uid)
         todo = self.todos[uid]
         del self.todos[uid]
+        todo._parent = None
+        todo._detach()
+        self._invalidate()
         return todo
+
+    def getSubtreeSessionTime(self):
+        """Return session time of the todo and all it's contained todos
+        on any level of nesting
+        """
+        return self._rollup()[0]
+
+    def getSubtreeTotalTime(self):
+        """Return total time of the todo and all it's contained todos
+        on any level of nesting
+        """
+        return self._rollup()[1]
+
+    def getOpenCount(self):
+        """Return number of not completed todos contained in the todo
+        on any level of nesting
+        """
+        return self._rollup()[2]
+
+    def getCompletedCount(self):
+        """Return number of completed todos contained in the todo
+        on any level of nesting
+        """
+        return self._rollup()[3]
+
+    def _rollup(self):
+        """Return cached totals of the subtree, calculate them first
+        for todos which don't have them cached
+        """
+        if self._totals is not None:
+            return self._totals
+        stack = [(self, False)]
+        while stack:
+            todo, ready = stack.pop()
+            if not ready:
+                # children go first
+                stack.append((todo, True))
+                for child in todo.todos.values():
+                    if child._totals is None:
+                        stack.append((child, False))
+                continue
+            session = todo.x_kde_ktimetracker_totalsessiontime or 0
+            total = todo.x_kde_ktimetracker_totaltasktime or 0
+            opened = completed = 0
+            for child in todo.todos.values():
+                totals = child._totals
+                session += totals[0]
+                total += totals[1]
+                opened += totals[2]
+                completed += totals[3]
+                if child.isCompleted():
+                    completed += 1
+                else:
+                    opened += 1
+            todo._totals = (session, total, opened, completed)
+        return self._totals
+
+    def _invalidate(self):
+        """Drop cached totals of the todo and it's parents
+        """
+        todo = self
+        while todo is not None and todo._totals is not None:
+            todo._totals = None
+            todo = todo._parent
+
+    def walk(self):
+        """Iterate over todo itself and all it's contained todos
+        on any level of nesting, parents go before their children
+        """
+        stack = [self]
+        while stack:
+            todo = stack.pop()
+            yield todo
+            children = todo.todos.values()
+            children.reverse()
+            stack.extend(children)
+
+    def _attach(self, index):
+        """Register todo together with it's children in uid index
+        """
+        todos = list(self.walk())
+        for todo in todos:
+            if index.get(todo._key(), todo) is not todo:
+                raise DuplicationError, 'There already exists task with ' \
+                    '"%s" id and %s type' % (todo.uid,
+                                             todo.x_kde_ktimetracker_bctype)
+        for todo in todos:
+            index[todo._key()] = todo
+            todo._index = index
+
+    def _detach(self):
+        """Remove todo together with it's children from uid index
+        """
+        index = self._index
+        if index is None:
+            return
+        for todo in self.walk():
+            key = todo._key()
+            if index.get(key) is todo:
+                del index[key]
+            todo._index = None
+
+
+class Todo(BaseTodo):
+    """Todo class
+    
+    Todo Attributes:
+        uid - unique id
+        dtstamp - date and time stamp
+        created - date and time of creation
+        last_modified - date and time of last modification
+        summary - task name
+        related_to - parent task uid or None in case it's root task
+        completed - date and time when task was completed
+        percent_complete - how many percents of the task is completed
+        x_kde_ktimetracker_totalsessiontime - KTime session time of the task
+                                              in minutes
+        x_kde_ktimetracker_totaltasktime - KTime time of the task in minutes
+        x_kde_ktimetracker-bctype - type of task as it's represented in basecamp
+                              (project, todolist, todoitem or None)
+        
+        todos - contained todos
+        dirty - attributes changed since todo was loaded from or dumped
+                to the storage file, mapped to the values they had there
+    
+    There may be hundreds of thousands of todos loaded at once, so they
+    have no instance dictionary. todos and dirty of the todo are the same
+    shared empty mapping until something is added to them.
+    
+    Time and completion totals of the todo's subtree are cached. Cache of
+    the todo and all it's parents is dropped when any of them changes, so
+    if todo has totals cached then all it's children have them as well.
+    """
+    __slots__ = FIELDS
+    
+    def __init__(self, uid, summary, dtstamp=None, created=None,
+                 last_modified=None, related_to=None, completed=None,
+                 percent_complete=None, x_kde_ktimetracker_totalsessiontime=None,
+                 x_kde_ktimetracker_totaltasktime=None, x_kde_ktimetracker_bctype=None):
+        setattr = object.__setattr__
+        # new todo is not stored yet, all it's attributes are changed
+        setattr(self, 'dirty', dict.fromkeys(FIELDS))
+        setattr(self, 'uid', uid)
+        setattr(self, 'summary', unescape(summary))
+        setattr(self, 'dtstamp', dtstamp)
+        setattr(self, 'created', created)
+        setattr(self, 'last_modified', last_modified)
+        setattr(self, 'related_to', related_to)
+        setattr(self, 'completed', completed)
+        setattr(self, 'percent_complete', percent_complete)
+        setattr(self, 'x_kde_ktimetracker_totalsessiontime', x_kde_ktimetracker_totalsessiontime)
+        setattr(self, 'x_kde_ktimetracker_totaltasktime', x_kde_ktimetracker_totaltasktime)
+        setattr(self, 'x_kde_ktimetracker_bctype',
+                _bctypes.get(x_kde_ktimetracker_bctype, x_kde_ktimetracker_bctype))
+
+        setattr(self, 'todos', _empty)
+
+        # container task and KArm's (bctype, uid) index this todo is
+        # registered in
+        self._parent = None
+        self._index = None
+        # (start, end) byte offsets and digest of the todo in the storage file
+        self._span = None
+        self._digest = None
+        # (session time, total time, open, completed) of the subtree
+        self._totals = None
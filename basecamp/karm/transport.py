@@ -0,0 +1,287 @@
+"""Pooled HTTP transport for basecamp requests
+
+Basecamp client makes lots of small requests, and with a new connection
+for each of them most of the time is spent on TCP and TLS setup. Here
+connections to the server are kept open and reused by all the clients
+of the process, which share the same pool (see getPool and connect).
+
+Pool also records how long each request took.
+"""
+import time
+import errno
+import socket
+import urllib
+import urllib2
+import httplib
+import threading
+from cStringIO import StringIO
+
+from timing import timedClient
+
+# errors of sending request through reused connection which server
+# could have closed meanwhile
+_sendErrors = (httplib.CannotSendRequest, socket.error)
+# errors of waiting for response, request could have been processed
+_responseErrors = (httplib.BadStatusLine, httplib.ResponseNotReady,
+                   socket.error)
+
+def _unanswered(error):
+    """Whether error of waiting for response means server closed the
+    connection without any byte of response, the way it closes idle
+    keep-alive connections
+    """
+    if isinstance(error, socket.timeout):
+        return False
+    if isinstance(error, httplib.BadStatusLine):
+        return error.line in ('', "''") or \
+               error.line.startswith('No status line received')
+    if isinstance(error, socket.error):
+        return error.args and error.args[0] in (errno.ECONNRESET,
+                                                errno.EPIPE)
+    return False
+
+class ConnectionPool(object):
+    """Persistent connections to HTTP servers
+
+    No more than size connections are open at once, threads which need
+    more wait until one of the connections is released. timeout is
+    socket timeout in seconds for every request, None means system's
+    default one.
+
+    Every request made through the pool is recorded in timings list as
+    (method, url, status, seconds) tuple, status is None for failed ones.
+
+    Request is sent again through a new connection only if the reused one
+    turns out to be closed by server before any byte of response, so
+    that server couldn't have processed it. Timed out requests are never
+    sent again.
+    """
+
+    def __init__(self, size=4, timeout=None):
+        self.size = size
+        self.timeout = timeout
+        self.timings = []
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(size)
+
+    def _connect(self, scheme, host):
+        if scheme == 'https':
+            factory = httplib.HTTPSConnection
+        else:
+            factory = httplib.HTTPConnection
+        if self.timeout is None:
+            return factory(host)
+        return factory(host, timeout=self.timeout)
+
+    def _acquire(self, scheme, host):
+        """Return (connection, reused) pair, wait for free slot if all
+        of them are taken
+        """
+        self._slots.acquire()
+        self._lock.acquire()
+        try:
+            idle = self._idle.get((scheme, host))
+            if idle:
+                return idle.pop(), True
+        finally:
+            self._lock.release()
+        return self._connect(scheme, host), False
+
+    def _release(self, scheme, host, connection, reuse):
+        if reuse:
+            self._lock.acquire()
+            try:
+                self._idle.setdefault((scheme, host), []).append(connection)
+            finally:
+                self._lock.release()
+        else:
+            connection.close()
+        self._slots.release()
+
+    def request(self, method, scheme, host, path, body=None, headers={}):
+        """Make request and return (status, reason, headers, body) of the
+        response, response body is read completely
+        """
+        url = '%s://%s%s' % (scheme, host, path)
+        start = time.time()
+        status = None
+        try:
+            while True:
+                connection, reused = self._acquire(scheme, host)
+                try:
+                    try:
+                        connection.request(method, path, body, headers)
+                    except socket.timeout:
+                        raise
+                    except _sendErrors:
+                        if not reused:
+                            raise
+                        # try once again with a new connection
+                        self._release(scheme, host, connection, False)
+                        continue
+                    try:
+                        response = connection.getresponse()
+                    except _responseErrors, e:
+                        if not reused or not _unanswered(e):
+                            raise
+                        self._release(scheme, host, connection, False)
+                        continue
+                    data = response.read()
+                except:
+                    self._release(scheme, host, connection, False)
+                    raise
+                self._release(scheme, host, connection,
+                              not response.will_close)
+                status = response.status
+                return status, response.reason, response.msg, data
+        finally:
+            self.timings.append((method, url, status, time.time() - start))
+
+    def close(self):
+        """Close all idle connections
+        """
+        self._lock.acquire()
+        try:
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+            self._idle = {}
+        finally:
+            self._lock.release()
+
+
+class PooledHandler(urllib2.AbstractHTTPHandler):
+    """urllib2 handler which makes http and https requests through
+    connection pool
+
+    With cache (see cache.ResponseCache) GET requests are answered from
+    it while the entry is fresh, and are made conditional when it's not.
+    """
+    # go before default handlers of the opener
+    handler_order = urllib2.AbstractHTTPHandler.handler_order - 100
+
+    def __init__(self, pool, cache=None):
+        urllib2.AbstractHTTPHandler.__init__(self)
+        self.pool = pool
+        self.cache = cache
+
+    def http_open(self, req):
+        return self._open(req, 'http')
+
+    def https_open(self, req):
+        return self._open(req, 'https')
+
+    http_request = urllib2.AbstractHTTPHandler.do_request_
+    https_request = urllib2.AbstractHTTPHandler.do_request_
+
+    def _open(self, req, scheme):
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+        headers = dict(req.unredirected_hdrs)
+        headers.update(req.headers)
+        headers = dict([(name.title(), value)
+                        for name, value in headers.items()])
+        headers['Connection'] = 'keep-alive'
+        method = req.get_method()
+
+        key = entry = None
+        if self.cache is not None and method == 'GET':
+            key = self.cache.key(req.get_full_url(),
+                                 headers.get('Authorization', ''))
+            entry = self.cache.lookup(key)
+            if entry is not None:
+                if self.cache.isFresh(entry):
+                    return self._cached(req, entry)
+                if entry['etag']:
+                    headers['If-None-Match'] = entry['etag']
+                if entry['last_modified']:
+                    headers['If-Modified-Since'] = entry['last_modified']
+
+        try:
+            status, reason, msg, data = self.pool.request(
+                method, scheme, host, req.get_selector(),
+                req.get_data(), headers)
+        except (socket.error, httplib.HTTPException), e:
+            raise urllib2.URLError(e)
+
+        if key is not None:
+            if status == 304 and entry is not None:
+                # stored again to be fresh for another ttl seconds
+                self.cache.store(key, entry)
+                return self._cached(req, entry)
+            if status == 200:
+                entry = {
+                    'status': status,
+                    'reason': reason,
+                    'headers': msg.headers,
+                    'body': data,
+                    'etag': msg.getheader('etag'),
+                    'last_modified': msg.getheader('last-modified'),
+                }
+                if entry['etag'] or entry['last_modified'] or \
+                   self.cache.ttl > 0:
+                    self.cache.store(key, entry)
+                self.cache.serve(entry)
+        return self._response(req, status, reason, msg, data)
+
+    def _cached(self, req, entry):
+        self.cache.serve(entry)
+        msg = httplib.HTTPMessage(StringIO(''.join(entry['headers'])))
+        return self._response(req, entry['status'], entry['reason'], msg,
+                              entry['body'])
+
+    def _response(self, req, status, reason, msg, data):
+        response = urllib.addinfourl(StringIO(data), msg,
+                                     req.get_full_url())
+        response.code = status
+        response.msg = reason
+        return response
+
+
+_pool = None
+
+def getPool(size=4, timeout=None):
+    """Return connection pool shared by the whole process
+
+    Pool is created on the first call, later calls return the same one.
+    """
+    global _pool
+    if _pool is None:
+        # options given on command line are strings
+        if timeout is not None:
+            timeout = float(timeout)
+        _pool = ConnectionPool(int(size), timeout)
+    return _pool
+
+def connect(url, user, password, pool=None, cache=None):
+    """Return basecamp client which makes requests through pool, shared
+    one by default, and cache if it's given
+    """
+    from basecamp.api import Basecamp
+
+    if pool is None:
+        pool = getPool()
+    bc = Basecamp(url, user, password)
+    handler = PooledHandler(pool, cache)
+    opener = getattr(bc, 'opener', None)
+    if opener is not None:
+        opener.add_handler(handler)
+    else:
+        # client uses urllib2.urlopen
+        urllib2.install_opener(urllib2.build_opener(handler))
+    return timedClient(bc)
+
+def timingReport(pool):
+    """Return short summary of requests made through pool
+    """
+    count = len(pool.timings)
+    total = sum([seconds for method, url, status, seconds in pool.timings])
+    failed = len([status for method, url, status, seconds in pool.timings
+                  if status is None])
+    if not count:
+        return 'No requests to basecamp were made'
+    return 'Made %d requests to basecamp (%d failed) in %.2fs, ' \
+           '%.0fms per request' % (count, failed, total,
+                                   total * 1000 / count)
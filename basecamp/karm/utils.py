@@ -29,8 +29,6 @@ def bcTime(time):
 
 def getSessionTime(todo):
     sessionTime = todo.x_kde_ktimetracker_totalsessiontime
-    if sessionTime is not None:
-        sessionTime = int(sessionTime)
-        if sessionTime > 0:
-            return sessionTime
+    if sessionTime is not None and sessionTime > 0:
+        return sessionTime
     return None
@@ -0,0 +1,55 @@
+"""Worker threads for concurrent basecamp requests
+
+Basecamp API calls spend most of their time waiting for the server, so
+running a few of them at once in threads speeds things up even though
+only one thread runs python code at a time.
+"""
+import sys
+import threading
+from Queue import Queue, Empty
+
+def concurrentMap(function, items, workers=4):
+    """Return list of function(item) results in the order of items
+    
+    function is called from up to workers threads at once. If any of the
+    calls raises an exception, the rest of items are not processed and
+    the exception is re-raised.
+    """
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    
+    queue = Queue()
+    for index in range(len(items)):
+        queue.put(index)
+    results = [None] * len(items)
+    errors = []
+    
+    def work():
+        while not errors:
+            try:
+                index = queue.get_nowait()
+            except Empty:
+                return
+            try:
+                results[index] = function(items[index])
+            except:
+                errors.append(sys.exc_info())
+    
+    threads = []
+    for i in range(min(workers, len(items))):
+        thread = threading.Thread(target=work)
+        thread.setDaemon(True)
+        thread.start()
+        threads.append(thread)
+    try:
+        for thread in threads:
+            # join with timeout, so that Ctrl-C still works
+            while thread.isAlive():
+                thread.join(0.1)
+    except KeyboardInterrupt:
+        errors.append(sys.exc_info())
+    if errors:
+        type, value, traceback = errors[0]
+        raise type, value, traceback
+    return results
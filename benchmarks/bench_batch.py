@@ -0,0 +1,91 @@
+"""Batch jobs in a process pool versus a process per job
+
+Usage: python benchmarks/bench_batch.py [--jobs=N] [--todos=N]
+                                       [--processes=N]
+
+Every job loads its own synthetic storage, the way update and checkin
+start. Jobs are run as separate python processes (what running karm
+for each storage from a shell script does), up to N at once, and then
+through batch module's pool of N worker processes, which import
+everything once.
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+from optparse import OptionParser
+
+from basecamp.karm import KArm
+from basecamp.karm.batch import Job, runBatch
+
+from synthetic import writeStorage
+
+SCRIPT = """
+import sys
+from basecamp.karm import KArm
+import vobject
+KArm().load(sys.argv[1])
+"""
+
+def loadStorage(argv):
+    for arg in argv:
+        if arg.startswith('--storage='):
+            KArm().load(arg.split('=', 1)[1])
+
+def separate(paths, processes):
+    """Run a python process for each storage, return seconds
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(sys.path)
+    start = time.time()
+    running = []
+    for path in paths:
+        while len(running) >= processes:
+            running.pop(0).wait()
+        running.append(subprocess.Popen([sys.executable, '-c', SCRIPT, path],
+                                        env=env))
+    for process in running:
+        process.wait()
+    return time.time() - start
+
+def pooled(paths, processes):
+    """Run batch jobs for storages, return (seconds, all jobs are ok)
+    """
+    # workers are forked with vobject imported, the way karm does it
+    import vobject
+    jobs = [Job(index, 'http://localhost', 'user', path, 'secret')
+            for index, path in enumerate(paths)]
+    start = time.time()
+    results = runBatch(loadStorage, jobs, [], ['up'], processes=processes)
+    ok = [status for job, status, seconds in results] == ['ok'] * len(jobs)
+    return time.time() - start, ok
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--jobs', type='int', default=40)
+    parser.add_option('--todos', type='int', default=500,
+                      help="todos in each storage")
+    parser.add_option('--processes', type='int', default=4)
+    options, args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        paths = []
+        for index in range(options.jobs):
+            path = os.path.join(directory, 'karm%d.ics' % index)
+            writeStorage(path, options.todos, seed=index)
+            paths.append(path)
+        elapsed = separate(paths, options.processes)
+        print 'process per job %8.3fs  %6.1f jobs/s' % (
+            elapsed, options.jobs / elapsed)
+        pool, ok = pooled(paths, options.processes)
+        print 'process pool    %8.3fs  %6.1f jobs/s  all ok: %s' % (
+            pool, options.jobs / pool, ok)
+        print 'speedup         %8.1fx' % (elapsed / pool)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Cached basecamp responses with conditional requests
+
+Usage: python benchmarks/bench_cache.py [--lists=N] [--items=N]
+                                        [--latency=MS]
+
+Local HTTP/1.1 server stands in for basecamp, it answers projects.xml
+and todo_lists.xml with ETag and Last-Modified and returns 304 for
+conditional requests when data has not changed. Both endpoints are
+requested the way update command does it: without cache, with empty
+cache, with cache to be revalidated, with fresh cache and after data
+was changed on the server.
+"""
+import os
+import time
+import shutil
+import tempfile
+import threading
+import urllib2
+import BaseHTTPServer
+import SocketServer
+from optparse import OptionParser
+
+from basecamp.karm.cache import ResponseCache
+from basecamp.karm.transport import ConnectionPool, PooledHandler
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+    latency = 0.0
+    documents = {}
+    version = 1
+    statuses = []
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        body = self.documents.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        etag = '"%d"' % Handler.version
+        if self.headers.getheader('if-none-match') == etag:
+            Handler.statuses.append(304)
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        Handler.statuses.append(200)
+        body = body.replace('VERSION', str(Handler.version))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', self.date_time_string(0))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+def documents(lists, items):
+    projects = '<projects>%s</projects>' % ''.join([
+        '<project><id>%d</id><name>Project %d VERSION</name>'
+        '</project>' % (i, i)
+        for i in range(10)])
+    todolists = '<todo-lists>%s</todo-lists>' % ''.join([
+        '<todo-list><id>%d</id><project-id>%d</project-id>'
+        '<name>List %d</name><todo-items>%s</todo-items></todo-list>' % (
+            i, i % 10, i, ''.join([
+                '<todo-item><id>%d</id><content>Item %d</content>'
+                '</todo-item>' % (i * items + j, j) for j in range(items)]))
+        for i in range(lists)])
+    return {'/projects.xml': projects,
+            '/todo_lists.xml': todolists}
+
+PATHS = ('/projects.xml', '/todo_lists.xml')
+
+def update(opener, base):
+    start = time.time()
+    bodies = [opener.open(base + path).read() for path in PATHS]
+    return time.time() - start, bodies
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--lists', type='int', default=50)
+    parser.add_option('--items', type='int', default=100)
+    parser.add_option('--latency', type='float', default=50.0,
+                      help="latency of each request in milliseconds")
+    options, args = parser.parse_args()
+
+    Handler.latency = options.latency / 1000.0
+    Handler.documents = documents(options.lists, options.items)
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    base = 'http://%s:%d' % server.server_address
+    directory = tempfile.mkdtemp()
+    pool = ConnectionPool()
+    try:
+        size = sum(map(len, Handler.documents.values()))
+        print 'data %d bytes' % size
+        signatures = []
+        for name, ttl, change in (('no cache', None, False),
+                                  ('empty cache', 0, False),
+                                  ('revalidated', 0, False),
+                                  ('fresh', 60, False),
+                                  ('changed', 0, True)):
+            if change:
+                Handler.version += 1
+            cache = None
+            if ttl is not None:
+                cache = ResponseCache(os.path.join(directory, 'cache'), ttl)
+            opener = urllib2.build_opener(PooledHandler(pool, cache))
+            Handler.statuses = []
+            elapsed, bodies = update(opener, base)
+            expected = [Handler.documents[path].replace(
+                'VERSION', str(Handler.version)) for path in PATHS]
+            if cache is not None:
+                signatures.append(cache.signature())
+            print '%-12s %8.3fs  statuses %-10s same data: %s' % (
+                name, elapsed, ','.join(map(str, Handler.statuses)) or '-',
+                bodies == expected)
+        print 'unchanged data has the same signature: %s' % (
+            signatures[0] == signatures[1] == signatures[2])
+        print 'changed data has another signature: %s' % (
+            signatures[2] != signatures[3])
+    finally:
+        shutil.rmtree(directory)
+        pool.close()
+        server.shutdown()
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""Merging of basecamp data into storage on update
+
+Usage: python benchmarks/bench_diff.py [--todos=N] [--items=N]
+                                      [--changed=SHARE]
+
+Synthetic storage is loaded and basecamp data is made from it with a
+few todo items renamed, added and with changed time. The data is merged
+with the nested loops update used before (with debug output's index
+lookups) and with diff module, both should give the same storage.
+Then some todo items are moved to other lists, which only diff notices.
+
+Renamed todo items make nested loops quadratic in the size of todo
+list, so diff is faster only on large lists: about 1.6-1.9 times with
+the default 50000 todos and 10000 items per list. With 20000 todos and
+2000 items per list it runs at 0.6-0.7 of the speed of nested loops,
+and it's slower with small lists or few changes as well. What it gains
+there is the changes nested loops don't find, moved and removed tasks.
+"""
+import os
+import time
+import random
+import tempfile
+from optparse import OptionParser
+
+from basecamp.karm import KArm
+from basecamp.karm.todo import Todo
+from basecamp.karm.diff import snapshot, diff, applyChanges
+
+from synthetic import writeStorage
+
+class Record(object):
+
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+def remoteData(karm, changed, rnd):
+    """Return (projects, todolists, hours) made of storage with changed
+    share of todo items renamed, added and with new time
+    """
+    projects = []
+    todolists = []
+    hours = {}
+    uid = 9000000
+    for project in karm.todos.values():
+        projects.append(Record(id=int(project.uid), name=project.summary))
+        for todolist in project.todos.values():
+            items = []
+            for todo in todolist.todos.values():
+                content = todo.summary
+                if rnd.random() < changed:
+                    content += u' (renamed)'
+                items.append(Record(id=int(todo.uid), content=content))
+                minutes = (todo.x_kde_ktimetracker_totaltasktime or 0) - \
+                          (todo.x_kde_ktimetracker_totalsessiontime or 0)
+                if rnd.random() < changed:
+                    minutes += 60
+                hours[todo.uid] = minutes / 60.0
+                if rnd.random() < changed:
+                    uid += 1
+                    items.append(Record(id=uid, content=u'New todo item'))
+                    hours[str(uid)] = 1.0
+            todolists.append(Record(id=int(todolist.uid),
+                                    name=todolist.summary,
+                                    project_id=int(project.uid),
+                                    todo_items=items))
+    return projects, todolists, hours
+
+def nestedMerge(karm, projects, todolists, hours):
+    """Merge the way update did it before diff module
+    """
+    updated = False
+    for project in projects:
+        task = karm.todos.get(str(project.id), None)
+        if task is None:
+            karm.add(Todo(str(project.id), project.name,
+                          x_kde_ktimetracker_bctype='project'))
+            updated = True
+        elif task.summary != project.name:
+            task.summary = project.name
+            updated = True
+    for todolist in todolists:
+        project_id = str(todolist.project_id)
+        task = karm.todos[project_id].todos.get(str(todolist.id), None)
+        if task is None:
+            task = karm.todos[project_id].add(Todo(str(todolist.id),
+                todolist.name, related_to=project_id,
+                x_kde_ktimetracker_bctype='todolist'))
+            updated = True
+        elif task.summary != todolist.name:
+            task.summary = todolist.name
+            updated = True
+        for todo in todolist.todo_items:
+            subtask = task.todos.get(str(todo.id), None)
+            if subtask is None:
+                subtask = task.add(Todo(str(todo.id), todo.content,
+                    related_to=task.uid,
+                    x_kde_ktimetracker_bctype='todoitem'))
+                updated = True
+            elif subtask.summary != todo.content:
+                subtask.summary = todo.content
+                updated = True
+                # position printed in debug mode
+                todolist.todo_items.index(todo)
+            if subtask.x_kde_ktimetracker_totalsessiontime is None:
+                subtask.x_kde_ktimetracker_totalsessiontime = 0
+            if subtask.x_kde_ktimetracker_totaltasktime is None:
+                subtask.x_kde_ktimetracker_totaltasktime = 0
+            session = subtask.x_kde_ktimetracker_totalsessiontime
+            total = subtask.x_kde_ktimetracker_totaltasktime
+            todoHours = hours.get(str(todo.id), 0.0)
+            if int(todoHours * 60.0) != total - session:
+                subtask.x_kde_ktimetracker_totaltasktime = \
+                    session + int(todoHours * 60.0)
+                updated = True
+    return updated
+
+def hashMerge(karm, projects, todolists, hours):
+    return applyChanges(karm, diff(karm, snapshot(projects, todolists),
+                                   hours))
+
+def load(path):
+    karm = KArm()
+    karm.load(path)
+    return karm
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--todos', type='int', default=50000)
+    parser.add_option('--items', type='int', default=10000,
+                      help="todo items in each todo list")
+    parser.add_option('--changed', type='float', default=0.1,
+                      help="share of todo items changed in basecamp")
+    options, args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.ics')
+    os.close(fd)
+    try:
+        writeStorage(path, options.todos, lists=5, items=options.items,
+                     entries=0)
+        remote = remoteData(load(path), options.changed, random.Random(0))
+
+        results = {}
+        for name, merge in (('nested', nestedMerge), ('diff', hashMerge)):
+            karm = load(path)
+            start = time.time()
+            merge(karm, *remote)
+            results[name] = (time.time() - start, str(karm))
+            print '%-7s %8.3fs' % (name, results[name][0])
+        print 'speedup %8.1fx' % (results['nested'][0] / results['diff'][0])
+        print 'same storage: %s' % (results['nested'][1] == results['diff'][1])
+
+        # move every 100th todo item into the next todo list
+        projects, todolists, hours = remote
+        karm = load(path)
+        moving = [[todo for todo in todolist.todo_items[::100]
+                   if karm._index.has_key((u'todoitem', str(todo.id)))]
+                  for todolist in todolists]
+        moved = 0
+        for index in range(len(todolists) - 1):
+            for todo in moving[index]:
+                todolists[index].todo_items.remove(todo)
+                todolists[index + 1].todo_items.append(todo)
+                moved += 1
+        changes = diff(karm, snapshot(projects, todolists), hours)
+        kinds = {}
+        for change in changes:
+            kinds[change.kind] = kinds.get(change.kind, 0) + 1
+        print 'changes: %s' % ', '.join(['%s %d' % item
+                                         for item in sorted(kinds.items())])
+        print 'moved todo items found: %s' % (kinds.get('moved', 0) == moved)
+    finally:
+        os.remove(path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Compare native and vobject KArm.dump paths
+
+Usage: python benchmarks/bench_dump.py [--todos=N] [--storage=PATH]
+
+Each path is measured in a separate process, peak memory is reported
+as growth of resident memory during the dump.
+"""
+import os
+import sys
+import time
+import resource
+import tempfile
+import subprocess
+from optparse import OptionParser
+
+from basecamp.karm import patch
+from basecamp.karm import KArm
+
+from synthetic import writeStorage
+
+def measure(path, native):
+    karm = KArm()
+    karm.load(path)
+    # measure writing of the whole storage, not copying of unchanged one
+    karm._source = None
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    fd, output = tempfile.mkstemp(suffix='.ics')
+    os.close(fd)
+    try:
+        start = time.time()
+        karm.dump(output, native=native)
+        elapsed = time.time() - start
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print '%f %d %d' % (elapsed, peak - before, os.path.getsize(output))
+    finally:
+        os.remove(output)
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--todos', type='int', default=20000)
+    parser.add_option('--storage', default=None,
+                      help="use existing storage instead of synthetic one")
+    parser.add_option('--measure', choices=('native', 'vobject'),
+                      help="internal: measure one path and exit")
+    options, args = parser.parse_args()
+
+    if options.measure:
+        measure(options.storage, options.measure == 'native')
+        return
+
+    path = options.storage
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix='.ics')
+        os.close(fd)
+        writeStorage(path, options.todos)
+    try:
+        results = {}
+        for name in ('vobject', 'native'):
+            output = subprocess.Popen(
+                [sys.executable, __file__, '--measure', name,
+                 '--storage', path],
+                stdout=subprocess.PIPE).communicate()[0]
+            elapsed, growth, size = output.split()
+            elapsed = float(elapsed)
+            results[name] = elapsed
+            print '%-8s %8.3fs %8.2f MB/s  memory growth %8d kB' % (
+                name, elapsed, int(size) / elapsed / 1024 / 1024, int(growth))
+        print 'speedup  %8.1fx' % (results['vobject'] / results['native'])
+    finally:
+        if options.storage is None:
+            os.remove(path)
+
+if __name__ == '__main__':
+    main()
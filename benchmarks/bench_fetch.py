@@ -0,0 +1,91 @@
+"""Concurrent fetching of todo items time as checkout --fetch-time does
+
+Usage: python benchmarks/bench_fetch.py [--items=N] [--latency=MS]
+                                        [--workers=N]
+
+CheckOut.fetchHours fetches time entries of todo items of synthetic
+account with one worker and with N workers, results should be the same
+and in the same order. Requests go through karm's transport to local
+fake basecamp server (see fakeserver module), which answers after the
+given latency. Without basecamp.api installed in-process FakeBasecamp
+(see fakebasecamp module) with the same latency is used instead.
+"""
+import time
+import tempfile
+from optparse import OptionParser
+
+from basecamp.karm import KArm
+from basecamp.karm.command.checkout import CheckOut
+
+from synthetic import writeStorage
+from fakebasecamp import Account, FakeBasecamp
+from fakeserver import serve
+from suite import command, connectTo
+
+def makeAccount(items):
+    """Return account with about the given number of todo items
+    """
+    f = tempfile.NamedTemporaryFile(suffix='.ics')
+    # synthetic storage has about two todo items per ten todos
+    writeStorage(f.name, items * 5)
+    karm = KArm()
+    karm.load(f.name)
+    f.close()
+    return Account.fromStorage(karm)
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--items', type='int', default=200)
+    parser.add_option('--latency', type='float', default=50.0,
+                      help="latency of each request in milliseconds")
+    parser.add_option('--workers', type='int', default=8)
+    options, args = parser.parse_args()
+
+    account = makeAccount(options.items)
+    todo_ids = [todo.id for todolist in account.todolists
+                for todo in todolist.todo_items][:options.items]
+    latency = options.latency / 1000.0
+    server = None
+    try:
+        import basecamp.api
+    except ImportError:
+        print 'basecamp.api is not installed, in-process client is used'
+        connectTo(FakeBasecamp(account, latency))
+    else:
+        server = serve(account, latency=latency)
+
+    checkout = command(CheckOut, None)
+    checkout.pool_size = options.workers
+    if server is not None:
+        checkout.url = server.url()
+    results = {}
+    try:
+        for workers in (1, options.workers):
+            checkout.workers = workers
+            start = time.time()
+            hours = checkout.fetchHours(todo_ids)
+            elapsed = time.time() - start
+            results[workers] = (elapsed, hours)
+            print '%3d workers %8.3fs  %8.1f requests/s' % (
+                workers, elapsed, len(todo_ids) / elapsed)
+    finally:
+        if server is not None:
+            from basecamp.karm.transport import getPool
+            getPool().close()
+            server.shutdown()
+            server.server_close()
+    print 'speedup     %8.1fx' % (results[1][0] /
+                                  results[options.workers][0])
+    print 'same results: %s' % (results[1][1] == results[options.workers][1])
+
+    # failure of any request fails the whole fetch
+    connectTo(FakeBasecamp(account, 0.001, failures=0.05))
+    try:
+        checkout.fetchHours(todo_ids)
+    except IOError, e:
+        print 'failure propagated: %s' % e
+    else:
+        print 'failure was not propagated'
+
+if __name__ == '__main__':
+    main()
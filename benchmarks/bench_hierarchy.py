@@ -0,0 +1,87 @@
+"""Scaling of KArm hierarchy construction
+
+Usage: python benchmarks/bench_hierarchy.py [--todos=N]
+
+Builds the tree of N todos in wide (one project with all the todos as
+it's children) and deep (chain of N nested todos) shapes, plus a shape
+with orphans and cycles. Time per todo should stay the same for N/10
+and N todos.
+"""
+import gc
+import time
+from optparse import OptionParser
+
+from basecamp.karm import KArm
+from basecamp.karm.todo import Todo
+
+def wide(size):
+    todos = [Todo('0', 'project')]
+    for uid in xrange(1, size):
+        todos.append(Todo(str(uid), 'todo', related_to='0'))
+    return todos
+
+def deep(size):
+    todos = [Todo('0', 'project')]
+    for uid in xrange(1, size):
+        todos.append(Todo(str(uid), 'todo', related_to=str(uid - 1)))
+    # children before parents is the worst case for the builder
+    todos.reverse()
+    return todos
+
+def broken(size):
+    """A quarter of todos are orphans, another quarter are cycles
+    of 10 todos
+    """
+    todos = wide(size / 2)
+    for uid in xrange(size / 2, size * 3 / 4):
+        todos.append(Todo(str(uid), 'orphan', related_to='missing'))
+    for uid in xrange(size * 3 / 4, size, 10):
+        for i in range(10):
+            parent = uid + (i + 1) % 10
+            todos.append(Todo(str(uid + i), 'cycle', related_to=str(parent)))
+    return todos
+
+def count(container):
+    total = 0
+    stack = [container]
+    while stack:
+        container = stack.pop()
+        total += len(container.todos)
+        stack.extend(container.todos.values())
+    return total
+
+def build(todos):
+    karm = KArm()
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.time()
+        karm._todos2Tasks(todos)
+        return karm, time.time() - start
+    finally:
+        gc.enable()
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--todos', type='int', default=100000)
+    options, args = parser.parse_args()
+    size = options.todos
+
+    for shape in (wide, deep, broken):
+        small, smallTime = build(shape(size / 10))
+        karm, elapsed = build(shape(size))
+        attached = count(karm)
+        skipped = len(karm.orphans) + sum([len(c) for c in karm.cycles])
+        print '%-7s %7d todos %7.3fs (%.2f us/todo, %.2f us/todo for %d), ' \
+              '%d attached, %d orphans, %d cycles' % (
+            shape.__name__, size, elapsed, elapsed * 1e6 / size,
+            smallTime * 1e6 / (size / 10), size / 10,
+            attached, len(karm.orphans), len(karm.cycles))
+        if shape is not broken:
+            assert attached == size
+        else:
+            assert len(karm.orphans) == size / 4
+            assert len(karm.cycles) == (size - size * 3 / 4) / 10
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Compare lazy and eager KArm.load by time to the first query
+
+Usage: python benchmarks/bench_lazy.py [--todos=N] [--storage=PATH]
+
+Query is what checkin with filters does: load the storage, find one
+todo and read it's summary. Each mode is measured in a separate process
+so that peak memory usage of one doesn't affect another.
+"""
+import os
+import sys
+import time
+import random
+import resource
+import tempfile
+import subprocess
+from optparse import OptionParser
+
+from basecamp.karm import KArm
+
+from synthetic import writeStorage
+
+def measure(path, lazy):
+    start = time.time()
+    karm = KArm()
+    karm.load(path, lazy=lazy)
+    loaded = time.time() - start
+    bctype, uid = random.Random(0).choice(karm._index.keys())
+    karm.find(uid, bctype).summary
+    elapsed = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print '%f %f %d' % (loaded, elapsed, peak)
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--todos', type='int', default=20000)
+    parser.add_option('--storage', default=None,
+                      help="use existing storage instead of synthetic one")
+    parser.add_option('--measure', choices=('lazy', 'eager'),
+                      help="internal: measure one mode and exit")
+    options, args = parser.parse_args()
+
+    if options.measure:
+        measure(options.storage, options.measure == 'lazy')
+        return
+
+    path = options.storage
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix='.ics')
+        os.close(fd)
+        writeStorage(path, options.todos)
+    try:
+        print 'Storage: %s (%d bytes)' % (path, os.path.getsize(path))
+        results = {}
+        for name in ('eager', 'lazy'):
+            output = subprocess.Popen(
+                [sys.executable, __file__, '--measure', name,
+                 '--storage', path],
+                stdout=subprocess.PIPE).communicate()[0]
+            loaded, elapsed, peak = output.split()
+            results[name] = float(elapsed)
+            print '%-6s load %8.3fs  first query %8.3fs  peak RSS %8d kB' % (
+                name, float(loaded), float(elapsed), int(peak))
+        print 'speedup  %8.1fx' % (results['eager'] / results['lazy'])
+    finally:
+        if options.storage is None:
+            os.remove(path)
+
+if __name__ == '__main__':
+    main()
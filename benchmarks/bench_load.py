@@ -0,0 +1,65 @@
+"""Compare native and vobject KArm.load paths
+
+Usage: python benchmarks/bench_load.py [--todos=N] [--storage=PATH]
+
+Each path is loaded in a separate process so that peak memory usage
+of one doesn't affect another.
+"""
+import os
+import sys
+import time
+import resource
+import tempfile
+import subprocess
+from optparse import OptionParser
+
+from basecamp.karm import patch
+from basecamp.karm import KArm
+
+from synthetic import writeStorage
+
+def measure(path, native):
+    start = time.time()
+    karm = KArm()
+    karm.load(path, native=native)
+    elapsed = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print '%f %d' % (elapsed, peak)
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--todos', type='int', default=20000)
+    parser.add_option('--storage', default=None,
+                      help="use existing storage instead of synthetic one")
+    parser.add_option('--measure', choices=('native', 'vobject'),
+                      help="internal: measure one path and exit")
+    options, args = parser.parse_args()
+
+    if options.measure:
+        measure(options.storage, options.measure == 'native')
+        return
+
+    path = options.storage
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix='.ics')
+        os.close(fd)
+        writeStorage(path, options.todos)
+    try:
+        print 'Storage: %s (%d bytes)' % (path, os.path.getsize(path))
+        results = {}
+        for name in ('vobject', 'native'):
+            output = subprocess.Popen(
+                [sys.executable, __file__, '--measure', name,
+                 '--storage', path],
+                stdout=subprocess.PIPE).communicate()[0]
+            elapsed, peak = output.split()
+            results[name] = float(elapsed)
+            print '%-8s %8.3fs  peak RSS %8d kB' % (name, float(elapsed),
+                                                    int(peak))
+        print 'speedup  %8.1fx' % (results['vobject'] / results['native'])
+    finally:
+        if options.storage is None:
+            os.remove(path)
+
+if __name__ == '__main__':
+    main()
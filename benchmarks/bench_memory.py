@@ -0,0 +1,137 @@
+"""Memory footprint of loaded todos
+
+Usage: python benchmarks/bench_memory.py [--todos=N]
+
+Builds hierarchy of N todos (1M by default) shaped like a KTimeTracker
+storage after karm checkout, with attribute values like the ones storage
+reader creates. Todo is compared with PlainTodo, todo with instance
+dictionary and own children mapping, the way todos used to be stored.
+Each of them is measured in a separate process.
+"""
+import os
+import sys
+import time
+import datetime
+import resource
+import subprocess
+from optparse import OptionParser
+
+from vobject.icalendar import utc
+
+from basecamp.karm.todo import Todo
+
+class PlainTodo(object):
+    """Todo with instance dictionary, every attribute has it's own value
+    """
+
+    def __init__(self, uid, summary, dtstamp=None, created=None,
+                 last_modified=None, related_to=None, completed=None,
+                 percent_complete=None, x_kde_ktimetracker_totalsessiontime=None,
+                 x_kde_ktimetracker_totaltasktime=None, x_kde_ktimetracker_bctype=None):
+        self.dirty = {}
+        self.uid = uid
+        self.summary = summary
+        self.dtstamp = dtstamp
+        self.created = created
+        self.last_modified = last_modified
+        self.related_to = related_to
+        self.completed = completed
+        self.percent_complete = percent_complete
+        self.x_kde_ktimetracker_totalsessiontime = x_kde_ktimetracker_totalsessiontime
+        self.x_kde_ktimetracker_totaltasktime = x_kde_ktimetracker_totaltasktime
+        self.x_kde_ktimetracker_bctype = x_kde_ktimetracker_bctype
+        self.todos = {}
+        self._parent = None
+        self._index = None
+        self._span = None
+        self._digest = None
+
+    def add(self, todo):
+        self.todos[todo.uid] = todo
+        todo._parent = self
+
+    def _clean(self):
+        self.dirty.clear()
+
+def stamp(seconds):
+    return datetime.datetime(2009, 1, 1, tzinfo=utc) + \
+        datetime.timedelta(seconds=seconds)
+
+def create(factory, uid, parent, bctype):
+    # build values the way reader does: fresh object for each of them
+    number = int(uid)
+    todo = factory(uid, u'todo %s' % uid, dtstamp=stamp(number),
+                   created=stamp(number), last_modified=stamp(number),
+                   related_to=parent is not None and parent.uid or None,
+                   x_kde_ktimetracker_totalsessiontime=number % 60,
+                   x_kde_ktimetracker_totaltasktime=number % 600,
+                   x_kde_ktimetracker_bctype=bctype and
+                       u''.join([c for c in bctype]) or None)
+    # todos read from the storage are not changed
+    todo._clean()
+    if parent is not None:
+        parent.add(todo)
+    return todo
+
+def build(factory, size, lists=10, items=20, entries=2):
+    """Create size todos, return list of the root ones
+    """
+    roots = []
+    count = 0
+    while count < size:
+        project = create(factory, unicode(count), None, 'project')
+        roots.append(project)
+        count += 1
+        for i in range(lists):
+            todolist = create(factory, unicode(count), project, 'todolist')
+            count += 1
+            for j in range(items):
+                item = create(factory, unicode(count), todolist, 'todoitem')
+                count += 1
+                for k in range(entries):
+                    create(factory, unicode(count), item, None)
+                    count += 1
+    return roots
+
+def rss():
+    # current resident set size in kB
+    for line in open('/proc/self/status'):
+        if line.startswith('VmRSS:'):
+            return int(line.split()[1])
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def measure(factory, size):
+    before = rss()
+    start = time.time()
+    roots = build(factory, size)
+    elapsed = time.time() - start
+    print '%f %d' % (elapsed, rss() - before)
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--todos', type='int', default=1000000)
+    parser.add_option('--measure', choices=('Todo', 'PlainTodo'),
+                      help="internal: measure one class and exit")
+    options, args = parser.parse_args()
+
+    if options.measure:
+        measure(globals()[options.measure], options.todos)
+        return
+
+    print 'Todos: %d' % options.todos
+    results = {}
+    for name in ('PlainTodo', 'Todo'):
+        output = subprocess.Popen(
+            [sys.executable, __file__, '--measure', name,
+             '--todos', str(options.todos)],
+            stdout=subprocess.PIPE).communicate()[0]
+        elapsed, used = output.split()
+        results[name] = int(used)
+        print '%-9s %8.3fs  %8d kB  %6d bytes per todo' % (
+            name, float(elapsed), int(used),
+            int(used) * 1024 / options.todos)
+    print 'saved    %8.1f%%' % (
+        100.0 * (results['PlainTodo'] - results['Todo']) / results['PlainTodo'])
+
+if __name__ == '__main__':
+    main()
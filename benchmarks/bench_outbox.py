@@ -0,0 +1,131 @@
+"""Submission of checkin operations through outbox journal
+
+Usage: python benchmarks/bench_outbox.py [--items=N] [--latency=MS]
+                                         [--workers=N] [--failures=RATE]
+
+Every todo item gets created and gets two time entries logged, like
+checkin does for new todos. FakeBasecamp answers after the given
+latency and refuses the given share of calls, so that they don't reach
+the server and are sent again. Operations are submitted
+with one worker and with N workers, and then submitted again after
+failures, until all of them are done. Each operation should reach the
+server exactly once.
+"""
+import os
+import time
+import errno
+import socket
+import random
+import shutil
+import tempfile
+import threading
+from optparse import OptionParser
+
+from basecamp.karm.outbox import Outbox, Operation, Reference, execute
+
+class Item(object):
+
+    def __init__(self, id):
+        self.id = id
+
+class FakeBasecamp(object):
+    """Stand-in for basecamp.api.Basecamp with injected latency and
+    failures, it counts the calls which succeeded
+    """
+
+    def __init__(self, latency, failures=0.0, seed=0):
+        self.latency = latency
+        self.failures = failures
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.ids = 1000
+
+    def _call(self, *key):
+        time.sleep(self.latency)
+        self.lock.acquire()
+        try:
+            if self.random.random() < self.failures:
+                raise socket.error(errno.ECONNREFUSED,
+                                   'Injected refused connection')
+            self.calls[key] = self.calls.get(key, 0) + 1
+        finally:
+            self.lock.release()
+
+    def createTodoItem(self, list_id, content, notify=True):
+        self._call('createTodoItem', content)
+        self.lock.acquire()
+        try:
+            self.ids += 1
+            return Item(self.ids)
+        finally:
+            self.lock.release()
+
+    def createTimeEntryForTodoItem(self, todo_id, hours, description=''):
+        self._call('createTimeEntryForTodoItem', description)
+
+def plan(items):
+    operations = []
+    for i in range(items):
+        create = Operation(len(operations), 'createTodoItem', u'todo%d' % i,
+                           (1,), {'content': u'Todo %d' % i})
+        operations.append(create)
+        for j in range(2):
+            operations.append(Operation(len(operations),
+                'createTimeEntryForTodoItem', u'todo%d' % i,
+                (Reference(create.id), '0.25'),
+                {'description': u'Entry %d.%d' % (i, j)}))
+    return operations
+
+def result(op, value):
+    if op.method == 'createTodoItem':
+        return value.id
+    return None
+
+def submit(path, bc, items, workers):
+    """Submit all operations, resuming from the journal after failures,
+    return (seconds, rounds)
+    """
+    outbox = Outbox(path)
+    outbox.create(plan(items))
+    start = time.time()
+    rounds = 0
+    while True:
+        rounds += 1
+        operations = outbox.load()
+        failed = execute(operations, lambda: bc, outbox, workers, retries=0,
+                         result=result)
+        outbox.close()
+        if not failed:
+            break
+    outbox.remove()
+    return time.time() - start, rounds
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--items', type='int', default=50)
+    parser.add_option('--latency', type='float', default=20.0,
+                      help="latency of each request in milliseconds")
+    parser.add_option('--workers', type='int', default=8)
+    parser.add_option('--failures', type='float', default=0.1,
+                      help="share of calls which fail")
+    options, args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'karm.ics.outbox')
+        results = {}
+        for workers in (1, options.workers):
+            bc = FakeBasecamp(options.latency / 1000.0, options.failures)
+            elapsed, rounds = submit(path, bc, options.items, workers)
+            results[workers] = elapsed
+            once = bc.calls.values() == [1] * (options.items * 3)
+            print '%3d workers %8.3fs  %8.1f operations/s  %d rounds  ' \
+                  'exactly once: %s' % (
+                workers, elapsed, options.items * 3 / elapsed, rounds, once)
+        print 'speedup     %8.1fx' % (results[1] / results[options.workers])
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Micro-benchmark of vobject serializer patched by patch module
+
+Usage: python benchmarks/bench_serialize.py [--todos=N] [--repeat=N]
+
+Serializes the same vobject calendar with referenceSerialize, the
+serializer patch module used to install, and with the current one,
+and reports content lines written per second.
+"""
+import os
+import time
+import tempfile
+import cStringIO
+import codecs
+from optparse import OptionParser
+
+import vobject.base
+from vobject.base import ContentLine, Component, foldOneLine, dquoteEscape
+
+from basecamp.karm import patch
+from basecamp.karm import KArm
+
+from synthetic import writeStorage
+
+def referenceSerialize(obj, buf, lineLength):
+    """Previous patch.karm_defaultSerialize, kept for comparison
+    """
+    outbuf = buf or cStringIO.StringIO()
+
+    if isinstance(obj, Component):
+        if obj.group is None:
+            groupString = ''
+        else:
+            groupString = obj.group + '.'
+        if obj.useBegin:
+            foldOneLine(outbuf, str(groupString + u"BEGIN:" + obj.name), lineLength)
+        for child in obj.getSortedChildren():
+            child.serialize(outbuf, lineLength, validate=False)
+        if obj.useBegin:
+            foldOneLine(outbuf, str(groupString + u"END:" + obj.name), lineLength)
+    elif isinstance(obj, ContentLine):
+        startedEncoded = obj.encoded
+        if obj.behavior and not startedEncoded: obj.behavior.encode(obj)
+        s=codecs.getwriter('utf-8')(cStringIO.StringIO())
+        if obj.group is not None:
+            s.write(obj.group + '.')
+        s.write(obj.name)
+        for key, paramvals in obj.params.iteritems():
+            s.write(';' + key + '=' + ','.join(dquoteEscape(p) for p in paramvals))
+        s.write(':' + obj.value)
+        if obj.behavior and not startedEncoded: obj.behavior.decode(obj)
+        foldOneLine(outbuf, s.getvalue(), lineLength)
+
+    return buf or outbuf.getvalue()
+
+def measure(calendar, serializer, repeat):
+    vobject.base.defaultSerialize = serializer
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        data = calendar.serialize()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, data
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--todos', type='int', default=5000)
+    parser.add_option('--repeat', type='int', default=3)
+    options, args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.ics')
+    os.close(fd)
+    try:
+        writeStorage(path, options.todos)
+        karm = KArm()
+        karm.load(path, native=False)
+    finally:
+        os.remove(path)
+    karm._tasks2Calendar()
+
+    current = vobject.base.defaultSerialize
+    results = {}
+    for name, serializer in (('reference', referenceSerialize),
+                             ('patch', current)):
+        elapsed, data = measure(karm._calendar, serializer, options.repeat)
+        lines = data.count('\r\n')
+        results[name] = (lines / elapsed, data)
+        print '%-9s %8.3fs  %10.0f lines/s' % (name, elapsed,
+                                               lines / elapsed)
+    vobject.base.defaultSerialize = current
+    print 'speedup   %8.1fx' % (results['patch'][0] / results['reference'][0])
+    print 'same output: %s' % (results['patch'][1] == results['reference'][1])
+
+if __name__ == '__main__':
+    main()
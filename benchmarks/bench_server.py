@@ -0,0 +1,124 @@
+"""Request patterns of karm commands against local fake basecamp
+
+Usage: python benchmarks/bench_server.py [--todos=N] [--latency=MS]
+                                         [--workers=N] [--errors=SHARE]
+
+Fake basecamp server (see fakeserver module) serves the account made of
+synthetic storage with the given latency and share of failed requests.
+Requests are made through karm's pooled transport the way commands make
+them:
+
+    update -t     time entries of every todo item one by one
+    update -t -b  time entries of every project page by page
+    checkin       time entry posted for every todo item with session
+                  time, with one and with N concurrent workers
+
+Failed requests are retried, the number of retries is reported.
+"""
+import time
+import urllib2
+import tempfile
+from optparse import OptionParser
+
+from basecamp.karm import KArm
+from basecamp.karm.transport import ConnectionPool, PooledHandler
+from basecamp.karm.workers import concurrentMap
+
+from synthetic import writeStorage
+from fakebasecamp import Account, ENTRIES_PAGE
+from fakeserver import serve
+
+class Client(object):
+    """Requests to fake basecamp, failed ones are retried
+    """
+
+    def __init__(self, url, pool):
+        self.url = url
+        self.opener = urllib2.build_opener(PooledHandler(pool))
+        self.retries = 0
+
+    def request(self, path, body=None):
+        request = urllib2.Request(self.url + path, body)
+        if body is not None:
+            request.add_header('Content-Type', 'application/xml')
+        while True:
+            try:
+                return self.opener.open(request).read()
+            except urllib2.HTTPError, e:
+                e.read()
+                if e.code not in (500, 503):
+                    raise
+                self.retries += 1
+
+    def pages(self, path):
+        """Request all pages of time entries, the way update does
+        """
+        page = 1
+        while True:
+            data = self.request('%s?page=%d' % (path, page))
+            if data.count('<time-entry>') < ENTRIES_PAGE:
+                return
+            page += 1
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--todos', type='int', default=2000)
+    parser.add_option('--latency', type='float', default=20.0,
+                      help="latency of each request in milliseconds")
+    parser.add_option('--workers', type='int', default=8)
+    parser.add_option('--errors', type='float', default=0.02,
+                      help="share of requests failed with 500")
+    options, args = parser.parse_args()
+
+    f = tempfile.NamedTemporaryFile(suffix='.ics')
+    writeStorage(f.name, options.todos)
+    karm = KArm()
+    karm.load(f.name)
+    f.close()
+    account = Account.fromStorage(karm)
+    server = serve(account, latency=options.latency / 1000.0,
+                   errors=options.errors)
+    pool = ConnectionPool(options.workers)
+    items = [todo.id for todolist in account.todolists
+             for todo in todolist.todo_items]
+    sessions = [todo for todo in karm._index.values()
+                if todo.x_kde_ktimetracker_bctype == 'todoitem' and
+                   todo.x_kde_ktimetracker_totalsessiontime]
+    print 'projects %d, todo items %d, with session time %d' % (
+        len(account.projects), len(items), len(sessions))
+    try:
+        patterns = [
+            ('update -t', 1, ['/todo_items/%d/time_entries.xml' % id
+                              for id in items]),
+            ('update -t -b', 1, [('pages', '/projects/%d/time_entries.xml'
+                                  % p.id) for p in account.projects]),
+        ]
+        for workers in (1, options.workers):
+            patterns.append(('checkin %d' % workers, workers, [
+                ('/todo_items/%s/time_entries.xml' % todo.uid,
+                 '<time-entry><hours>%.2f</hours></time-entry>' % (
+                     todo.x_kde_ktimetracker_totalsessiontime / 60.0))
+                for todo in sessions]))
+        for name, workers, requests in patterns:
+            client = Client(server.url(), pool)
+            def request(args):
+                if not isinstance(args, tuple):
+                    return client.request(args)
+                if args[0] == 'pages':
+                    return client.pages(args[1])
+                return client.request(*args)
+            made = len(pool.timings)
+            start = time.time()
+            concurrentMap(request, requests, workers)
+            elapsed = time.time() - start
+            print '%-14s %8.3fs  %5d requests  %5d retries' % (
+                name, elapsed, len(pool.timings) - made - client.retries,
+                client.retries)
+    finally:
+        # handlers of kept alive connections finish once they are closed
+        pool.close()
+        server.shutdown()
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
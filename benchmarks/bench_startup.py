@@ -0,0 +1,83 @@
+"""Import time of karm command line utility
+
+Usage: python benchmarks/bench_startup.py [--repeat=N] [--budget=MS]
+
+Imports karm utility and all it's commands in a fresh interpreter the
+way karmcmd does before running any command, and reports the best time
+of N runs minus the time of an empty interpreter run. Exits with status 1
+if it takes longer than the budget, or if any of the modules which should
+be imported only when command runs (vobject, basecamp.api, patch,
+urllib2) were imported.
+"""
+import sys
+import time
+import subprocess
+from optparse import OptionParser
+
+MODULES = (
+    'basecamp.karm.bin.karm',
+    'basecamp.karm.command.checkout',
+    'basecamp.karm.command.update',
+    'basecamp.karm.command.checkin',
+)
+
+# imported only when command is actually run, for packages it's enough
+# to check the top level one
+HEAVY = ('vobject', 'dateutil', 'basecamp.api', 'basecamp.karm.patch',
+         'urllib2')
+
+CHILD = '''
+import sys
+skipped = []
+for name in %r:
+    try:
+        __import__(name)
+    except ImportError, e:
+        skipped.append(name)
+heavy = %r
+print ' '.join([name for name in heavy if sys.modules.get(name) is not None])
+print ' '.join(skipped)
+'''
+
+def run(code):
+    start = time.time()
+    process = subprocess.Popen([sys.executable, '-c', code],
+                               stdout=subprocess.PIPE)
+    output = process.communicate()[0]
+    return time.time() - start, output
+
+def best(code, repeat):
+    results = [run(code) for i in range(repeat)]
+    results.sort()
+    return results[0]
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--repeat', type='int', default=10)
+    parser.add_option('--budget', type='float', default=150.0,
+                      help="import time budget in milliseconds")
+    options, args = parser.parse_args()
+
+    empty, output = best('pass', options.repeat)
+    elapsed, output = best(CHILD % (MODULES, HEAVY), options.repeat)
+    imported, skipped = output.split('\n')[:2]
+    imported = imported.split()
+    spent = (elapsed - empty) * 1000
+    print 'interpreter  %8.1f ms' % (empty * 1000)
+    print 'imports      %8.1f ms (budget %.1f ms)' % (spent,
+                                                       options.budget)
+    if skipped:
+        # e.g. cmdhelper or basecamp.api are not installed
+        print 'not importable: %s' % ', '.join(skipped.split())
+    failed = False
+    if imported:
+        print 'imported too early: %s' % ', '.join(imported)
+        failed = True
+    if spent > options.budget:
+        print 'over budget'
+        failed = True
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
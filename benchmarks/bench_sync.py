@@ -0,0 +1,119 @@
+"""Full and delta sync of basecamp data into lazily loaded storage
+
+Usage: python benchmarks/bench_sync.py [--todos=N] [--changed=N]
+                                      [--latency=MS]
+
+Synthetic storage is loaded lazily and basecamp data is made from it
+with a few projects changed. Full sync requests todo lists of all
+projects and compares the whole storage, delta sync (the way update
+does it with sync cursor) requests todo lists only of changed projects
+and compares only their subtrees. Each request waits for the given
+latency, transferred data is not accounted. Both should give the same
+storage.
+"""
+import os
+import time
+import tempfile
+from optparse import OptionParser
+
+from basecamp.karm import KArm
+from basecamp.karm.diff import snapshot, diff, applyChanges
+
+from synthetic import writeStorage
+
+class Record(object):
+
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+def remoteData(karm, changed):
+    """Return (projects, project id -> todo lists) of storage with the
+    first todo item of changed projects renamed
+    """
+    projects = []
+    todolists = {}
+    for project in karm.todos.values():
+        id = int(project.uid)
+        projects.append(Record(id=id, name=project.summary))
+        todolists[id] = []
+        for todolist in project.todos.values():
+            items = [Record(id=int(todo.uid), content=todo.summary)
+                     for todo in todolist.todos.values()]
+            todolists[id].append(Record(id=int(todolist.uid),
+                                        name=todolist.summary,
+                                        project_id=id, todo_items=items))
+    projects.sort(key=lambda project: project.id)
+    for project in projects[:changed]:
+        for todolist in todolists[project.id][:1]:
+            for todo in todolist.todo_items[:1]:
+                todo.content += u' (renamed)'
+    return projects, todolists
+
+def parsed(karm):
+    """Return number of todos parsed from the mapped storage
+    """
+    return len([todo for todo in karm._index.values()
+                if getattr(todo, '_storage', None) is None])
+
+def sync(path, projects, todolists, latency, changed=None):
+    """Merge basecamp data into storage, return (seconds, requests,
+    parsed todos, storage)
+    """
+    start = time.time()
+    karm = KArm()
+    karm.load(path, lazy=True)
+    requests = 1
+    time.sleep(latency)
+    if changed is None:
+        lists = []
+        for project in projects:
+            lists.extend(todolists[project.id])
+        requests += 1
+        time.sleep(latency)
+        scope = None
+    else:
+        projects = projects[:changed]
+        lists = []
+        for project in projects:
+            lists.extend(todolists[project.id])
+            requests += 1
+            time.sleep(latency)
+        scope = [str(project.id) for project in projects]
+    if applyChanges(karm, diff(karm, snapshot(projects, lists),
+                               scope=scope)):
+        karm.dump()
+    elapsed = time.time() - start
+    return elapsed, requests, parsed(karm), str(karm)
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--todos', type='int', default=50000)
+    parser.add_option('--changed', type='int', default=2,
+                      help="projects changed since the last sync")
+    parser.add_option('--latency', type='float', default=50.0,
+                      help="latency of each request in milliseconds")
+    options, args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.ics')
+    os.close(fd)
+    try:
+        writeStorage(path, options.todos, lists=5, items=40, entries=0)
+        karm = KArm()
+        karm.load(path)
+        projects, todolists = remoteData(karm, options.changed)
+        print 'projects %d, changed %d' % (len(projects), options.changed)
+
+        results = {}
+        for name, changed in (('full', None), ('delta', options.changed)):
+            writeStorage(path, options.todos, lists=5, items=40, entries=0)
+            results[name] = sync(path, projects, todolists,
+                                 options.latency / 1000.0, changed)
+            print '%-6s %8.3fs  %4d requests  %6d todos parsed' % (
+                (name,) + results[name][:3])
+        print 'speedup %7.1fx' % (results['full'][0] / results['delta'][0])
+        print 'same storage: %s' % (results['full'][3] == results['delta'][3])
+    finally:
+        os.remove(path)
+
+if __name__ == '__main__':
+    main()
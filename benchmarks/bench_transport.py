@@ -0,0 +1,102 @@
+"""Pooled keep-alive transport against new connection for every request
+
+Usage: python benchmarks/bench_transport.py [--requests=N] [--setup=MS]
+                                            [--workers=N] [--pool-size=N]
+
+Local HTTP/1.1 server stands in for basecamp, each new connection to it
+is delayed by --setup milliseconds to mimic TCP and TLS handshakes with
+the remote server. The same requests are made with plain urllib2 opener
+and with opener which goes through ConnectionPool.
+"""
+import time
+import threading
+import urllib2
+import BaseHTTPServer
+import SocketServer
+from optparse import OptionParser
+
+from basecamp.karm.transport import ConnectionPool, PooledHandler, \
+    timingReport
+from basecamp.karm.workers import concurrentMap
+
+BODY = '<?xml version="1.0" encoding="UTF-8"?>\n<time-entries>' + \
+       '<time-entry><hours>1.5</hours></time-entry>' * 10 + \
+       '</time-entries>\n'
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # response is written at once, not in small delayed segments
+    wbufsize = -1
+    setup_delay = 0.0
+    connections = 0
+
+    def setup(self):
+        Handler.connections += 1
+        time.sleep(self.setup_delay)
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+def startServer(delay):
+    Handler.setup_delay = delay
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    return server
+
+def run(opener, urls, workers):
+    def fetch(url):
+        response = opener.open(url)
+        try:
+            return response.read()
+        finally:
+            response.close()
+    start = time.time()
+    bodies = concurrentMap(fetch, urls, workers)
+    return time.time() - start, bodies
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--requests', type='int', default=200)
+    parser.add_option('--setup', type='float', default=20.0,
+                      help="delay of each new connection in milliseconds")
+    parser.add_option('--workers', type='int', default=4)
+    parser.add_option('--pool-size', type='int', default=4)
+    options, args = parser.parse_args()
+
+    server = startServer(options.setup / 1000.0)
+    host, port = server.server_address
+    urls = ['http://%s:%d/todo_items/%d/time_entries.xml' % (host, port, i)
+            for i in range(options.requests)]
+
+    results = {}
+    pool = ConnectionPool(options.pool_size)
+    for name, opener in (
+            ('plain', urllib2.build_opener()),
+            ('pooled', urllib2.build_opener(PooledHandler(pool)))):
+        Handler.connections = 0
+        elapsed, bodies = run(opener, urls, options.workers)
+        results[name] = elapsed
+        print '%-7s %8.3fs  %8.1f requests/s  %4d connections' % (
+            name, elapsed, options.requests / elapsed, Handler.connections)
+        assert bodies == [BODY] * options.requests
+    print 'speedup %8.1fx' % (results['plain'] / results['pooled'])
+    print timingReport(pool)
+    pool.close()
+    server.shutdown()
+    server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""Synthetic basecamp account and in-process client for benchmarks
+
+Account is made of a storage, so that update and checkin find their
+tasks there: projects, todo lists and todo items of the storage with a
+share of them changed (renamed, added, with time logged). FakeBasecamp
+answers the methods of basecamp.api.Basecamp karm commands use from
+the account, with optional latency and failures of each call.
+"""
+import time
+import random
+import threading
+
+# time entries of project basecamp returns at once
+ENTRIES_PAGE = 50
+
+class Record(object):
+    """Object returned by basecamp client
+    """
+
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+class Account(object):
+    """Projects, todo lists with their todo items and time entries
+    """
+
+    def __init__(self, person_id=1):
+        self.person_id = person_id
+        self.projects = []
+        self.todolists = []
+        self.entries = []
+        self.byTodo = {}
+        self.byId = {}
+        self.lock = threading.Lock()
+        self.ids = 90000000
+
+    def newId(self):
+        self.lock.acquire()
+        try:
+            self.ids += 1
+            return self.ids
+        finally:
+            self.lock.release()
+
+    def addEntry(self, project_id, todo_id, hours, description=u''):
+        entry = Record(id=self.newId(), project_id=project_id,
+                       todo_item_id=todo_id, hours=float(hours),
+                       description=description)
+        self.lock.acquire()
+        try:
+            self.entries.append(entry)
+            if todo_id is not None:
+                self.byTodo.setdefault(todo_id, []).append(entry)
+        finally:
+            self.lock.release()
+        return entry
+
+    def register(self, kind, record):
+        """Make project, todo list or todo item record found by it's id
+        """
+        self.byId[kind, record.id] = record
+        return record
+
+    def project(self, id):
+        return self.byId['project', id]
+
+    def todolist(self, id):
+        return self.byId['todolist', id]
+
+    def todoItem(self, id):
+        return self.byId['todoitem', id]
+
+    def fromStorage(cls, karm, changed=0.0, seed=0):
+        """Return account with basecamp tasks of the storage, changed
+        share of todo items is renamed, added and has time logged
+        """
+        rnd = random.Random(seed)
+        account = cls()
+        for project in karm.todos.values():
+            if project.x_kde_ktimetracker_bctype != 'project':
+                continue
+            id = int(project.uid)
+            account.projects.append(account.register('project', Record(
+                id=id, name=project.summary, last_changed_on=u'2009-02-14')))
+            for todolist in project.todos.values():
+                if todolist.x_kde_ktimetracker_bctype != 'todolist':
+                    continue
+                items = []
+                for todo in todolist.todos.values():
+                    if todo.x_kde_ktimetracker_bctype != 'todoitem':
+                        continue
+                    content = todo.summary
+                    if rnd.random() < changed:
+                        content += u' (renamed)'
+                    items.append(account.register('todoitem', Record(
+                        id=int(todo.uid), content=content, completed=False)))
+                    minutes = (todo.x_kde_ktimetracker_totaltasktime or 0) - \
+                        (todo.x_kde_ktimetracker_totalsessiontime or 0)
+                    if rnd.random() < changed:
+                        minutes += 60
+                    if minutes:
+                        account.addEntry(id, int(todo.uid), minutes / 60.0)
+                    if rnd.random() < changed:
+                        items.append(account.register('todoitem', Record(
+                            id=account.newId(), content=u'New todo item',
+                            completed=False)))
+                account.todolists.append(account.register('todolist', Record(
+                    id=int(todolist.uid), name=todolist.summary,
+                    project_id=id, todo_items=items)))
+        return account
+    fromStorage = classmethod(fromStorage)
+
+
+class FakeBasecamp(object):
+    """Stand-in for basecamp.api.Basecamp working with the account
+
+    Each call waits for latency seconds and fails with IOError with
+    the given probability. calls counts the calls of every method.
+    """
+
+    def __init__(self, account, latency=0.0, failures=0.0, seed=0):
+        self.account = account
+        self.latency = latency
+        self.failures = failures
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def _call(self, method):
+        if self.latency:
+            time.sleep(self.latency)
+        self.lock.acquire()
+        try:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            if self.failures and self.random.random() < self.failures:
+                raise IOError, 'Injected failure of %s' % method
+        finally:
+            self.lock.release()
+
+    def getAuthenticatedPerson(self):
+        self._call('getAuthenticatedPerson')
+        return Record(id=self.account.person_id)
+
+    def getProjects(self):
+        self._call('getProjects')
+        return list(self.account.projects)
+
+    def getTodoLists(self):
+        self._call('getTodoLists')
+        return list(self.account.todolists)
+
+    def getTodoListsForProject(self, project_id):
+        self._call('getTodoListsForProject')
+        return [todolist for todolist in self.account.todolists
+                if todolist.project_id == project_id]
+
+    def getEntriesForTodoItem(self, todo_id):
+        self._call('getEntriesForTodoItem')
+        return list(self.account.byTodo.get(todo_id, ()))
+
+    def getEntriesForProject(self, project_id, page=1):
+        """Return the page of time entries of the project, pages are
+        numbered from 1 and have ENTRIES_PAGE entries like basecamp's
+        """
+        self._call('getEntriesForProject')
+        entries = [entry for entry in self.account.entries
+                   if entry.project_id == project_id]
+        start = (page - 1) * ENTRIES_PAGE
+        return entries[start:start + ENTRIES_PAGE]
+
+    def createTimeEntryForProject(self, project_id, hours, date=None,
+                                  person_id=None, description=''):
+        self._call('createTimeEntryForProject')
+        return self.account.addEntry(project_id, None, hours, description)
+
+    def createTimeEntryForTodoItem(self, todo_id, hours, date=None,
+                                   person_id=None, description=''):
+        self._call('createTimeEntryForTodoItem')
+        return self.account.addEntry(None, todo_id, hours, description)
+
+    def createTodoItem(self, list_id, content, notify=True):
+        self._call('createTodoItem')
+        todo = self.account.register('todoitem', Record(
+            id=self.account.newId(), content=content, completed=False))
+        self.account.todolist(list_id).todo_items.append(todo)
+        return todo
+
+    def completeTodoItem(self, todo_id):
+        self._call('completeTodoItem')
+        self.account.todoItem(todo_id).completed = True
@@ -0,0 +1,407 @@
+"""Local fake basecamp server with latency and failure injection
+
+Usage: python benchmarks/fakeserver.py [--port=N] [--todos=N]
+                                       [--storage=PATH] [--changed=SHARE]
+                                       [--latency=MS] [--bandwidth=KBS]
+                                       [--errors=SHARE] [--rate-limit=N]
+                                       [--user=NAME --password=SECRET]
+
+Server speaks the part of Basecamp Classic XML API karm commands use,
+over HTTP/1.1 with keep-alive connections:
+
+    GET  /me.xml                                 authenticated person
+    GET  /projects.xml                           projects
+    GET  /todo_lists.xml                         todo lists with items
+    GET  /projects/<id>/todo_lists.xml           todo lists of project
+    GET  /projects/<id>/time_entries.xml?page=N  time entries of project
+    GET  /todo_items/<id>/time_entries.xml       time entries of todo item
+    POST /projects/<id>/time_entries.xml         create time entry
+    POST /todo_items/<id>/time_entries.xml       create time entry
+    POST /todo_lists/<id>/todo_items.xml         create todo item
+    PUT  /todo_items/<id>/complete.xml           complete todo item
+
+Time entries of project are returned the way basecamp returns them, in
+pages of 50 numbered from 1.
+
+Account is made of the given storage, or of synthetic one with the
+given number of todos (see fakebasecamp module), so that karm update
+and checkin run against that storage find their tasks there. Every
+request waits for latency, responses of all connections share the
+bandwidth, errors share of requests fails with 500 and requests above
+rate limit per second get 503 with Retry-After header, the way
+basecamp throttles API clients. Other requests are logged to stderr
+with 404 response.
+
+Point karm at it with the url printed on start:
+
+    python benchmarks/fakeserver.py --storage=karm.ics --latency=100 &
+    karmcmd -U http://127.0.0.1:8081 -u user -p secret -s karm.ics up -t
+
+Server could also be started in-process with serve().
+"""
+import re
+import cgi
+import sys
+import time
+import base64
+import random
+import tempfile
+import threading
+import BaseHTTPServer
+import SocketServer
+from xml.dom import minidom
+from xml.sax.saxutils import escape
+from optparse import OptionParser
+
+from fakebasecamp import Account, FakeBasecamp
+
+class Limiter(object):
+    """Shared limits of the server: bandwidth in bytes per second and
+    rate of requests per second, None means unlimited
+    """
+
+    def __init__(self, bandwidth=None, rate=None):
+        self.bandwidth = bandwidth
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.free = time.time()
+        self.tokens = rate or 0
+        self.filled = time.time()
+
+    def send(self, size):
+        """Wait until size bytes could be sent
+        """
+        if not self.bandwidth:
+            return
+        self.lock.acquire()
+        try:
+            now = time.time()
+            self.free = max(self.free, now) + float(size) / self.bandwidth
+            delay = self.free - now
+        finally:
+            self.lock.release()
+        time.sleep(delay)
+
+    def allow(self):
+        """Return True if one more request could be answered now
+        """
+        if not self.rate:
+            return True
+        self.lock.acquire()
+        try:
+            now = time.time()
+            self.tokens = min(self.rate,
+                              self.tokens + (now - self.filled) * self.rate)
+            self.filled = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+        finally:
+            self.lock.release()
+
+
+def element(name, value):
+    """Return XML element of basecamp's typed value
+    """
+    if value is None:
+        return '<%s nil="true"></%s>' % (name, name)
+    if isinstance(value, bool):
+        return '<%s type="boolean">%s</%s>' % (name, str(value).lower(),
+                                               name)
+    if isinstance(value, (int, long)):
+        return '<%s type="integer">%d</%s>' % (name, value, name)
+    if isinstance(value, float):
+        return '<%s type="float">%s</%s>' % (name, value, name)
+    return '<%s>%s</%s>' % (name, escape(unicode(value).encode('utf-8')),
+                            name)
+
+def record(name, record, fields):
+    return '<%s>%s</%s>' % (name, ''.join([
+        element(field.replace('_', '-'), getattr(record, field, None))
+        for field in fields]), name)
+
+def array(name, items):
+    return '<%s type="array">%s</%s>' % (name, ''.join(items), name)
+
+def project(project):
+    return record('project', project, ('id', 'name', 'last_changed_on'))
+
+def todoItem(todo):
+    return record('todo-item', todo, ('id', 'content', 'completed'))
+
+def todoList(todolist):
+    fields = record('todo-list', todolist, ('id', 'name', 'project_id'))
+    return fields[:-len('</todo-list>')] + \
+        array('todo-items', map(todoItem, todolist.todo_items)) + \
+        '</todo-list>'
+
+def timeEntry(entry):
+    return record('time-entry', entry, ('id', 'project_id', 'todo_item_id',
+                                        'hours', 'description'))
+
+def fields(body):
+    """Return name -> text map of the elements of posted XML record
+    """
+    values = {}
+    document = minidom.parseString(body)
+    for node in document.documentElement.childNodes:
+        if node.nodeType == node.ELEMENT_NODE:
+            values[node.tagName] = ''.join([child.data
+                                            for child in node.childNodes
+                                            if child.nodeType ==
+                                               child.TEXT_NODE])
+    return values
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+
+    def _authorized(self):
+        server = self.server
+        if server.credentials is None:
+            return True
+        header = self.headers.getheader('authorization') or ''
+        if not header.lower().startswith('basic '):
+            return False
+        try:
+            return base64.b64decode(header[6:].strip()) == server.credentials
+        except TypeError:
+            return False
+
+    def _respond(self, status, body='', headers={}):
+        self.send_response(status)
+        if body:
+            self.send_header('Content-Type', 'application/xml')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.server.limiter.send(len(body))
+        self.wfile.write(body)
+
+    def _handle(self, method):
+        server = self.server
+        server.count(method, self.path)
+        # body is read anyway, so that connection could be kept alive
+        body = ''
+        length = int(self.headers.getheader('content-length') or 0)
+        if length:
+            body = self.rfile.read(length)
+        if server.latency:
+            time.sleep(server.latency)
+        if not server.limiter.allow():
+            self._respond(503, headers={'Retry-After': '1'})
+            return
+        if not self._authorized():
+            self._respond(401, headers={'WWW-Authenticate':
+                                        'Basic realm="Basecamp"'})
+            return
+        if server.errors and server.random.random() < server.errors:
+            self._respond(500)
+            return
+        path = self.path.split('?', 1)[0]
+        for route, name in ROUTES:
+            match = route.match(method + ' ' + path)
+            if match is not None:
+                try:
+                    getattr(self, name)(body, *map(int, match.groups()))
+                except KeyError:
+                    self._respond(404)
+                return
+        self.log_message('Unknown request: %s %s', method, self.path)
+        self._respond(404)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def me(self, body):
+        self._respond(200, record('person',
+            self.server.client.getAuthenticatedPerson(), ('id',)))
+
+    def projects(self, body):
+        self._respond(200, array('projects',
+            map(project, self.server.client.getProjects())))
+
+    def todoLists(self, body):
+        self._respond(200, array('todo-lists',
+            map(todoList, self.server.client.getTodoLists())))
+
+    def projectTodoLists(self, body, project_id):
+        self.server.account.project(project_id)
+        self._respond(200, array('todo-lists', map(todoList,
+            self.server.client.getTodoListsForProject(project_id))))
+
+    def projectEntries(self, body, project_id):
+        self.server.account.project(project_id)
+        query = cgi.parse_qs(self.path.partition('?')[2])
+        try:
+            page = max(int(query.get('page', ['1'])[0]), 1)
+        except ValueError:
+            page = 1
+        self._respond(200, array('time-entries', map(timeEntry,
+            self.server.client.getEntriesForProject(project_id, page))))
+
+    def todoEntries(self, body, todo_id):
+        self.server.account.todoItem(todo_id)
+        self._respond(200, array('time-entries', map(timeEntry,
+            self.server.client.getEntriesForTodoItem(todo_id))))
+
+    def _created(self, location, body):
+        self._respond(201, body, {'Location': location})
+
+    def createProjectEntry(self, body, project_id):
+        self.server.account.project(project_id)
+        values = fields(body)
+        entry = self.server.client.createTimeEntryForProject(project_id,
+            values.get('hours', 0), description=values.get('description', ''))
+        self._created('/time_entries/%d.xml' % entry.id, timeEntry(entry))
+
+    def createTodoEntry(self, body, todo_id):
+        self.server.account.todoItem(todo_id)
+        values = fields(body)
+        entry = self.server.client.createTimeEntryForTodoItem(todo_id,
+            values.get('hours', 0), description=values.get('description', ''))
+        self._created('/time_entries/%d.xml' % entry.id, timeEntry(entry))
+
+    def createTodoItem(self, body, list_id):
+        self.server.account.todolist(list_id)
+        todo = self.server.client.createTodoItem(list_id,
+                                                 fields(body).get('content'))
+        self._created('/todo_items/%d.xml' % todo.id, todoItem(todo))
+
+    def completeTodoItem(self, body, todo_id):
+        self.server.client.completeTodoItem(todo_id)
+        self._respond(200)
+
+    def log_message(self, format, *args):
+        if self.server.verbose or format.startswith('Unknown'):
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format,
+                                                              *args)
+
+ROUTES = [(re.compile('^%s$' % pattern), name) for pattern, name in (
+    (r'GET /me\.xml', 'me'),
+    (r'GET /projects\.xml', 'projects'),
+    (r'GET /todo_lists\.xml', 'todoLists'),
+    (r'GET /projects/(\d+)/todo_lists\.xml', 'projectTodoLists'),
+    (r'GET /projects/(\d+)/time_entries\.xml', 'projectEntries'),
+    (r'GET /todo_items/(\d+)/time_entries\.xml', 'todoEntries'),
+    (r'POST /projects/(\d+)/time_entries\.xml', 'createProjectEntry'),
+    (r'POST /todo_items/(\d+)/time_entries\.xml', 'createTodoEntry'),
+    (r'POST /todo_lists/(\d+)/todo_items\.xml', 'createTodoItem'),
+    (r'PUT /todo_items/(\d+)/complete\.xml', 'completeTodoItem'),
+)]
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Fake basecamp serving the account
+
+    requests counts requests of every method and path pattern.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, account, latency=0.0, bandwidth=None,
+                 errors=0.0, rate=None, credentials=None, seed=0,
+                 verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+        self.account = account
+        self.client = FakeBasecamp(account)
+        self.latency = latency
+        self.limiter = Limiter(bandwidth, rate)
+        self.errors = errors
+        self.random = random.Random(seed)
+        self.credentials = credentials
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.requests = {}
+
+    def count(self, method, path):
+        key = method + ' ' + re.sub(r'\d+', '<id>', path.split('?', 1)[0])
+        self.lock.acquire()
+        try:
+            self.requests[key] = self.requests.get(key, 0) + 1
+        finally:
+            self.lock.release()
+
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+def serve(account, port=0, **kw):
+    """Start server for the account in a daemon thread and return it,
+    server.url() is the address to connect to, server.shutdown() stops
+    it and server.server_close() closes it's socket
+    """
+    server = Server(('127.0.0.1', port), account, **kw)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    return server
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--port', type='int', default=8081)
+    parser.add_option('--storage', default=None,
+                      help="make account of the given storage")
+    parser.add_option('--todos', type='int', default=10000,
+                      help="todos of synthetic storage without --storage")
+    parser.add_option('--changed', type='float', default=0.05,
+                      help="share of todo items changed in basecamp")
+    parser.add_option('--latency', type='float', default=0.0,
+                      help="latency of each request in milliseconds")
+    parser.add_option('--bandwidth', type='float', default=None,
+                      help="kilobytes per second sent to all clients")
+    parser.add_option('--errors', type='float', default=0.0,
+                      help="share of requests failed with 500")
+    parser.add_option('--rate-limit', type='float', default=None,
+                      help="requests per second answered before 503")
+    parser.add_option('--user', default=None)
+    parser.add_option('--password', default='')
+    parser.add_option('--verbose', action='store_true', default=False,
+                      help="log every request")
+    options, args = parser.parse_args()
+
+    from basecamp.karm import KArm
+    karm = KArm()
+    if options.storage:
+        karm.load(options.storage)
+    else:
+        from synthetic import writeStorage
+        f = tempfile.NamedTemporaryFile(suffix='.ics')
+        writeStorage(f.name, options.todos)
+        karm.load(f.name)
+        f.close()
+    account = Account.fromStorage(karm, options.changed)
+
+    credentials = None
+    if options.user is not None:
+        credentials = '%s:%s' % (options.user, options.password)
+    bandwidth = None
+    if options.bandwidth:
+        bandwidth = options.bandwidth * 1024
+    server = Server(('127.0.0.1', options.port), account,
+                    options.latency / 1000.0, bandwidth, options.errors,
+                    options.rate_limit, credentials,
+                    verbose=options.verbose)
+    print 'Fake basecamp with %d projects and %d todo lists at %s' % (
+        len(account.projects), len(account.todolists), server.url())
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    keys = server.requests.keys()
+    keys.sort()
+    for key in keys:
+        print '%6d %s' % (server.requests[key], key)
+
+if __name__ == '__main__':
+    main()
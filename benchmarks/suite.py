@@ -0,0 +1,247 @@
+"""Benchmark suite: time and peak memory of karm operations
+
+Usage: python benchmarks/suite.py [--sizes=N,N...] [--operations=NAME,...]
+                                  [--depth=N] [--entries=N] [--plain=SHARE]
+                                  [--save=PATH] [--baseline=PATH]
+                                  [--tolerance=SHARE]
+
+For every size synthetic storage is generated (see synthetic module)
+and every operation is run on it in a separate process, which reports
+its wall time and peak memory:
+
+    load         KArm.load with native reader
+    lazy         KArm.load of memory mapped storage
+    dump         KArm.dump of loaded storage into a new file
+    incremental  KArm.dump in place after a single todo has changed
+    update       Update.run merging basecamp account made of storage
+    checkin      CheckIn traversal, submission and storage update
+
+Commands talk to in-process FakeBasecamp (see fakebasecamp module), so
+the suite runs offline, and nothing is written outside of temporary
+directory. Results could be saved with --save and compared
+with saved ones with --baseline: operation which takes more time or
+memory than the baseline one by more than tolerance share is reported
+as a regression. Operation which fails is reported with it's error
+output. The suite exits with status 1 if there are regressions or
+failures. Timings are only comparable on the same machine.
+"""
+import os
+import sys
+import time
+import shutil
+import resource
+import tempfile
+import subprocess
+from optparse import OptionParser
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from basecamp.karm.tests.base import command
+
+from synthetic import writeStorage
+
+OPERATIONS = ('load', 'lazy', 'dump', 'incremental', 'update', 'checkin')
+
+def connectTo(client):
+    """Make karm commands use client instead of basecamp
+    """
+    from basecamp.karm import transport
+    transport.connect = lambda url, user, password, pool=None, cache=None: \
+        client
+
+def load(path, **kw):
+    from basecamp.karm import KArm
+    karm = KArm()
+    karm.load(path, **kw)
+    return karm
+
+def prepare(operation, path):
+    """Return function running the operation on the storage at path,
+    the time spent here is not measured
+    """
+    if operation == 'load':
+        return lambda: load(path)
+    if operation == 'lazy':
+        return lambda: load(path, lazy=True)
+    if operation == 'dump':
+        karm = load(path)
+        return lambda: karm.dump(path + '.dump')
+    if operation == 'incremental':
+        karm = load(path)
+        karm.dump()
+        todo = karm._index.values()[len(karm._index) / 2]
+        def dump():
+            todo.x_kde_ktimetracker_totalsessiontime = \
+                (todo.x_kde_ktimetracker_totalsessiontime or 0) + 1
+            karm.dump()
+        return dump
+    from fakebasecamp import Account, FakeBasecamp
+    client = FakeBasecamp(Account.fromStorage(load(path), changed=0.05))
+    connectTo(client)
+    if operation == 'update':
+        from basecamp.karm.command.update import Update
+        update = command(Update, path)
+        update.update_time = update.bulk_time = True
+        update.no_cache = True
+        # never the user's cache, should update use it
+        update.cache_dir = os.path.join(os.path.dirname(path), 'cache')
+        update.full = True
+        return update.run
+    if operation == 'checkin':
+        from basecamp.karm.command.checkin import CheckIn
+        from basecamp.karm.outbox import Outbox
+        checkin = command(CheckIn, path)
+        def run():
+            karm = load(path)
+            operations = checkin.collect(karm, 1, ask=False)
+            outbox = Outbox(path + '.outbox')
+            outbox.create(operations)
+            checkin.submit(outbox, operations)
+            outbox.remove()
+            if checkin.updateStorage(karm, operations):
+                karm.dump()
+        return run
+    raise ValueError, 'Unknown operation: %s' % operation
+
+def measure(operation, path):
+    """Run the operation and print JSON result
+    """
+    try:
+        run = prepare(operation, path)
+    except ImportError, e:
+        print json.dumps({'skipped': str(e)})
+        return
+    start = time.time()
+    run()
+    elapsed = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print json.dumps({'seconds': elapsed, 'peak': peak})
+
+def runOperation(operation, path):
+    """Run the operation in a separate process on the copy of storage,
+    return it's result
+    """
+    copy = path + '.' + operation
+    shutil.copy(path, copy)
+    try:
+        process = subprocess.Popen([sys.executable, __file__,
+                                    '--measure', operation, copy],
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        output, errors = process.communicate()
+    finally:
+        for name in (copy, copy + '.dump', copy + '.outbox'):
+            if os.path.exists(name):
+                os.remove(name)
+    if process.returncode == 0:
+        try:
+            return json.loads(output.strip().splitlines()[-1])
+        except (ValueError, IndexError):
+            pass
+    return {'failed': errors.strip() or
+                      'exit status %d' % process.returncode}
+
+def compare(result, baseline, tolerance):
+    """Return text comparing result with baseline one and whether it's
+    a regression
+    """
+    if baseline is None or not baseline.has_key('seconds'):
+        return '', False
+    seconds = result['seconds'] / max(baseline['seconds'], 1e-6)
+    peak = float(result['peak']) / max(baseline['peak'], 1)
+    # differences of few milliseconds are noise
+    regression = (seconds > 1 + tolerance and
+                  result['seconds'] - baseline['seconds'] > 0.01) or \
+                 peak > 1 + tolerance
+    text = '  %5.2fx time %5.2fx memory' % (seconds, peak)
+    if regression:
+        text += '  REGRESSION'
+    return text, regression
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--sizes', default='1000,10000,100000',
+                      help="comma separated numbers of todos")
+    parser.add_option('--operations', default=','.join(OPERATIONS))
+    parser.add_option('--depth', type='int', default=1,
+                      help="levels of tasks nested into todo items")
+    parser.add_option('--entries', type='int', default=2,
+                      help="fan-out of time entries and their nested tasks")
+    parser.add_option('--plain', type='float', default=0.0,
+                      help="share of tasks without basecamp type")
+    parser.add_option('--save', default=None,
+                      help="save results to the given JSON file")
+    parser.add_option('--baseline', default=None,
+                      help="compare results with the saved ones")
+    parser.add_option('--tolerance', type='float', default=0.25,
+                      help="allowed share of time and memory increase")
+    parser.add_option('--measure', choices=OPERATIONS,
+                      help="internal: measure one operation and exit")
+    options, args = parser.parse_args()
+
+    if options.measure:
+        measure(options.measure, args[0])
+        return
+
+    sizes = [int(size) for size in options.sizes.split(',')]
+    operations = options.operations.split(',')
+    for operation in operations:
+        if operation not in OPERATIONS:
+            parser.error("unknown operation: %s" % operation)
+    baseline = {}
+    if options.baseline:
+        f = open(options.baseline, 'rb')
+        try:
+            baseline = json.load(f)['results']
+        finally:
+            f.close()
+
+    results = {}
+    regressions = failures = 0
+    directory = tempfile.mkdtemp()
+    try:
+        for size in sizes:
+            path = os.path.join(directory, 'karm.ics')
+            writeStorage(path, size, depth=options.depth,
+                         entries=options.entries, plain=options.plain)
+            for operation in operations:
+                key = '%s %d' % (operation, size)
+                result = results[key] = runOperation(operation, path)
+                if result.has_key('skipped'):
+                    print '%-12s %8d  skipped: %s' % (operation, size,
+                                                       result['skipped'])
+                    continue
+                if result.has_key('failed'):
+                    failures += 1
+                    print '%-12s %8d  FAILED' % (operation, size)
+                    print result['failed']
+                    continue
+                text, regression = compare(result, baseline.get(key),
+                                           options.tolerance)
+                regressions += regression
+                print '%-12s %8d  %8.3fs  %8d kB%s' % (
+                    operation, size, result['seconds'], result['peak'], text)
+    finally:
+        shutil.rmtree(directory)
+
+    if options.save:
+        f = open(options.save, 'wb')
+        try:
+            json.dump({'options': {'depth': options.depth,
+                                   'entries': options.entries,
+                                   'plain': options.plain},
+                       'results': results}, f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+    if failures:
+        print '%d operations failed' % failures
+    if regressions:
+        print '%d regressions' % regressions
+    if failures or regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
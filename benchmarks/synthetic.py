@@ -0,0 +1,148 @@
+"""Synthetic KTimeTracker storages for benchmarks
+
+Generated files look like the ones KTimeTracker writes after karm
+checkout: projects with todo lists, todo items and time entries
+nested into todo items. Run as a script it writes such storage to the
+given path.
+"""
+import random
+from optparse import OptionParser
+
+HEADER = ("BEGIN:VCALENDAR\r\n"
+          "PRODID:-//K Desktop Environment//NONSGML KTimeTracker 4.2.0//EN\r\n"
+          "VERSION:2.0\r\n")
+FOOTER = "END:VCALENDAR\r\n"
+
+WORDS = ("fix", "layout", "review", "deploy", "client", "meeting",
+         "invoice", "migration", "search", "portlet", "theme", "caching",
+         "\xc3\xbcbersicht", "r\xc3\xa9sum\xc3\xa9", "notes\\, misc")
+
+def fold(line):
+    """Fold content line the way KTimeTracker does
+    """
+    out = []
+    while len(line) > 75:
+        out.append(line[:75])
+        line = ' ' + line[75:]
+    out.append(line)
+    return '\r\n'.join(out) + '\r\n'
+
+def vtodo(uid, summary, bctype=None, related_to=None, session=0, total=0,
+          completed=False):
+    lines = ["BEGIN:VTODO",
+             "DTSTAMP:20090214T101500Z",
+             "CREATED:20090101T120000Z",
+             "UID:%s" % uid,
+             "LAST-MODIFIED:20090214T101500Z",
+             "SUMMARY:%s" % summary]
+    if related_to is not None:
+        lines.append("RELATED-TO:%s" % related_to)
+    if completed:
+        lines.append("COMPLETED:20090213T170000Z")
+        lines.append("PERCENT-COMPLETE:100")
+    if bctype is not None:
+        lines.append("X-KDE-ktimetracker-bctype:%s" % bctype)
+    lines.append("X-KDE-ktimetracker-totalSessionTime:%d" % session)
+    lines.append("X-KDE-ktimetracker-totalTaskTime:%d" % total)
+    lines.append("END:VTODO")
+    return ''.join([fold(line) for line in lines])
+
+def summary(rnd, words=4):
+    return ' '.join([rnd.choice(WORDS) for i in range(rnd.randint(1, words))])
+
+def generate(size, lists=10, items=20, entries=2, seed=0, depth=1,
+             plain=0.0):
+    """Yield VTODO components until there are size of them
+
+    Each project has lists todo lists, each list has items todo items
+    and each todo item has up to entries time entries. Time entries
+    could have up to entries nested tasks themselves, down to depth
+    levels below todo item. plain is the share of projects, todo lists
+    and todo items which have no basecamp type (personal tasks, time
+    entries of projects and todo items not yet created in basecamp).
+    """
+    rnd = random.Random(seed)
+    state = {'uid': 1000000, 'count': 0}
+
+    def bctype(name):
+        if plain and rnd.random() < plain:
+            return None
+        return name
+
+    def task(summary, bctype=None, related_to=None, session=0, total=0,
+             completed=False):
+        state['uid'] += 1
+        state['count'] += 1
+        return state['uid'], vtodo(state['uid'], summary, bctype, related_to,
+                                   session, total, completed)
+
+    def nested(parent, level):
+        for e in range(rnd.randint(0, entries)):
+            if state['count'] >= size:
+                return
+            uid, component = task(summary(rnd), None, parent,
+                                  rnd.randint(0, 60))
+            yield component
+            if level < depth:
+                for component in nested(uid, level + 1):
+                    yield component
+
+    while state['count'] < size:
+        project, component = task('Project ' + summary(rnd),
+                                  bctype('project'))
+        yield component
+        for l in range(lists):
+            if state['count'] >= size:
+                return
+            todolist, component = task(summary(rnd), bctype('todolist'),
+                                       project)
+            yield component
+            for i in range(items):
+                if state['count'] >= size:
+                    return
+                session = rnd.choice((0, 0, 0, 15, 90))
+                item, component = task(summary(rnd, 20), bctype('todoitem'),
+                                       todolist, session,
+                                       session + rnd.randint(0, 600),
+                                       rnd.random() < 0.1)
+                yield component
+                for component in nested(item, 1):
+                    yield component
+
+def writeStorage(path, size, **kw):
+    """Write synthetic storage with size todos to path
+    """
+    f = open(path, 'wb')
+    try:
+        f.write(HEADER)
+        for component in generate(size, **kw):
+            f.write(component)
+        f.write(FOOTER)
+    finally:
+        f.close()
+
+def main():
+    parser = OptionParser(usage="python benchmarks/synthetic.py [options] "
+                          "PATH")
+    parser.add_option('--todos', type='int', default=10000)
+    parser.add_option('--lists', type='int', default=10,
+                      help="todo lists in each project")
+    parser.add_option('--items', type='int', default=20,
+                      help="todo items in each todo list")
+    parser.add_option('--entries', type='int', default=2,
+                      help="fan-out of time entries and their nested tasks")
+    parser.add_option('--depth', type='int', default=1,
+                      help="levels of tasks nested into todo items")
+    parser.add_option('--plain', type='float', default=0.0,
+                      help="share of tasks without basecamp type")
+    parser.add_option('--seed', type='int', default=0)
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("path of the storage is required")
+    writeStorage(args[0], options.todos, lists=options.lists,
+                 items=options.items, entries=options.entries,
+                 seed=options.seed, depth=options.depth,
+                 plain=options.plain)
+
+if __name__ == '__main__':
+    main()
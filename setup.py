@@ -22,6 +22,7 @@ setup(name='basecamp.karm',
       namespace_packages=['basecamp'],
       include_package_data=True,
       zip_safe=False,
+      test_suite='basecamp.karm.tests',
       install_requires=[
           'setuptools',
           'cmdhelper',